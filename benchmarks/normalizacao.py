@@ -0,0 +1,116 @@
+"""
+Microbenchmark da normalização usada na comparação da ETAPA 2.
+
+Mede o custo por registro da implementação anterior (re.sub sem padrão
+pré-compilado, formatar_cpf repetido a cada uso e comparar_campos decidindo
+a normalização valor a valor) e da atual (normalizar_registros_accounts por
+lote + comparar_normalizado com o registro já normalizado).
+
+Uso:
+    python benchmarks/normalizacao.py [quantidade_de_registros] [repeticoes]
+"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import formatar_cpf, normalizar_registros_accounts, calcular_divergencias
+
+CAMPOS_GESTAO = ['cpf_cnpj', 'name', 'email', 'phone']
+CAMPOS_CONTRATO = ['cpf_cnpj', 'nome', 'email']
+
+# --- IMPLEMENTAÇÃO ANTERIOR (referência) ---
+def limpar_cpf_anterior(cpf):
+    if not cpf: return None
+    return re.sub(r'\D', '', str(cpf))
+
+def formatar_cpf_anterior(cpf):
+    c = limpar_cpf_anterior(cpf)
+    if not c or len(c) != 11: return c
+    return f"{c[:3]}.{c[3:6]}.{c[6:9]}-{c[9:]}"
+
+def comparar_campos_anterior(dict1, dict2, campos):
+    divergencias = {}
+    for campo in campos:
+        val1 = dict1.get(campo)
+        val2 = dict2.get(campo)
+        if campo == 'cpf_cnpj' or campo == 'cpf':
+            val1 = limpar_cpf_anterior(val1)
+            val2 = limpar_cpf_anterior(val2)
+        elif isinstance(val1, str):
+            val1 = val1.strip() if val1 else None
+        if isinstance(val2, str):
+            val2 = val2.strip() if val2 else None
+        if val1 != val2:
+            divergencias[campo] = (val1, val2)
+    return divergencias
+
+def processar_anterior(accounts, gestao, contrato):
+    """Fluxo por registro do loop anterior: normaliza e formata o CPF a cada uso."""
+    for uuid, dados in accounts.items():
+        cpf = limpar_cpf_anterior(dados['cpf_cnpj'])
+        formatar_cpf_anterior(cpf)  # linha "✓ Accounts"
+        comparar_campos_anterior(
+            {'cpf_cnpj': cpf, 'name': dados['name'], 'email': dados['email'], 'phone': dados['phone']},
+            dict(gestao[uuid]), CAMPOS_GESTAO
+        )
+        formatar_cpf_anterior(cpf)  # cpf_depois (gestao)
+        comparar_campos_anterior(
+            {'cpf_cnpj': cpf, 'nome': dados['name'], 'email': dados['email']},
+            {'cpf_cnpj': contrato[uuid]['cpf_cnpj'], 'nome': contrato[uuid]['nome'], 'email': contrato[uuid]['email']},
+            CAMPOS_CONTRATO
+        )
+        formatar_cpf_anterior(cpf)  # cpf_depois (contrato)
+
+def processar_atual(accounts, gestao, contrato):
+    """Fluxo atual: normalização em lote, reaproveitada em todas as comparações."""
+    normalizados = normalizar_registros_accounts(accounts)
+    for uuid, normalizado in normalizados.items():
+        normalizado['cpf_formatado']
+        calcular_divergencias(normalizado, gestao[uuid], CAMPOS_GESTAO)
+        calcular_divergencias(normalizado, contrato[uuid], CAMPOS_CONTRATO)
+
+def gerar_dados(quantidade, semente=42):
+    """Gera registros sintéticos de accounts, tb_usuario e usuario (~20% divergentes)."""
+    aleatorio = random.Random(semente)
+    accounts, gestao, contrato = {}, {}, {}
+    for i in range(quantidade):
+        uuid = f'{i:032x}'
+        cpf = f'{aleatorio.randrange(10 ** 11):011d}'
+        accounts[uuid] = {'cpf_cnpj': formatar_cpf(cpf) if i % 3 else cpf, 'name': f'Nome {i} ',
+                          'email': f'u{i}@exemplo.com', 'phone': f'1199{i:07d}' if i % 4 else None}
+        divergente = aleatorio.random() < 0.2
+        gestao[uuid] = {'id': i, 'cpf_cnpj': '000' if divergente else cpf, 'name': f'Nome {i}',
+                        'email': f'u{i}@exemplo.com', 'phone': accounts[uuid]['phone']}
+        contrato[uuid] = {'id': i, 'cpf_cnpj': formatar_cpf(cpf), 'nome': f' Nome {i}',
+                          'email': 'antigo@exemplo.com' if divergente else f'u{i}@exemplo.com'}
+    return accounts, gestao, contrato
+
+def medir(funcao, dados, repeticoes):
+    """Menor tempo entre as repetições, em segundos."""
+    melhor = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(*dados)
+        duracao = time.perf_counter() - inicio
+        melhor = duracao if melhor is None else min(melhor, duracao)
+    return melhor
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeticoes = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    dados = gerar_dados(quantidade)
+    
+    anterior = medir(processar_anterior, dados, repeticoes)
+    atual = medir(processar_atual, dados, repeticoes)
+    
+    print(f"Registros: {quantidade} | melhor de {repeticoes} execução(ões)")
+    print(f"  Anterior: {anterior * 1e6 / quantidade:7.2f} µs/registro ({anterior:.3f}s)")
+    print(f"  Atual...: {atual * 1e6 / quantidade:7.2f} µs/registro ({atual:.3f}s)")
+    print(f"  Ganho...: {anterior / atual:.2f}x")
+
+if __name__ == '__main__':
+    main()
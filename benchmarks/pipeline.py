@@ -0,0 +1,223 @@
+"""
+Benchmark de ponta a ponta com uma base sintética em um Postgres local.
+
+Cria os bancos bench_ajuste_gestao e bench_ajuste_contrato (apagando-os se já
+existirem) com users, tb_usuario, usuario e segurado na escala pedida, sendo
+uma fração dos registros divergente de accounts. accounts.users fica no banco
+de gestão, e funções dblink* de mesmo nome executam o SQL "remoto" nesse mesmo
+banco. Gera relatorio_bench.xlsx com os UUIDs e roda main() em dois processos
+sem interação: 'plan' (ETAPAS 1 e 2) e 'apply' (ETAPAS 3 e 4). Para cada um,
+informa o tempo das etapas, os registros por segundo e o pico de RSS.
+
+O Postgres precisa aceitar conexões em 127.0.0.1: como a porta já está em uso,
+main() assume que o túnel SSH está ativo e conecta direto nela. As demais
+variáveis do script (TAMANHO_LOTE, WORKERS_PIPELINE, MOTOR_COMPARACAO...) são
+lidas do ambiente, como em uma execução normal.
+
+Uso:
+    python benchmarks/pipeline.py [escala: 10k, 100k, 1M ou número] [taxa_de_divergencia]
+
+Conexão (variáveis de ambiente): BENCH_PG_PORT (padrão 5432), BENCH_PG_USER
+(padrão postgres) e BENCH_PG_PASS.
+"""
+import contextlib
+import hashlib
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from uuid import UUID
+
+import psycopg2
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import main as executar_ajuste, METRICAS, EXPRESSAO_CPF_SEGURADO, INDICE_CPF_SEGURADO, formatar_bytes
+
+BANCO_GESTAO = 'bench_ajuste_gestao'
+BANCO_CONTRATO = 'bench_ajuste_contrato'
+NOME_CLIENTE = 'BENCH'
+ESCALAS = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+# Substitutos da extensão dblink: a "conexão" é só um nome guardado na sessão
+SQL_GESTAO = """
+    CREATE TABLE users (id uuid PRIMARY KEY, cpf_cnpj varchar, name varchar, email varchar, phone varchar);
+    CREATE TABLE tb_usuario (id serial PRIMARY KEY, sso_id uuid, cpf_cnpj varchar, name varchar,
+                             email varchar, phone varchar, updated_at timestamp);
+    CREATE FUNCTION dblink_get_connections() RETURNS text[] LANGUAGE sql AS
+        $$ SELECT string_to_array(NULLIF(current_setting('bench.dblink', true), ''), ',') $$;
+    CREATE FUNCTION dblink_connect(text, text) RETURNS text LANGUAGE plpgsql AS
+        $$ BEGIN PERFORM set_config('bench.dblink', $1, false); RETURN 'OK'; END $$;
+    CREATE FUNCTION dblink_disconnect(text) RETURNS text LANGUAGE plpgsql AS
+        $$ BEGIN PERFORM set_config('bench.dblink', '', false); RETURN 'OK'; END $$;
+    CREATE FUNCTION dblink(text, text) RETURNS SETOF record LANGUAGE plpgsql AS
+        $$ BEGIN RETURN QUERY EXECUTE $2; END $$;
+    SELECT setseed(0.42);
+    INSERT INTO users
+    SELECT md5(i::text)::uuid, lpad(i::text, 11, '0'), 'Nome ' || i, 'u' || i || '@exemplo.com', '1199' || lpad(i::text, 7, '0')
+    FROM generate_series(1, %(quantidade)s) i;
+    INSERT INTO tb_usuario (sso_id, cpf_cnpj, name, email, phone)
+    SELECT md5(i::text)::uuid,
+           CASE WHEN divergente AND i %% 3 = 0 THEN '000' ELSE lpad(i::text, 11, '0') END,
+           CASE WHEN divergente AND i %% 3 = 1 THEN 'Nome antigo ' || i ELSE 'Nome ' || i END,
+           CASE WHEN divergente AND i %% 3 = 2 THEN 'antigo' || i || '@exemplo.com' ELSE 'u' || i || '@exemplo.com' END,
+           '1199' || lpad(i::text, 7, '0')
+    FROM (SELECT i, random() < %(taxa)s AS divergente FROM generate_series(1, %(quantidade)s) i) s;
+    CREATE INDEX ON tb_usuario (sso_id);
+    ANALYZE;
+"""
+
+SQL_CONTRATO = f"""
+    CREATE TABLE usuario (id serial PRIMARY KEY, sso_id varchar, cpf_cnpj varchar, nome varchar,
+                          email varchar, updated_at timestamp);
+    CREATE TABLE segurado (id serial PRIMARY KEY, cpf_cnpj varchar, usuario_id int, nome varchar, updated_at timestamp);
+    SELECT setseed(0.24);
+    INSERT INTO usuario (sso_id, cpf_cnpj, nome, email)
+    SELECT md5(i::text)::uuid::text,
+           CASE WHEN divergente AND i %% 2 = 0 THEN '000' ELSE lpad(i::text, 11, '0') END,
+           'Nome ' || i,
+           CASE WHEN divergente AND i %% 2 = 1 THEN 'antigo' || i || '@exemplo.com' ELSE 'u' || i || '@exemplo.com' END
+    FROM (SELECT i, random() < %(taxa)s AS divergente FROM generate_series(1, %(quantidade)s) i) s;
+    -- Um segurado correto por usuário (usuario.id = i) e, para uma fração, outro com CPF de terceiro
+    INSERT INTO segurado (cpf_cnpj, usuario_id, nome)
+    SELECT regexp_replace(lpad(i::text, 11, '0'), '(...)(...)(...)(..)', '\\1.\\2.\\3-\\4'), i, 'Segurado ' || i
+    FROM generate_series(1, %(quantidade)s) i;
+    INSERT INTO segurado (cpf_cnpj, usuario_id, nome)
+    SELECT '999.999.999-99', i, 'Segurado divergente ' || i
+    FROM generate_series(1, %(quantidade)s) i WHERE random() < %(taxa)s;
+    CREATE INDEX ON usuario (sso_id);
+    CREATE INDEX ON segurado (usuario_id);
+    CREATE INDEX {INDICE_CPF_SEGURADO} ON segurado (({EXPRESSAO_CPF_SEGURADO.replace('%', '%%')}));
+    ANALYZE;
+"""
+
+def parametros_conexao(banco='postgres'):
+    """Conexão com o Postgres local do benchmark (BENCH_PG_*)."""
+    return {
+        'host': '127.0.0.1',
+        'port': int(os.getenv('BENCH_PG_PORT', '5432')),
+        'user': os.getenv('BENCH_PG_USER', 'postgres'),
+        'password': os.getenv('BENCH_PG_PASS', ''),
+        'database': banco
+    }
+
+def ler_escala(texto):
+    """'10k', '100k', '1M' ou um número de registros."""
+    return ESCALAS.get(texto.lower()) or int(texto)
+
+def uuid_registro(i):
+    """Mesmo UUID gerado no banco por md5(i::text)::uuid."""
+    return str(UUID(hashlib.md5(str(i).encode()).hexdigest()))
+
+def carregar_base_sintetica(quantidade, taxa):
+    """Recria os bancos de gestão e contrato com a base sintética."""
+    conn = psycopg2.connect(**parametros_conexao())
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        for banco in (BANCO_GESTAO, BANCO_CONTRATO):
+            cur.execute(f"DROP DATABASE IF EXISTS {banco}")
+            cur.execute(f"CREATE DATABASE {banco} ENCODING 'UTF8' TEMPLATE template0")
+    finally:
+        conn.close()
+
+    for banco, sql in ((BANCO_GESTAO, SQL_GESTAO), (BANCO_CONTRATO, SQL_CONTRATO)):
+        conn = psycopg2.connect(**parametros_conexao(banco))
+        try:
+            conn.cursor().execute(sql, {'quantidade': quantidade, 'taxa': taxa})
+            conn.commit()
+        finally:
+            conn.close()
+
+def gerar_relatorio(caminho, quantidade):
+    """relatorio_bench.xlsx no formato do script de análise (aba '1-Emails Duplicados')."""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('1-Emails Duplicados')
+    ws.append(['email', 'uuid_comum'])
+    for i in range(1, quantidade + 1):
+        ws.append([f'u{i}@exemplo.com', uuid_registro(i)])
+    wb.save(caminho)
+
+def pico_rss_bytes():
+    """Pico de memória residente do processo, ou None onde resource não existe (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss vem em KB no Linux e em bytes no macOS
+    return pico if sys.platform == 'darwin' else pico * 1024
+
+def executar_modo(diretorio, ambiente, modo):
+    """
+    Roda main(modo) neste processo, com a saída em <modo>.log no diretório do benchmark.
+    Retorna (resumo, {etapa: segundos}, pico de RSS em bytes).
+    """
+    os.chdir(diretorio)
+    os.environ.update(ambiente)
+    with open(os.path.join(diretorio, f'{modo}.log'), 'w', encoding='utf-8') as log, open(os.devnull) as entrada_vazia:
+        sys.stdin = entrada_vazia
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            resumo = executar_ajuste(modo) or {}
+    return resumo, dict(METRICAS.etapas), pico_rss_bytes()
+
+def main():
+    quantidade = ler_escala(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    taxa = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    conexao = parametros_conexao()
+
+    diretorio = tempfile.mkdtemp(prefix='bench_ajuste_')
+    ambiente = {
+        'NOME_CLIENTE': NOME_CLIENTE,
+        'DB_HOST': conexao['host'],
+        'DB_GESTAO_NAME': BANCO_GESTAO, 'DB_GESTAO_USER': conexao['user'], 'DB_GESTAO_PASS': conexao['password'],
+        'DB_CONTRATO_NAME': BANCO_CONTRATO, 'DB_CONTRATO_USER': conexao['user'], 'DB_CONTRATO_PASS': conexao['password'],
+        'URL_ACCOUNTS': 'bench', 'DB_ACCOUNTS_NAME_USER': 'bench', 'DB_ACCOUNTS_PASS': 'bench',
+        # Porta do Postgres local no lugar do túnel: main() a encontra em uso e não abre o SSH
+        'SSH_HOST': 'bench', 'SSH_USER': 'bench', 'SSH_LOCAL_PORT': str(conexao['port']),
+        'ARQUIVO_RELATORIO': '', 'LIMITE_REGISTROS': '0', 'CRIAR_INDICE_CPF_SEGURADO': 'N',
+        'REUTILIZAR_PLANO': 'N', 'CONFIRMAR_UPDATES': 'S', 'METRICAS_JSON': 'S'
+    }
+
+    print(f"Base sintética: {quantidade} registro(s), {taxa:.0%} de divergência")
+    inicio = time.perf_counter()
+    carregar_base_sintetica(quantidade, taxa)
+    print(f"  Carga no Postgres.....: {time.perf_counter() - inicio:.1f}s ({BANCO_GESTAO}, {BANCO_CONTRATO})")
+
+    inicio = time.perf_counter()
+    gerar_relatorio(os.path.join(diretorio, f'relatorio_{NOME_CLIENTE.lower()}.xlsx'), quantidade)
+    print(f"  Relatório de entrada..: {time.perf_counter() - inicio:.1f}s")
+
+    # Cada modo em um processo novo (spawn), para que o pico de RSS seja só o dele
+    contexto = multiprocessing.get_context('spawn')
+    resultados = {}
+    for modo in ('plan', 'apply'):
+        with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as executor:
+            resultados[modo] = executor.submit(executar_modo, diretorio, ambiente, modo).result()
+        status = resultados[modo][0].get('status')
+        if modo == 'plan' and status != 'PLANO GERADO':
+            print(f"❌ plan terminou com status {status!r} - veja {os.path.join(diretorio, 'plan.log')}")
+            sys.exit(1)
+
+    resumo_plan, etapas_plan, pico_plan = resultados['plan']
+    resumo_apply, etapas_apply, pico_apply = resultados['apply']
+    acoes = resumo_plan['updates_gestao'] + resumo_plan['updates_contrato'] + resumo_plan['desvinculacoes']
+    analise = etapas_plan.get('ETAPA 2 - Análise', 0.0)
+    execucao = etapas_apply.get('ETAPA 3 - Execução dos UPDATEs', 0.0)
+    relatorio = etapas_apply.get('ETAPA 4 - Relatório', 0.0)
+
+    print(f"\nAções planejadas: gestao={resumo_plan['updates_gestao']} contrato={resumo_plan['updates_contrato']} "
+          f"desvinculações={resumo_plan['desvinculacoes']} ignorados={resumo_plan['ignorados']} erros={resumo_plan['erros']}")
+    print(f"  plan  | ETAPA 2 (análise)..: {analise:7.1f}s | {resumo_plan['processados'] / analise if analise else 0:9.0f} registros/s")
+    print(f"  apply | ETAPA 3 (execução).: {execucao:7.1f}s | {acoes / execucao if execucao else 0:9.0f} ações/s "
+          f"({resumo_apply.get('status')}, {resumo_apply.get('erros_execucao', 0)} erro(s))")
+    print(f"  apply | ETAPA 4 (relatório): {relatorio:7.1f}s")
+    if pico_plan is not None:
+        print(f"  Pico de RSS: plan {formatar_bytes(pico_plan)} | apply {formatar_bytes(pico_apply)}")
+    print(f"\nLogs (plan.log, apply.log), relatórios e métricas do apply: {diretorio}")
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
 import csv
 import re
 import os
@@ -7,11 +7,19 @@ import sys
 import subprocess
 import time
 import socket
-from dotenv import load_dotenv
+import struct
+import tempfile
+import json
+import hashlib
+import sqlite3
+import queue
+import threading
+from itertools import islice, chain
+from collections import OrderedDict
+from uuid import UUID
 from contextlib import contextmanager
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Font, PatternFill, Alignment
-from openpyxl.utils import get_column_letter
+# openpyxl, psycopg2.extras e python-dotenv são importados nas funções que os usam:
+# importar este módulo não carrega nada pesado nem lê configuração
 
 # ============================================
 #             SELEÇÃO DE CLIENTE
@@ -82,10 +90,6 @@ def exibir_menu_clientes():
             print("\n\n⚠️  Operação cancelada.\n")
             sys.exit(0)
 
-# Seleciona o cliente e carrega as variáveis de ambiente
-env_file, NOME_CLIENTE_SELECIONADO = exibir_menu_clientes()
-load_dotenv(env_file)
-
 # --- FUNÇÕES DE CONFIGURAÇÃO ---
 def carregar_configuracoes():
     """Carrega configurações do arquivo .env atual."""
@@ -124,296 +128,2670 @@ def carregar_configuracoes():
         'ssh_password': os.getenv('SSH_PASSWORD'),
         'ssh_pkey': os.getenv('SSH_PKEY_PATH'),
         'remote_bind_address': (os.getenv('SSH_REMOTE_DB_HOST', 'localhost'), int(os.getenv('SSH_REMOTE_DB_PORT', '5432'))),
-        'local_bind_port': int(os.getenv('SSH_LOCAL_PORT', '5435'))
+        'local_bind_port': int(os.getenv('SSH_LOCAL_PORT', '5435')),
+        # Conexão mestre reutilizável (ControlMaster): padrão S fora do Windows; variáveis vazias ficam com o padrão
+        'control_master': (os.getenv('SSH_CONTROL_MASTER', '').strip() or ('N' if os.name == 'nt' else 'S')).upper() == 'S',
+        'control_path': os.path.expanduser(os.getenv('SSH_CONTROL_PATH', '').strip() or '~/.ssh/ajuste-%C'),
+        'control_persist': int(os.getenv('SSH_CONTROL_PERSIST', '').strip() or '600')
+    }
+    
+    # Validação: túnel SSH é obrigatório
+    if not SSH_CONFIG['ssh_host'] or not SSH_CONFIG['ssh_user']:
+        raise ValueError("SSH_HOST e SSH_USER são obrigatórios no arquivo .env")
+    if SSH_CONFIG['control_master'] and os.name == 'nt':
+        raise ValueError("SSH_CONTROL_MASTER=S não é suportado no Windows (use N)")
+    
+    # Busca de CPF em segurado: coluna normalizada opcional e criação do índice (S/N/vazio = perguntar)
+    BUSCA_CPF_SEGURADO = {
+        'coluna_normalizada': os.getenv('COLUNA_CPF_SEGURADO', '').strip() or None,
+        'criar_indice': os.getenv('CRIAR_INDICE_CPF_SEGURADO', '').strip().upper()
+    }
+    
+    LIMITE_REGISTROS = int(os.getenv('LIMITE_REGISTROS', '0'))
+    # Quantidade de UUIDs buscados em accounts por chamada ao dblink
+    TAMANHO_LOTE = max(1, int(os.getenv('TAMANHO_LOTE', '5000')))
+    # Quantidade de linhas por comando UPDATE ... FROM (VALUES ...) na execução
+    TAMANHO_PAGINA_UPDATE = max(1, int(os.getenv('TAMANHO_PAGINA_UPDATE', '1000')))
+    # Quantidade aproximada de linhas alteradas entre um COMMIT e outro
+    COMMIT_A_CADA = max(1, int(os.getenv('COMMIT_A_CADA', '5000')))
+    # Threads (e conexões) por estágio do pipeline de análise
+    WORKERS_PIPELINE = max(1, int(os.getenv('WORKERS_PIPELINE', '1')))
+    # Onde accounts é comparado com tb_usuario/usuario: 'python' (padrão) ou 'sql' (no banco)
+    MOTOR_COMPARACAO = os.getenv('MOTOR_COMPARACAO', 'python').strip().lower()
+    if MOTOR_COMPARACAO not in ('python', 'sql'):
+        raise ValueError(f"MOTOR_COMPARACAO inválido: '{MOTOR_COMPARACAO}' (use python ou sql)")
+    # Modo incremental: pula UUIDs com accounts inalterado e já resolvidos na última execução
+    MODO_INCREMENTAL = os.getenv('MODO_INCREMENTAL', 'N').strip().upper() in ('S', 'SIM', 'Y', 'YES')
+    
+    # Cache local de accounts: LRU em memória e, com arquivo, SQLite em disco (TTL em segundos)
+    CACHE_ACCOUNTS = {
+        'ativo': os.getenv('CACHE_ACCOUNTS', 'N').strip().upper() in ('S', 'SIM', 'Y', 'YES'),
+        'max_memoria': max(1, int(os.getenv('CACHE_ACCOUNTS_MAX', '200000'))),
+        'ttl': max(0, int(os.getenv('CACHE_ACCOUNTS_TTL', '86400'))),
+        'arquivo': os.getenv('CACHE_ACCOUNTS_ARQUIVO', '').strip() or None,
+        'forcar_atualizacao': os.getenv('ATUALIZAR_CACHE_ACCOUNTS', 'N').strip().upper() in ('S', 'SIM', 'Y', 'YES')
+    }
+    
+    # Saída da análise: detalhado (linhas por registro), progresso (linha única) ou silencioso;
+    # LOG_ANALISE=S grava o detalhe por registro em analise_<cliente>.log
+    SAIDA_ANALISE = {
+        'verbosidade': os.getenv('VERBOSIDADE', 'detalhado').strip().lower(),
+        'log': os.getenv('LOG_ANALISE', 'N').strip().upper() in ('S', 'SIM', 'Y', 'YES')
+    }
+    if SAIDA_ANALISE['verbosidade'] not in VERBOSIDADES:
+        raise ValueError(f"VERBOSIDADE inválida: '{SAIDA_ANALISE['verbosidade']}' (use {', '.join(VERBOSIDADES)})")
+    
+    return DB_GESTAO, DB_CONTRATO, DB_PESSOA, SSH_CONFIG, SENHA_ACCOUNTS, URL_ACCOUNTS, DB_ACCOUNTS_NAME_USER, BUSCA_CPF_SEGURADO, LIMITE_REGISTROS, TAMANHO_LOTE, TAMANHO_PAGINA_UPDATE, COMMIT_A_CADA, WORKERS_PIPELINE, MOTOR_COMPARACAO, MODO_INCREMENTAL, CACHE_ACCOUNTS, SAIDA_ANALISE
+
+# --- FUNÇÕES AUXILIARES ---
+# Tabela de str.translate que remove os caracteres ASCII que não são dígitos
+_TABELA_SOMENTE_DIGITOS = {c: None for c in range(128) if not chr(c).isdigit()}
+_NAO_DIGITOS = re.compile(r'\D')
+
+def limpar_cpf(cpf):
+    """Remove caracteres não numéricos."""
+    if not cpf: return None
+    texto = cpf if isinstance(cpf, str) else str(cpf)
+    if texto.isdecimal():
+        return texto
+    if texto.isascii():
+        return texto.translate(_TABELA_SOMENTE_DIGITOS)
+    # Fora do ASCII, \D também preserva dígitos de outros alfabetos
+    return _NAO_DIGITOS.sub('', texto)
+
+def formatar_cpf(cpf):
+    """Aplica máscara de CPF."""
+    c = limpar_cpf(cpf)
+    if not c or len(c) != 11: return c
+    return f"{c[:3]}.{c[3:6]}.{c[6:9]}-{c[9:]}"
+
+def normalizar_uuid(valor):
+    """Retorna o UUID no formato canônico (minúsculo, com hífens) ou None se inválido."""
+    try:
+        return str(UUID(str(valor).strip()))
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+# --- NORMALIZAÇÃO PARA COMPARAÇÃO ---
+def normalizar_texto(valor):
+    """Texto sem espaços nas pontas; texto vazio vira None. Valores que não são texto ficam como estão."""
+    if isinstance(valor, str):
+        return valor.strip() if valor else None
+    return valor
+
+def normalizar_cpf_atual(valor):
+    """CPF do lado comparado (gestao/contrato): somente dígitos; sem dígitos vira None."""
+    return limpar_cpf(valor) or None
+
+# Normalizadores por campo: (valor de accounts, valor atual). Resolvidos uma vez
+# por campo, e não a cada valor; campos fora do dicionário são texto.
+NORMALIZADORES_CAMPO = {
+    'cpf_cnpj': (limpar_cpf, normalizar_cpf_atual),
+    'cpf': (limpar_cpf, normalizar_cpf_atual)
+}
+NORMALIZADORES_TEXTO = (normalizar_texto, normalizar_texto)
+
+def limpar_cpfs(valores):
+    """limpar_cpf em lote: normaliza uma coluna inteira de uma vez."""
+    return list(map(limpar_cpf, valores))
+
+def normalizar_textos(valores):
+    """normalizar_texto em lote: normaliza uma coluna inteira de uma vez."""
+    return list(map(normalizar_texto, valores))
+
+def normalizar_registros_accounts(accounts):
+    """
+    Normaliza, coluna a coluna, os registros de accounts de um lote ({uuid: dados}).
+    Retorna {uuid: registro normalizado} com os campos já no formato de comparação
+    (cpf_cnpj, name/nome, email, phone) e o CPF formatado, calculados uma única vez
+    por registro e reaproveitados em todas as comparações e no relatório.
+    """
+    chaves = list(accounts)
+    registros = [accounts[chave] for chave in chaves]
+    cpfs = limpar_cpfs(r['cpf_cnpj'] for r in registros)
+    nomes = normalizar_textos(r['name'] for r in registros)
+    emails = normalizar_textos(r['email'] for r in registros)
+    telefones = normalizar_textos(r['phone'] for r in registros)
+    
+    return {
+        chave: {'cpf_cnpj': cpf, 'cpf_formatado': formatar_cpf(cpf), 'name': nome, 'nome': nome, 'email': email, 'phone': telefone}
+        for chave, cpf, nome, email, telefone in zip(chaves, cpfs, nomes, emails, telefones)
+    }
+
+# Plano de comparação por lista de campos: [(campo, normalizador do valor atual)],
+# com None para campos de texto (normalizados direto no laço, sem chamada de função)
+_PLANOS_COMPARACAO = {}
+
+def plano_comparacao(campos):
+    """Resolve uma única vez o normalizador de cada campo da lista."""
+    chave = tuple(campos)
+    plano = _PLANOS_COMPARACAO.get(chave)
+    if plano is None:
+        plano = _PLANOS_COMPARACAO[chave] = [
+            (campo, NORMALIZADORES_CAMPO[campo][1] if campo in NORMALIZADORES_CAMPO else None)
+            for campo in chave
+        ]
+    return plano
+
+def comparar_normalizado(normalizado, dict2, campos):
+    """
+    Compara um registro de accounts já normalizado com os valores atuais (dict2).
+    Retorna dict com campos divergentes: {'campo': (valor_accounts, valor_atual)}
+    """
+    divergencias = {}
+    for campo, normalizar_atual in plano_comparacao(campos):
+        val2 = dict2.get(campo)
+        if normalizar_atual is not None:
+            val2 = normalizar_atual(val2)
+        elif isinstance(val2, str):
+            val2 = val2.strip() if val2 else None
+        val1 = normalizado[campo]
+        if val1 != val2:
+            divergencias[campo] = (val1, val2)
+    return divergencias
+
+def comparar_campos(dict1, dict2, campos):
+    """
+    Compara campos entre dois dicionários.
+    Retorna dict com campos divergentes: {'campo': (valor1, valor2)}
+    """
+    normalizado = {campo: NORMALIZADORES_CAMPO.get(campo, NORMALIZADORES_TEXTO)[0](dict1.get(campo)) for campo in campos}
+    return comparar_normalizado(normalizado, dict2, campos)
+
+# Nome da conexão dblink reutilizada durante toda a execução
+NOME_CONEXAO_DBLINK = 'ajuste_accounts'
+
+def verificar_porta_disponivel(port):
+    """Verifica se uma porta está disponível para uso."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(('127.0.0.1', port))
+        sock.close()
+        return True
+    except OSError:
+        return False
+
+# Pedido de SSL do protocolo do Postgres: o servidor responde com um único byte ('S' ou 'N')
+SSL_REQUEST_POSTGRES = struct.pack('!ii', 8, 80877103)
+
+def sondar_postgres(port, timeout=3):
+    """
+    Verifica se a porta local leva a um servidor Postgres: envia o pedido de SSL
+    e espera a resposta de um byte, sem autenticar. Uma porta que aceita a conexão
+    mas não chega ao banco (túnel cujo destino caiu, outro serviço) retorna False.
+    """
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=timeout) as sock:
+            sock.sendall(SSL_REQUEST_POSTGRES)
+            resposta = sock.recv(1)
+    except OSError:
+        return False
+    return resposta in (b'S', b'N')
+
+def aguardar_postgres(port, timeout=15, processo=None):
+    """
+    Aguarda a porta local responder como Postgres, com espera crescente entre as
+    tentativas (10 ms a 200 ms). Se o processo ssh informado terminar antes, desiste.
+    """
+    limite = time.monotonic() + timeout
+    espera = 0.01
+    while True:
+        if sondar_postgres(port):
+            return True
+        if processo is not None and processo.poll() is not None:
+            return False
+        if time.monotonic() + espera > limite:
+            return False
+        time.sleep(espera)
+        espera = min(espera * 2, 0.2)
+
+class TunelSSH:
+    """
+    Túnel SSH da porta local até o Postgres remoto.
+    
+    Com ControlMaster (padrão fora do Windows), uma conexão mestre por servidor
+    SSH fica ativa em segundo plano (ControlPersist) e é reaproveitada pelas
+    execuções seguintes e pelos outros clientes no mesmo servidor: cada execução
+    só pede o encaminhamento da sua porta (ssh -O forward) e o cancela ao final.
+    Sem ControlMaster, um processo `ssh -N -L` por execução.
+    
+    O túnel só é considerado pronto quando a porta responde como Postgres.
+    restaurar() refaz o túnel que caiu durante a execução (chamado pelo pool
+    de conexões antes de reconectar).
+    """
+    
+    def __init__(self, SSH_CONFIG):
+        self.config = SSH_CONFIG
+        self.porta = SSH_CONFIG['local_bind_port']
+        remote_host, remote_port = SSH_CONFIG['remote_bind_address']
+        self.encaminhamento = f"{self.porta}:{remote_host}:{remote_port}"
+        self.control_path = SSH_CONFIG['control_path'] if SSH_CONFIG['control_master'] else None
+        self.processo = None
+        self.encaminhamento_proprio = False
+        self.restauracoes = 0
+        self._trava = threading.Lock()
+    
+    def _comando(self, *argumentos):
+        comando = ['ssh', '-p', str(self.config['ssh_port']), '-l', self.config['ssh_user'],
+                   '-o', 'StrictHostKeyChecking=no', '-o', 'ServerAliveInterval=60', '-o', 'ServerAliveCountMax=3',
+                   '-o', 'ExitOnForwardFailure=yes']
+        if self.config['ssh_pkey']:
+            comando += ['-i', self.config['ssh_pkey']]
+        if self.control_path:
+            comando += ['-S', self.control_path]
+        return comando + list(argumentos) + [self.config['ssh_host']]
+    
+    def _executar_ssh(self, *argumentos, timeout=30):
+        """Executa um comando ssh curto; retorna (código de saída, stderr)."""
+        # stderr em arquivo: com -f, o ssh mestre continua em segundo plano com os descritores herdados
+        with tempfile.TemporaryFile() as erros:
+            resultado = subprocess.run(self._comando(*argumentos), stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.DEVNULL, stderr=erros, timeout=timeout)
+            erros.seek(0)
+            return resultado.returncode, erros.read().decode(errors='replace').strip()
+    
+    def _mestre_ativo(self):
+        return self._executar_ssh('-O', 'check')[0] == 0
+    
+    def _iniciar(self):
+        """Abre o encaminhamento da porta local (pelo ssh mestre ou por um processo próprio)."""
+        if self.control_path:
+            diretorio = os.path.dirname(self.control_path)
+            if diretorio:
+                os.makedirs(diretorio, mode=0o700, exist_ok=True)
+            import fcntl
+            # Trava entre processos (modo multicliente): só um deles abre a conexão mestre
+            with open(os.path.join(diretorio or '.', 'ajuste-ssh.lock'), 'w') as trava:
+                fcntl.flock(trava, fcntl.LOCK_EX)
+                if self._mestre_ativo():
+                    print("[SSH] Reutilizando a conexão mestre (ControlMaster) já ativa")
+                else:
+                    # -f: o comando retorna depois da autenticação, com o mestre em segundo plano
+                    codigo, erros = self._executar_ssh('-M', '-f', '-N', '-o', f"ControlPersist={self.config['control_persist']}",
+                                                      timeout=None)
+                    if codigo != 0:
+                        raise Exception(f"falha ao abrir a conexão mestre: {erros or f'ssh saiu com código {codigo}'}")
+            codigo, erros = self._executar_ssh('-O', 'forward', '-L', self.encaminhamento)
+            if codigo != 0:
+                raise Exception(f"falha ao encaminhar a porta {self.porta}: {erros or f'ssh saiu com código {codigo}'}")
+            self.encaminhamento_proprio = True
+            return
+        
+        self._encerrar_processo()
+        opcoes = {'stdout': subprocess.PIPE, 'stderr': subprocess.PIPE, 'stdin': subprocess.PIPE}
+        if os.name == 'nt':
+            opcoes['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            opcoes['preexec_fn'] = os.setsid
+        self.processo = subprocess.Popen(self._comando('-N', '-L', self.encaminhamento), **opcoes)
+    
+    def _aguardar(self, timeout=15):
+        if aguardar_postgres(self.porta, timeout, self.processo):
+            return
+        if self.processo is not None and self.processo.poll() is not None:
+            erros = self.processo.stderr.read().decode(errors='replace').strip()
+            raise Exception(f"ssh terminou com código {self.processo.returncode}: {erros}")
+        raise Exception("Timeout ao aguardar túnel SSH ficar ativo")
+    
+    def abrir(self):
+        """Abre o túnel ou reaproveita um listener da porta local que já chega ao Postgres."""
+        print(f"[SSH] Conectando ao servidor {self.config['ssh_host']}:{self.config['ssh_port']}...")
+        
+        if not verificar_porta_disponivel(self.porta):
+            if sondar_postgres(self.porta):
+                print(f"[SSH] Porta {self.porta} já em uso e respondendo como Postgres - reutilizando o túnel existente")
+                return
+            raise Exception(f"a porta {self.porta} já está em uso, mas não responde como Postgres "
+                            f"(túnel antigo sem destino ou outro serviço)")
+        
+        print(f"[SSH] Estabelecendo túnel: localhost:{self.encaminhamento}"
+              f"{' (ControlMaster)' if self.control_path else ''}")
+        if self.config['ssh_password'] and not self.config['ssh_pkey']:
+            print("[SSH] Nota: Para autenticação por senha, considere usar chave SSH.")
+        
+        inicio = time.monotonic()
+        self._iniciar()
+        self._aguardar()
+        print(f"[SSH] Túnel SSH estabelecido com sucesso! ({time.monotonic() - inicio:.2f}s)")
+    
+    def restaurar(self):
+        """
+        Verifica o túnel e, se ele caiu, abre de novo. Seguro para várias threads:
+        só uma refaz o túnel; as outras encontram a porta respondendo. Retorna True
+        se a porta chega ao Postgres ao final.
+        """
+        with self._trava:
+            if sondar_postgres(self.porta):
+                return True
+            if not verificar_porta_disponivel(self.porta) and self.processo is None and not self.control_path:
+                print(f"\n⚠️  [SSH] Porta {self.porta} não chega ao Postgres e o túnel não é deste processo - não é possível refazê-lo")
+                return False
+            print(f"\n⚠️  [SSH] Túnel da porta {self.porta} caiu - restabelecendo...")
+            try:
+                if self.control_path and self.encaminhamento_proprio:
+                    # Encaminhamento antigo (se o mestre ainda existir) é descartado antes do novo
+                    self._executar_ssh('-O', 'cancel', '-L', self.encaminhamento)
+                self._iniciar()
+                self._aguardar()
+            except Exception as e:
+                print(f"⚠️  [SSH] Não foi possível restabelecer o túnel: {e}")
+                return False
+            self.restauracoes += 1
+            print(f"[SSH] Túnel restabelecido ({self.restauracoes}ª vez nesta execução)")
+            return True
+    
+    def _encerrar_processo(self):
+        """Encerra o processo ssh próprio (sem ControlMaster); retorna a marca para o log."""
+        if not self.processo:
+            return "✓"
+        processo, self.processo = self.processo, None
+        try:
+            processo.terminate()
+            processo.wait(timeout=5)
+            return "✓"
+        except Exception:
+            try:
+                processo.kill()
+                return "✓ (forçado)"
+            except Exception:
+                return "⚠️  (processo pode continuar em background)"
+    
+    def fechar(self):
+        """Cancela o encaminhamento (o ssh mestre continua para as próximas execuções) ou encerra o processo ssh."""
+        if self.control_path and self.encaminhamento_proprio:
+            print(f"[SSH] Liberando a porta {self.porta} (conexão mestre mantida por {self.config['control_persist']}s)...", end=" ")
+            try:
+                codigo, _ = self._executar_ssh('-O', 'cancel', '-L', self.encaminhamento)
+                print("✓" if codigo == 0 else "⚠️  (conexão mestre já encerrada)")
+            except Exception as e:
+                print(f"⚠️  ({e})")
+            self.encaminhamento_proprio = False
+            print("[SSH] Túnel SSH encerrado.")
+        elif self.processo:
+            print("[SSH] Encerrando túnel SSH...", end=" ")
+            print(self._encerrar_processo())
+            print("[SSH] Túnel SSH encerrado.")
+
+@contextmanager
+def gerenciar_tunnel_ssh(SSH_CONFIG):
+    """Context manager para gerenciar ciclo de vida do túnel SSH. Entrega o TunelSSH aberto."""
+    tunel = TunelSSH(SSH_CONFIG)
+    try:
+        tunel.abrir()
+    except FileNotFoundError:
+        print(f"[SSH] ERRO: Comando 'ssh' não encontrado no sistema.")
+        print(f"[SSH] Certifique-se de que o OpenSSH está instalado.")
+        tunel.fechar()
+        sys.exit(1)
+    except Exception as e:
+        print(f"[SSH] Erro ao estabelecer túnel: {e}")
+        tunel.fechar()
+        sys.exit(1)
+    
+    try:
+        yield tunel
+    finally:
+        tunel.fechar()
+
+def ajustar_hosts_para_tunnel(db_config, SSH_CONFIG):
+    """Ajusta host e porta dos bancos para usar túnel SSH."""
+    config = db_config.copy()
+    config['host'] = '127.0.0.1'
+    config['port'] = SSH_CONFIG['local_bind_port']
+    return config
+
+# --- MÉTRICAS DE DESEMPENHO ---
+# Todo cursor criado pelas conexões do script (CursorMedido / CursorDictMedido)
+# registra em METRICAS a duração de cada execute, as linhas retornadas ou
+# afetadas e os bytes trocados, agrupados por banco e tipo de consulta. As
+# etapas de main() são cronometradas à parte. O resultado vai para a aba
+# 6-Performance do relatório e, com METRICAS_JSON=S, para metricas_<cliente>.json.
+
+# Trecho inicial do SQL usado para classificar a consulta
+TAMANHO_AMOSTRA_SQL = 2000
+# Comentário inicial /* nome */ dá um nome explícito à consulta
+_PADRAO_NOME_CONSULTA = re.compile(r'\s*/\*\s*([\w.-]+)\s*\*/')
+_PADRAO_VERBO_SQL = re.compile(r'\s*(\w+)')
+_PADRAO_TABELA_SQL = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+(?:\.\w+)?)\s*(\()?', re.IGNORECASE)
+_PADRAO_FOR_UPDATE = re.compile(r'\bFOR\s+UPDATE\b', re.IGNORECASE)
+
+def tipo_consulta(sql):
+    """
+    Nome da consulta para as métricas: o comentário inicial /* nome */, se houver;
+    senão o verbo e a primeira tabela (ex.: 'SELECT segurado', 'UPDATE tb_usuario',
+    'SELECT tb_usuario FOR UPDATE'). Funções na cláusula FROM (dblink, unnest) só
+    são usadas quando a consulta não lê nenhuma tabela.
+    """
+    if isinstance(sql, bytes):
+        amostra = sql[:TAMANHO_AMOSTRA_SQL].decode('utf-8', 'replace')
+    else:
+        amostra = str(sql)[:TAMANHO_AMOSTRA_SQL]
+    
+    nome = _PADRAO_NOME_CONSULTA.match(amostra)
+    if nome:
+        return nome.group(1)
+    
+    verbo = _PADRAO_VERBO_SQL.match(amostra)
+    verbo = verbo.group(1).upper() if verbo else '?'
+    tabelas = _PADRAO_TABELA_SQL.findall(amostra)
+    tabela = next((nome for nome, funcao in tabelas if not funcao), None)
+    if tabela is None and tabelas:
+        tabela = tabelas[0][0]
+    tipo = f"{verbo} {tabela}" if tabela else verbo
+    if verbo == 'SELECT' and _PADRAO_FOR_UPDATE.search(amostra):
+        tipo += ' FOR UPDATE'
+    return tipo
+
+def percentil(ordenados, p):
+    """Percentil p (0-100) de uma lista já ordenada, pelo método do posto mais próximo."""
+    if not ordenados:
+        return 0.0
+    posicao = max(1, -(-len(ordenados) * p // 100))
+    return ordenados[int(posicao) - 1]
+
+def tamanho_linhas(linhas):
+    """Estimativa dos bytes recebidos: tamanho dos textos/bytes e 8 bytes por valor de outro tipo."""
+    total = 0
+    for linha in linhas:
+        for valor in (linha.values() if isinstance(linha, dict) else linha):
+            if valor is None:
+                continue
+            total += len(valor) if isinstance(valor, (str, bytes, memoryview)) else 8
+    return total
+
+class MetricasDesempenho:
+    """
+    Tempos das etapas e latência das consultas da execução, compartilhados entre
+    as threads do pipeline. As durações de cada tipo de consulta são mantidas
+    para o cálculo de p50/p95/p99.
+    """
+    
+    CABECALHO = ['Tipo', 'Banco', 'Nome', 'Quantidade', 'Erros', 'Total (s)', 'Média (ms)',
+                 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'Máximo (ms)', 'Linhas',
+                 'Bytes enviados', 'Bytes recebidos (estimado)']
+    
+    def __init__(self):
+        self._trava = threading.Lock()
+        self.reiniciar()
+    
+    def reiniciar(self):
+        """Descarta as medições (início de uma nova execução)."""
+        with self._trava:
+            self.consultas = {}
+            self.etapas = []
+            self._etapa_atual = None
+    
+    def _consulta(self, banco, tipo):
+        chave = (banco, tipo)
+        dados = self.consultas.get(chave)
+        if dados is None:
+            dados = self.consultas[chave] = {'duracoes': [], 'erros': 0, 'linhas': 0,
+                                             'bytes_enviados': 0, 'bytes_recebidos': 0}
+        return dados
+    
+    def registrar_consulta(self, banco, tipo, duracao, linhas, bytes_enviados, erro=False):
+        """Registra um execute: duração em segundos, linhas retornadas/afetadas e bytes do SQL enviado."""
+        with self._trava:
+            dados = self._consulta(banco, tipo)
+            dados['duracoes'].append(duracao)
+            dados['linhas'] += max(linhas, 0)
+            dados['bytes_enviados'] += bytes_enviados
+            if erro:
+                dados['erros'] += 1
+    
+    def registrar_recebidos(self, banco, tipo, quantidade):
+        """Soma bytes recebidos (estimados) ao tipo de consulta."""
+        with self._trava:
+            self._consulta(banco, tipo)['bytes_recebidos'] += quantidade
+    
+    def iniciar_etapa(self, nome):
+        """Encerra a etapa em andamento (se houver) e começa a cronometrar a próxima."""
+        agora = time.perf_counter()
+        with self._trava:
+            self._fechar_etapa(agora)
+            self._etapa_atual = (nome, agora)
+    
+    def encerrar_etapa(self):
+        """Encerra a etapa em andamento."""
+        agora = time.perf_counter()
+        with self._trava:
+            self._fechar_etapa(agora)
+    
+    def _fechar_etapa(self, agora):
+        if self._etapa_atual:
+            nome, inicio = self._etapa_atual
+            self.etapas.append((nome, agora - inicio))
+            self._etapa_atual = None
+    
+    def _etapas_com_atual(self):
+        """Etapas encerradas e a em andamento (duração até agora, marcada com em_andamento)."""
+        etapas = [(nome, duracao, False) for nome, duracao in self.etapas]
+        if self._etapa_atual:
+            nome, inicio = self._etapa_atual
+            etapas.append((nome, time.perf_counter() - inicio, True))
+        return etapas
+    
+    def estatisticas_consultas(self):
+        """Lista de dicts por (banco, tipo), da consulta com maior tempo total para a menor."""
+        with self._trava:
+            copias = [(banco, tipo, dict(dados, duracoes=sorted(dados['duracoes'])))
+                      for (banco, tipo), dados in self.consultas.items()]
+        
+        estatisticas = []
+        for banco, tipo, dados in copias:
+            duracoes = dados['duracoes']
+            total = sum(duracoes)
+            estatisticas.append({
+                'banco': banco,
+                'tipo': tipo,
+                'quantidade': len(duracoes),
+                'erros': dados['erros'],
+                'total_s': total,
+                'media_ms': total / len(duracoes) * 1000 if duracoes else 0.0,
+                'p50_ms': percentil(duracoes, 50) * 1000,
+                'p95_ms': percentil(duracoes, 95) * 1000,
+                'p99_ms': percentil(duracoes, 99) * 1000,
+                'max_ms': duracoes[-1] * 1000 if duracoes else 0.0,
+                'linhas': dados['linhas'],
+                'bytes_enviados': dados['bytes_enviados'],
+                'bytes_recebidos': dados['bytes_recebidos']
+            })
+        estatisticas.sort(key=lambda item: item['total_s'], reverse=True)
+        return estatisticas
+    
+    def linhas_relatorio(self):
+        """Gera as linhas da aba 6-Performance (etapas e depois consultas)."""
+        with self._trava:
+            etapas = self._etapas_com_atual()
+        for nome, duracao, em_andamento in etapas:
+            yield {'Tipo': 'Etapa', 'Nome': f"{nome} (em andamento)" if em_andamento else nome,
+                   'Total (s)': round(duracao, 3)}
+        
+        for item in self.estatisticas_consultas():
+            yield {
+                'Tipo': 'Consulta', 'Banco': item['banco'], 'Nome': item['tipo'],
+                'Quantidade': item['quantidade'], 'Erros': item['erros'],
+                'Total (s)': round(item['total_s'], 3), 'Média (ms)': round(item['media_ms'], 2),
+                'p50 (ms)': round(item['p50_ms'], 2), 'p95 (ms)': round(item['p95_ms'], 2),
+                'p99 (ms)': round(item['p99_ms'], 2), 'Máximo (ms)': round(item['max_ms'], 2),
+                'Linhas': item['linhas'], 'Bytes enviados': item['bytes_enviados'],
+                'Bytes recebidos (estimado)': item['bytes_recebidos']
+            }
+    
+    def exibir_resumo(self, limite=5):
+        """Imprime a duração das etapas e as consultas com maior tempo total."""
+        with self._trava:
+            etapas = self._etapas_com_atual()
+        estatisticas = self.estatisticas_consultas()
+        if not etapas and not estatisticas:
+            return
+        
+        print("\n⏱️  Desempenho:")
+        for nome, duracao, em_andamento in etapas:
+            print(f"   {nome}: {duracao:.1f}s{' (em andamento)' if em_andamento else ''}")
+        if estatisticas:
+            print(f"   Consultas com maior tempo total (de {len(estatisticas)} tipo(s)):")
+            for item in estatisticas[:limite]:
+                print(f"   - [{item['banco']}] {item['tipo']}: {item['quantidade']}x, {item['total_s']:.1f}s, "
+                      f"p50 {item['p50_ms']:.1f}ms, p95 {item['p95_ms']:.1f}ms, p99 {item['p99_ms']:.1f}ms, "
+                      f"{item['linhas']} linha(s), {formatar_bytes(item['bytes_recebidos'])} recebidos")
+    
+    def salvar_json(self, caminho, dados_extras=None):
+        """Grava etapas e estatísticas das consultas em JSON. Retorna o caminho, ou None em caso de erro."""
+        with self._trava:
+            etapas = self._etapas_com_atual()
+        dados = dict(dados_extras or {})
+        dados['etapas'] = [{'nome': nome, 'duracao_s': round(duracao, 3), 'em_andamento': em_andamento}
+                           for nome, duracao, em_andamento in etapas]
+        dados['consultas'] = self.estatisticas_consultas()
+        try:
+            with open(caminho, 'w', encoding='utf-8') as arquivo:
+                json.dump(dados, arquivo, ensure_ascii=False, indent=2)
+            return caminho
+        except OSError as e:
+            print(f"⚠️  Erro ao gravar métricas em {caminho}: {e}")
+            return None
+
+METRICAS = MetricasDesempenho()
+
+def caminho_metricas(cliente_nome):
+    """Caminho do arquivo JSON de métricas do cliente (METRICAS_JSON=S)."""
+    return os.path.join(os.getcwd(), f'metricas_{cliente_nome.lower().replace(" ", "_")}.json')
+
+class _MedicaoCursor:
+    """Mixin de cursor que registra cada execute e os bytes lidos em METRICAS."""
+    
+    _tipo_metricas = None
+    
+    def execute(self, query, vars=None):
+        banco = self.connection.info.dbname
+        tipo = tipo_consulta(query)
+        self._tipo_metricas = (banco, tipo)
+        erro = False
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        except BaseException:
+            erro = True
+            raise
+        finally:
+            duracao = time.perf_counter() - inicio
+            METRICAS.registrar_consulta(banco, tipo, duracao, self.rowcount, len(self.query or b''), erro)
+    
+    def _contar_recebidos(self, linhas):
+        if self._tipo_metricas and linhas:
+            METRICAS.registrar_recebidos(*self._tipo_metricas, tamanho_linhas(linhas))
+    
+    def fetchone(self):
+        linha = super().fetchone()
+        if linha is not None:
+            self._contar_recebidos((linha,))
+        return linha
+    
+    def fetchmany(self, size=None):
+        linhas = super().fetchmany(size) if size is not None else super().fetchmany()
+        self._contar_recebidos(linhas)
+        return linhas
+    
+    def fetchall(self):
+        linhas = super().fetchall()
+        self._contar_recebidos(linhas)
+        return linhas
+
+class CursorMedido(_MedicaoCursor, psycopg2.extensions.cursor):
+    """Cursor padrão (tuplas) com medição; cursor_factory das conexões do script."""
+
+_CURSOR_DICT_MEDIDO = []
+
+def cursor_dict_medido():
+    """RealDictCursor com medição (classe criada no primeiro uso, ao importar psycopg2.extras)."""
+    if not _CURSOR_DICT_MEDIDO:
+        from psycopg2.extras import RealDictCursor
+        
+        class CursorDictMedido(_MedicaoCursor, RealDictCursor):
+            """RealDictCursor com medição."""
+        
+        _CURSOR_DICT_MEDIDO.append(CursorDictMedido)
+    return _CURSOR_DICT_MEDIDO[0]
+
+# Tentativas de reconexão após uma queda de conexão (ex.: oscilação do túnel SSH)
+TENTATIVAS_RECONEXAO = 3
+
+def conexao_ativa(conn):
+    """
+    Health check: descarta a transação em aberto e executa SELECT 1.
+    Retorna False se a conexão estiver fechada ou não responder.
+    """
+    if conn is None or conn.closed:
+        return False
+    try:
+        conn.rollback()
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.fetchone()
+        return True
+    except psycopg2.Error:
+        return False
+
+class PoolConexoes:
+    """
+    Pool de conexões de um banco (ThreadedConnectionPool) compartilhado entre as
+    threads da execução. Bloqueia quando todas as conexões estão emprestadas,
+    verifica cada conexão ao emprestar e troca as que caíram por novas.
+    ao_conectar(conn) roda em toda conexão nova (ex.: abrir o dblink) e
+    ao_fechar(conn) antes de fechá-la. ao_reconectar() roda antes de cada
+    tentativa de reconexão (ex.: restabelecer o túnel SSH que caiu).
+    """
+    
+    def __init__(self, nome, db_config, maxconn, ao_conectar=None, ao_fechar=None, ao_reconectar=None):
+        self.nome = nome
+        self.maxconn = maxconn
+        # minconn = maxconn: conexões devolvidas ficam abertas no pool (e com o dblink aberto)
+        self._pool = ThreadedConnectionPool(maxconn, maxconn, cursor_factory=CursorMedido, **db_config)
+        self._vagas = threading.BoundedSemaphore(maxconn)
+        self._trava = threading.Lock()
+        self._conhecidas = {}
+        self._ao_conectar = ao_conectar
+        self._ao_fechar = ao_fechar
+        self._ao_reconectar = ao_reconectar
+        self.stats = {
+            'conexoes_criadas': 0, 'reconexoes': 0, 'emprestimos': 0,
+            'em_uso': 0, 'pico_em_uso': 0, 'espera_total_s': 0.0
+        }
+    
+    def _emprestar(self):
+        """Pega uma conexão do pool; conexões novas passam por ao_conectar."""
+        conn = self._pool.getconn()
+        if id(conn) not in self._conhecidas:
+            try:
+                if self._ao_conectar:
+                    self._ao_conectar(conn)
+                conn.commit()
+            except Exception:
+                self._pool.putconn(conn, close=True)
+                raise
+            with self._trava:
+                self._conhecidas[id(conn)] = conn
+                self.stats['conexoes_criadas'] += 1
+        return conn
+    
+    def _descartar(self, conn):
+        """Fecha e remove do pool uma conexão que caiu."""
+        with self._trava:
+            self._conhecidas.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+    
+    def obter(self):
+        """Empresta uma conexão verificada, reconectando se ela tiver caído."""
+        inicio = time.time()
+        self._vagas.acquire()
+        try:
+            try:
+                conn = self._emprestar()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                # Conexão nova (ou ociosa ainda não usada) que não chega ao banco: o túnel pode ter caído
+                conn = None
+            tentativa = 0
+            while not conexao_ativa(conn):
+                if conn is not None:
+                    self._descartar(conn)
+                tentativa += 1
+                if tentativa > TENTATIVAS_RECONEXAO:
+                    raise psycopg2.OperationalError(f"[Pool {self.nome}] banco indisponível após {TENTATIVAS_RECONEXAO} tentativa(s) de reconexão")
+                print(f"\n⚠️  [Pool {self.nome}] Conexão perdida - reconectando (tentativa {tentativa}/{TENTATIVAS_RECONEXAO})...")
+                with self._trava:
+                    self.stats['reconexoes'] += 1
+                if self._ao_reconectar:
+                    self._ao_reconectar()
+                time.sleep(2 ** (tentativa - 1))
+                try:
+                    conn = self._emprestar()
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    conn = None
+        except BaseException:
+            self._vagas.release()
+            raise
+        
+        with self._trava:
+            self.stats['emprestimos'] += 1
+            self.stats['em_uso'] += 1
+            self.stats['pico_em_uso'] = max(self.stats['pico_em_uso'], self.stats['em_uso'])
+            self.stats['espera_total_s'] += time.time() - inicio
+        return conn
+    
+    def devolver(self, conn):
+        """Devolve a conexão ao pool, encerrando a transação em aberto (ou descartando-a se caiu)."""
+        try:
+            if conn.closed:
+                self._descartar(conn)
+            else:
+                try:
+                    conn.rollback()
+                    self._pool.putconn(conn)
+                except psycopg2.Error:
+                    self._descartar(conn)
+        finally:
+            with self._trava:
+                self.stats['em_uso'] -= 1
+            self._vagas.release()
+    
+    def renovar(self, conn):
+        """Verifica uma conexão mantida por muito tempo; se caiu, devolve e empresta outra."""
+        if conexao_ativa(conn):
+            return conn
+        self.devolver(conn)
+        return self.obter()
+    
+    @contextmanager
+    def conexao(self):
+        """Empresta uma conexão durante o bloco."""
+        conn = self.obter()
+        try:
+            yield conn
+        finally:
+            self.devolver(conn)
+    
+    def executar(self, funcao, *args):
+        """
+        Executa funcao(conn, *args) com uma conexão do pool. Se a conexão cair no
+        meio da execução, repete com uma conexão nova; outros erros são relançados.
+        """
+        for tentativa in range(TENTATIVAS_RECONEXAO + 1):
+            conn = self.obter()
+            try:
+                return funcao(conn, *args)
+            except psycopg2.Error:
+                if tentativa == TENTATIVAS_RECONEXAO or conexao_ativa(conn):
+                    raise
+                print(f"\n⚠️  [Pool {self.nome}] Conexão caiu durante a consulta - repetindo com uma nova conexão...")
+            finally:
+                self.devolver(conn)
+    
+    def fechar(self):
+        """Fecha todas as conexões do pool."""
+        if self._ao_fechar:
+            for conn in list(self._conhecidas.values()):
+                if not conn.closed:
+                    self._ao_fechar(conn)
+        self._pool.closeall()
+    
+    def resumo(self):
+        """Texto com as estatísticas de uso do pool."""
+        return (f"{self.stats['conexoes_criadas']} conexão(ões) criada(s), {self.stats['reconexoes']} reconexão(ões), "
+                f"{self.stats['emprestimos']} empréstimo(s), pico {self.stats['pico_em_uso']}/{self.maxconn} em uso, "
+                f"espera {self.stats['espera_total_s']:.1f}s")
+
+def abrir_conexao_dblink(conn, URL_ACCOUNTS, DB_ACCOUNTS_NAME_USER, SENHA_ACCOUNTS, nome=NOME_CONEXAO_DBLINK):
+    """
+    Abre uma conexão dblink nomeada com accounts na sessão informada.
+    Retorna True se uma nova conexão remota foi aberta.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT %s = ANY(COALESCE(dblink_get_connections(), '{}'))", (nome,))
+    if cur.fetchone()[0]:
+        return False
+    
+    conexao_accounts = f"host={URL_ACCOUNTS} dbname={DB_ACCOUNTS_NAME_USER} user={DB_ACCOUNTS_NAME_USER} password={SENHA_ACCOUNTS}"
+    cur.execute("SELECT dblink_connect(%s, %s)", (nome, conexao_accounts))
+    return True
+
+def fechar_conexao_dblink(conn, nome=NOME_CONEXAO_DBLINK):
+    """Encerra a conexão dblink nomeada, se ainda estiver aberta."""
+    if conn is None or conn.closed:
+        return
+    try:
+        conn.rollback()
+        cur = conn.cursor()
+        cur.execute("SELECT %s = ANY(COALESCE(dblink_get_connections(), '{}'))", (nome,))
+        if cur.fetchone()[0]:
+            cur.execute("SELECT dblink_disconnect(%s)", (nome,))
+            print(f"[dblink] Conexão '{nome}' com accounts encerrada.")
+    except Exception as e:
+        print(f"⚠️  Erro ao encerrar conexão dblink '{nome}': {e}")
+
+def buscar_accounts_lote(cur, uuids, conexao_dblink=NOME_CONEXAO_DBLINK):
+    """
+    Busca em accounts.users (via dblink) todos os UUIDs do lote em uma única chamada.
+    Usa a conexão dblink nomeada já aberta na sessão.
+    Retorna dict {uuid: dados_accounts} com os UUIDs no formato canônico.
+    """
+    if not uuids:
+        return {}
+    
+    sql_remoto = cur.mogrify(
+        "SELECT id, cpf_cnpj, name, email, phone FROM users WHERE id = ANY(%s::uuid[])",
+        (list(uuids),)
+    ).decode()
+    sql_accounts = """
+        SELECT id, cpf_cnpj, name, email, phone
+        FROM dblink(%s, %s) AS accounts(id uuid, cpf_cnpj varchar, name varchar, email varchar, phone varchar)
+    """
+    cur.execute(sql_accounts, (conexao_dblink, sql_remoto))
+    
+    return {str(linha['id']): linha for linha in cur.fetchall()}
+
+# --- CACHE LOCAL DE ACCOUNTS ---
+class CacheAccounts:
+    """
+    Cache de linhas de accounts.users consultado antes do dblink: LRU em memória
+    e, opcionalmente, SQLite em disco compartilhado entre execuções e clientes
+    (vários processos podem usar o mesmo arquivo). Entradas mais antigas que o TTL
+    não são usadas. Com forcar_atualizacao, toda consulta vai ao dblink e o
+    resultado regrava o cache. Compartilhado entre as threads do pipeline.
+    """
+    
+    def __init__(self, origem, max_memoria, ttl, arquivo=None):
+        self.origem = origem
+        self.max_memoria = max_memoria
+        self.ttl = ttl
+        self.arquivo = arquivo
+        self.forcar_atualizacao = False
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self.zerar_contadores()
+        self._conn = None
+        if arquivo:
+            self._conn = sqlite3.connect(arquivo, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_accounts (
+                    origem TEXT NOT NULL,
+                    uuid TEXT NOT NULL,
+                    dados TEXT NOT NULL,
+                    gravado_em REAL NOT NULL,
+                    PRIMARY KEY (origem, uuid)
+                )
+            """)
+            # Entradas vencidas não serão mais usadas: libera o espaço
+            self._conn.execute("DELETE FROM cache_accounts WHERE gravado_em < ?", (time.time() - ttl,))
+            self._conn.commit()
+    
+    def zerar_contadores(self):
+        self.acertos_memoria = 0
+        self.acertos_disco = 0
+        self.faltas = 0
+    
+    def obter(self, uuids):
+        """Retorna ({uuid: dados} encontrados no cache, [uuids a buscar no dblink])."""
+        uuids = list(uuids)
+        if self.forcar_atualizacao:
+            with self._lock:
+                self.faltas += len(uuids)
+            return {}, uuids
+        
+        validade = time.time() - self.ttl
+        encontrados = {}
+        pendentes = []
+        with self._lock:
+            for uuid in uuids:
+                entrada = self._memoria.get(uuid)
+                if entrada and entrada[0] >= validade:
+                    self._memoria.move_to_end(uuid)
+                    encontrados[uuid] = entrada[1]
+                else:
+                    pendentes.append(uuid)
+            self.acertos_memoria += len(encontrados)
+            
+            if self._conn and pendentes:
+                do_disco = {}
+                # Limite de parâmetros por comando do SQLite
+                for inicio in range(0, len(pendentes), 900):
+                    parte = pendentes[inicio:inicio + 900]
+                    linhas = self._conn.execute(
+                        f"SELECT uuid, dados, gravado_em FROM cache_accounts "
+                        f"WHERE origem = ? AND gravado_em >= ? AND uuid IN ({', '.join('?' * len(parte))})",
+                        [self.origem, validade] + parte
+                    )
+                    for uuid, dados, gravado_em in linhas:
+                        do_disco[uuid] = (gravado_em, json.loads(dados))
+                for uuid, entrada in do_disco.items():
+                    self._guardar_memoria(uuid, entrada)
+                    encontrados[uuid] = entrada[1]
+                self.acertos_disco += len(do_disco)
+                pendentes = [uuid for uuid in pendentes if uuid not in do_disco]
+            
+            self.faltas += len(pendentes)
+        return encontrados, pendentes
+    
+    def guardar(self, linhas):
+        """Guarda {uuid: dados} recém-buscados no dblink (em memória e, se houver, em disco)."""
+        if not linhas:
+            return
+        agora = time.time()
+        with self._lock:
+            for uuid, dados in linhas.items():
+                self._guardar_memoria(uuid, (agora, dados))
+            if self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO cache_accounts (origem, uuid, dados, gravado_em) VALUES (?, ?, ?, ?)",
+                    [(self.origem, uuid, json.dumps(dados, ensure_ascii=False, default=str), agora)
+                     for uuid, dados in linhas.items()]
+                )
+                self._conn.commit()
+    
+    def _guardar_memoria(self, uuid, entrada):
+        self._memoria[uuid] = entrada
+        self._memoria.move_to_end(uuid)
+        while len(self._memoria) > self.max_memoria:
+            self._memoria.popitem(last=False)
+    
+    def resumo(self):
+        acertos = self.acertos_memoria + self.acertos_disco
+        consultas = acertos + self.faltas
+        taxa = f"{100 * acertos / consultas:.1f}%" if consultas else '-'
+        return (f"{acertos} acerto(s) ({self.acertos_memoria} memória, {self.acertos_disco} disco), "
+                f"{self.faltas} falta(s), taxa {taxa}{' - atualização forçada' if self.forcar_atualizacao else ''}")
+
+# Caches do processo: no modo multicliente, um processo que atende vários
+# clientes reaproveita o cache em memória entre eles
+_CACHES_ACCOUNTS = {}
+
+def obter_cache_accounts(config, origem):
+    """Cache de accounts do processo para a origem e a configuração informadas (None se desativado)."""
+    if not config['ativo']:
+        return None
+    chave = (origem, config['max_memoria'], config['ttl'], config['arquivo'])
+    cache = _CACHES_ACCOUNTS.get(chave)
+    if cache is None:
+        cache = _CACHES_ACCOUNTS[chave] = CacheAccounts(origem, config['max_memoria'], config['ttl'], config['arquivo'])
+    cache.forcar_atualizacao = config['forcar_atualizacao']
+    cache.zerar_contadores()
+    return cache
+
+def buscar_accounts_com_cache(cur, uuids, cache=None):
+    """buscar_accounts_lote consultando antes o cache: só os UUIDs ausentes vão ao dblink."""
+    if cache is None:
+        return buscar_accounts_lote(cur, uuids)
+    
+    encontrados, faltantes = cache.obter(uuids)
+    if faltantes:
+        buscados = {uuid: dict(linha, id=uuid) for uuid, linha in buscar_accounts_lote(cur, faltantes).items()}
+        cache.guardar(buscados)
+        encontrados.update(buscados)
+    return encontrados
+
+# Expressão de CPF normalizado em segurado. O índice precisa usar exatamente
+# esta expressão para que o planner consiga utilizá-lo nas consultas.
+EXPRESSAO_CPF_SEGURADO = r"REGEXP_REPLACE(cpf_cnpj, '\D', '', 'g')"
+INDICE_CPF_SEGURADO = 'idx_segurado_cpf_cnpj_normalizado'
+
+def verificar_indice_cpf_segurado(conn):
+    """
+    Procura um índice válido em segurado sobre a expressão de CPF normalizado.
+    Retorna o nome do índice encontrado ou None.
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        WHERE i.indrelid = 'segurado'::regclass
+        AND i.indisvalid
+        AND i.indexprs IS NOT NULL
+        AND i.indpred IS NULL
+    """)
+    for nome_indice, definicao in cur.fetchall():
+        definicao = definicao.lower()
+        if 'regexp_replace' in definicao and 'cpf_cnpj' in definicao and "'\\d'" in definicao:
+            return nome_indice
+    return None
+
+def verificar_coluna_cpf_segurado(conn, coluna):
+    """Verifica se a coluna de CPF normalizado existe em segurado e se possui índice."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT a.attname,
+               EXISTS (
+                   SELECT 1 FROM pg_index i
+                   WHERE i.indrelid = a.attrelid AND i.indisvalid AND i.indkey[0] = a.attnum
+               )
+        FROM pg_attribute a
+        WHERE a.attrelid = 'segurado'::regclass AND a.attname = %s AND NOT a.attisdropped
+    """, (coluna,))
+    linha = cur.fetchone()
+    if not linha:
+        return False, False
+    return True, linha[1]
+
+def criar_indice_cpf_segurado(db_config):
+    """Cria o índice de CPF normalizado em segurado com CREATE INDEX CONCURRENTLY."""
+    conn = psycopg2.connect(cursor_factory=CursorMedido, **db_config)
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        # Um CONCURRENTLY interrompido deixa o índice inválido; remove antes de recriar
+        cur.execute("""
+            SELECT 1 FROM pg_index i
+            WHERE i.indexrelid = to_regclass(%s) AND NOT i.indisvalid
+        """, (INDICE_CPF_SEGURADO,))
+        if cur.fetchone():
+            print(f"[Segurado] Removendo índice inválido {INDICE_CPF_SEGURADO}...")
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDICE_CPF_SEGURADO}")
+        
+        print(f"[Segurado] Criando índice {INDICE_CPF_SEGURADO} (CONCURRENTLY, pode demorar)...", end=" ", flush=True)
+        inicio = time.time()
+        cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDICE_CPF_SEGURADO} ON segurado (({EXPRESSAO_CPF_SEGURADO}))")
+        print(f"✓ ({time.time() - inicio:.1f}s)")
+    finally:
+        conn.close()
+
+def preparar_busca_cpf_segurado(conn, db_config, BUSCA_CPF_SEGURADO):
+    """
+    Define como o CPF normalizado de segurado será consultado.
+    Retorna (expressao_sql, modo), onde modo é 'coluna', 'indice' ou 'regex'.
+    """
+    coluna = BUSCA_CPF_SEGURADO['coluna_normalizada']
+    if coluna:
+        existe, indexada = verificar_coluna_cpf_segurado(conn, coluna)
+        conn.rollback()
+        if existe:
+            print(f"[Segurado] Busca de CPF pela coluna normalizada '{coluna}'")
+            if not indexada:
+                print(f"⚠️  A coluna '{coluna}' não possui índice - consultas farão varredura sequencial.")
+            return f'"{coluna}"', 'coluna'
+        print(f"⚠️  Coluna '{coluna}' (COLUNA_CPF_SEGURADO) não existe em segurado - ignorando.")
+    
+    nome_indice = verificar_indice_cpf_segurado(conn)
+    conn.rollback()
+    if nome_indice:
+        print(f"[Segurado] Busca de CPF pelo índice de expressão '{nome_indice}'")
+        return EXPRESSAO_CPF_SEGURADO, 'indice'
+    
+    print(f"\n⚠️  Índice de CPF normalizado não encontrado em segurado.")
+    print(f"   Sem ele, cada busca por CPF faz uma varredura sequencial da tabela.")
+    
+    criar = BUSCA_CPF_SEGURADO['criar_indice']
+    if criar not in ('S', 'N'):
+        try:
+            criar = input(f"Criar o índice {INDICE_CPF_SEGURADO} agora (CONCURRENTLY)? (S/N): ").strip().upper()
+        except EOFError:
+            criar = 'N'
+    
+    if criar in ['S', 'SIM', 'Y', 'YES']:
+        try:
+            criar_indice_cpf_segurado(db_config)
+            if verificar_indice_cpf_segurado(conn):
+                conn.rollback()
+                return EXPRESSAO_CPF_SEGURADO, 'indice'
+            conn.rollback()
+        except Exception as e:
+            print(f"\n⚠️  Não foi possível criar o índice: {e}")
+    
+    print(f"⚠️  Usando busca por REGEXP_REPLACE sem índice (mais lenta).")
+    return EXPRESSAO_CPF_SEGURADO, 'regex'
+
+def montar_array_literal(valores):
+    """
+    Monta um literal de array do PostgreSQL ('{...}') sem tipo definido.
+    Usado em `coluna = ANY(%s)`, o literal assume o tipo da coluna (uuid, varchar, integer...).
+    """
+    itens = []
+    for valor in valores:
+        texto = str(valor).replace('\\', '\\\\').replace('"', '\\"')
+        itens.append(f'"{texto}"')
+    return '{' + ','.join(itens) + '}'
+
+def buscar_segurados_por_cpf_lote(cur, cpfs, expressao_cpf_segurado):
+    """
+    Verifica em uma única consulta quais CPFs do lote existem em segurado.
+    Retorna dict {cpf_normalizado: dados_segurado} com um segurado por CPF.
+    """
+    if not cpfs:
+        return {}
+    
+    sql_segurados = f"""
+        /* segurados_por_cpf */
+        SELECT DISTINCT ON (cpf_normalizado)
+               {expressao_cpf_segurado} AS cpf_normalizado, id, cpf_cnpj, usuario_id, nome
+        FROM segurado
+        WHERE {expressao_cpf_segurado} = ANY(%s)
+        ORDER BY cpf_normalizado, id
+    """
+    cur.execute(sql_segurados, (montar_array_literal(cpfs),))
+    return {linha['cpf_normalizado']: linha for linha in cur.fetchall()}
+
+def buscar_segurados_vinculados_lote(cur, usuario_ids, expressao_cpf_segurado):
+    """
+    Busca em uma única consulta todos os segurados vinculados aos usuários do lote.
+    Retorna dict {usuario_id: [segurados]} com o CPF normalizado de cada segurado,
+    para que as divergências sejam filtradas em memória.
+    """
+    if not usuario_ids:
+        return {}
+    
+    sql_vinculados = f"""
+        /* segurados_vinculados */
+        SELECT usuario_id, id, cpf_cnpj, nome, {expressao_cpf_segurado} AS cpf_normalizado
+        FROM segurado
+        WHERE usuario_id = ANY(%s)
+        ORDER BY usuario_id, id
+    """
+    cur.execute(sql_vinculados, (montar_array_literal(usuario_ids),))
+    
+    segurados_por_usuario = {}
+    for linha in cur.fetchall():
+        segurados_por_usuario.setdefault(linha['usuario_id'], []).append(linha)
+    return segurados_por_usuario
+
+def buscar_usuarios_por_sso_lote(cur, tabela, colunas, sso_ids):
+    """
+    Busca em uma única consulta os usuários do lote pelo sso_id.
+    Retorna dict {uuid: dados} com o UUID no formato canônico. Se houver mais de
+    um registro para o mesmo sso_id, mantém o primeiro (como o fetchone anterior).
+    """
+    if not sso_ids:
+        return {}
+    
+    sql_usuarios = f"""
+        SELECT sso_id, {', '.join(colunas)}
+        FROM {tabela}
+        WHERE sso_id = ANY(%s)
+        ORDER BY id
+    """
+    cur.execute(sql_usuarios, (montar_array_literal(sso_ids),))
+    
+    usuarios = {}
+    for linha in cur.fetchall():
+        chave = normalizar_uuid(linha['sso_id']) or str(linha['sso_id'])
+        usuarios.setdefault(chave, linha)
+    return usuarios
+
+def filtrar_segurados_divergentes(segurados_vinculados, cpf_correto):
+    """Retorna os segurados cujo CPF normalizado difere do CPF correto (CPF nulo não conta)."""
+    return [
+        seg for seg in segurados_vinculados
+        if seg['cpf_normalizado'] is not None and seg['cpf_normalizado'] != cpf_correto
+    ]
+
+# --- COMPARAÇÃO NO BANCO (MOTOR_COMPARACAO=sql) ---
+# Campos comparados com accounts em cada tabela: (coluna da tabela, campo de accounts).
+# A ordem define os bits da máscara de divergências (1, 2, 4, 8).
+CAMPOS_COMPARACAO = {
+    'tb_usuario': [('cpf_cnpj', 'cpf_cnpj'), ('name', 'name'), ('email', 'email'), ('phone', 'phone')],
+    'usuario': [('cpf_cnpj', 'cpf_cnpj'), ('nome', 'name'), ('email', 'email')]
+}
+
+# Caracteres removidos por str.strip() - o BTRIM recebe a mesma lista para que a
+# normalização no banco seja idêntica à de comparar_campos
+ESPACOS_STRIP = ''.join(chr(c) for c in range(0x3001) if chr(c).isspace())
+
+def expressao_normalizada_sql(campo, coluna):
+    """Expressão SQL que normaliza a coluna como comparar_campos normaliza o valor atual (lado direito)."""
+    if campo == 'cpf_cnpj' or campo == 'cpf':
+        return rf"NULLIF(REGEXP_REPLACE(t.{coluna}, '\D', '', 'g'), '')"
+    return f"(CASE WHEN t.{coluna} IS NULL OR t.{coluna} = '' THEN NULL ELSE BTRIM(t.{coluna}, %(espacos)s) END)"
+
+def preparar_comparacao_sql(conn, tabela):
+    """
+    Verifica se a tabela permite a comparação no banco: as colunas comparadas
+    precisam ser texto (text/varchar), para que a normalização seja a mesma do Python.
+    Retorna o tipo SQL de sso_id, ou None se a tabela não for compatível.
+    """
+    colunas = [coluna for coluna, _ in CAMPOS_COMPARACAO[tabela]]
+    tipos = obter_tipos_colunas(conn.cursor(), tabela, colunas + ['sso_id'])
+    conn.rollback()
+    incompativeis = [
+        f"{coluna} ({tipos[coluna]})" for coluna in colunas
+        if not (tipos[coluna] == 'text' or tipos[coluna].startswith('character varying'))
+    ]
+    if incompativeis:
+        print(f"⚠️  {tabela}: colunas que não são texto ({', '.join(incompativeis)}) - comparação feita no Python.")
+        return None
+    return tipos['sso_id']
+
+def comparar_usuarios_sql(cur, tabela, colunas_extras, accounts_por_chave, tipo_sso_id):
+    """
+    Compara no banco os dados de accounts do lote com a tabela (join por sso_id).
+    accounts_por_chave: {uuid do relatório: registro de normalizar_registros_accounts}.
+    
+    Retorna dict {uuid: linha} no mesmo formato de buscar_usuarios_por_sso_lote,
+    com a coluna extra 'mascara' (bits dos campos divergentes, na ordem de
+    CAMPOS_COMPARACAO). Para linhas consistentes (mascara = 0), somente sso_id,
+    'mascara' e colunas_extras são transferidos; os campos comparados vêm nulos.
+    """
+    if not accounts_por_chave:
+        return {}
+    
+    campos = CAMPOS_COMPARACAO[tabela]
+    chaves = list(accounts_por_chave)
+    parametros = {'espacos': ESPACOS_STRIP, 'chaves': chaves}
+    for n, (_, campo_accounts) in enumerate(campos):
+        valores = (accounts_por_chave[chave][campo_accounts] for chave in chaves)
+        parametros[f'a{n}'] = [None if valor is None else str(valor) for valor in valores]
+    
+    unnest = ', '.join(['%(chaves)s::text[]'] + [f'%(a{n})s::text[]' for n in range(len(campos))])
+    aliases = ', '.join(['chave'] + [f'a{n}' for n in range(len(campos))])
+    mascara = ' | '.join(
+        f"(CASE WHEN {expressao_normalizada_sql(campo_accounts, coluna)} IS DISTINCT FROM a.a{n} THEN {1 << n} ELSE 0 END)"
+        for n, (coluna, campo_accounts) in enumerate(campos)
+    )
+    valores_atuais = ', '.join(f"CASE WHEN m.mascara <> 0 THEN t.{coluna} END AS {coluna}" for coluna, _ in campos)
+    extras = ''.join(f't.{coluna}, ' for coluna in colunas_extras)
+    
+    sql_comparacao = f"""
+        /* comparacao_{tabela} */
+        SELECT t.sso_id, {extras}m.mascara, {valores_atuais}
+        FROM unnest({unnest}) AS a({aliases})
+        JOIN {tabela} t ON t.sso_id = a.chave::{tipo_sso_id}
+        CROSS JOIN LATERAL (SELECT {mascara} AS mascara) m
+        ORDER BY t.id
+    """
+    cur.execute(sql_comparacao, parametros)
+    
+    usuarios = {}
+    for linha in cur.fetchall():
+        chave = normalizar_uuid(linha['sso_id']) or str(linha['sso_id'])
+        usuarios.setdefault(chave, linha)
+    return usuarios
+
+def calcular_divergencias(normalizado, dados_atuais, campos):
+    """
+    Divergências de um registro de accounts já normalizado, como em comparar_campos.
+    Linhas vindas da comparação no banco com máscara zero são consistentes sem nova
+    comparação; as demais são conferidas no Python, que continua sendo a referência.
+    """
+    if dados_atuais.get('mascara') == 0:
+        return {}
+    return comparar_normalizado(normalizado, dados_atuais, campos)
+
+# --- ESTADO DO MODO INCREMENTAL ---
+# Campos de accounts que entram no hash: se nenhum mudar, o resultado da última
+# análise (consistente ou já aplicado) continua valendo para o UUID.
+CAMPOS_HASH_ACCOUNTS = ('cpf_cnpj', 'name', 'email', 'phone')
+
+# Resultados que dispensam nova verificação enquanto o hash de accounts não mudar
+RESULTADOS_RESOLVIDOS = ('CONSISTENTE', 'APLICADO')
+
+def hash_accounts(dados):
+    """Hash (128 bits) dos campos de accounts usados no ajuste."""
+    valores = json.dumps([dados.get(campo) for campo in CAMPOS_HASH_ACCOUNTS], ensure_ascii=False, default=str)
+    return hashlib.blake2b(valores.encode('utf-8'), digest_size=16).hexdigest()
+
+def caminho_estado(cliente_nome):
+    """Caminho do banco SQLite com o estado do modo incremental do cliente."""
+    return os.path.join(os.getcwd(), f'estado_{cliente_nome.lower().replace(" ", "_")}.sqlite')
+
+class EstadoIncremental:
+    """
+    Estado local do modo incremental (SQLite, um arquivo por cliente): para cada
+    UUID, o hash dos dados de accounts e o último resultado (CONSISTENTE,
+    PLANEJADO, APLICADO ou FALHOU). Compartilhado entre as threads do pipeline.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS estado (
+                uuid TEXT PRIMARY KEY,
+                hash_accounts TEXT NOT NULL,
+                resultado TEXT NOT NULL,
+                atualizado_em TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def inalterados(self, hashes):
+        """UUIDs de {uuid: hash} com o mesmo hash da última execução e resultado resolvido."""
+        uuids = list(hashes)
+        encontrados = set()
+        with self._lock:
+            # Limite de parâmetros por comando do SQLite
+            for inicio in range(0, len(uuids), 900):
+                parte = uuids[inicio:inicio + 900]
+                linhas = self._conn.execute(
+                    f"SELECT uuid, hash_accounts FROM estado WHERE uuid IN ({', '.join('?' * len(parte))}) "
+                    f"AND resultado IN ({', '.join('?' * len(RESULTADOS_RESOLVIDOS))})",
+                    parte + list(RESULTADOS_RESOLVIDOS)
+                )
+                encontrados.update(uuid for uuid, hash_anterior in linhas if hashes[uuid] == hash_anterior)
+        return encontrados
+
+    def registrar_analise(self, resultados):
+        """Grava [(uuid, hash, resultado)] de um lote analisado."""
+        agora = time.strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            self._conn.executemany("""
+                INSERT INTO estado (uuid, hash_accounts, resultado, atualizado_em) VALUES (?, ?, ?, ?)
+                ON CONFLICT(uuid) DO UPDATE SET hash_accounts = excluded.hash_accounts,
+                    resultado = excluded.resultado, atualizado_em = excluded.atualizado_em
+            """, [(uuid, hash_atual, resultado, agora) for uuid, hash_atual, resultado in resultados])
+            self._conn.commit()
+
+    def registrar_execucao(self, item):
+        """
+        Resultado de uma ação executada. O UUID só fica APLICADO se todas as suas
+        ações tiveram sucesso; qualquer falha ou conflito o deixa como FALHOU.
+        """
+        if item.status == 'SUCESSO':
+            sql = "UPDATE estado SET resultado = 'APLICADO', atualizado_em = ? WHERE uuid = ? AND resultado = 'PLANEJADO'"
+        else:
+            sql = "UPDATE estado SET resultado = 'FALHOU', atualizado_em = ? WHERE uuid = ?"
+        with self._lock:
+            self._conn.execute(sql, (time.strftime('%Y-%m-%d %H:%M:%S'), normalizar_uuid(item.uuid)))
+
+    def confirmar(self):
+        with self._lock:
+            self._conn.commit()
+
+    def fechar(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+# --- ESTÁGIOS DO PIPELINE DE ANÁLISE ---
+# Cada estágio recebe o pool do seu banco e a carga do lote (dict), e devolve a
+# carga com os dados carregados. Erros de consulta não interrompem o pipeline:
+# ficam em carga['erro'] e o lote inteiro vai para a lista de erros. Se a conexão
+# cair, o erro é relançado para que o pool repita o lote com uma conexão nova.
+def estagio_accounts_gestao(tipo_sso_id_sql=None, estado=None, cache=None):
+    """
+    Estágio 1 (gestao): accounts via dblink e gestao.tb_usuario por sso_id.
+    Com tipo_sso_id_sql, tb_usuario é comparado no banco (comparar_usuarios_sql).
+    Com estado (modo incremental), UUIDs inalterados desde a última execução
+    ficam em carga['inalterados'] e não seguem para gestao e contrato.
+    Com cache, accounts é consultado primeiro no cache local (CacheAccounts).
+    """
+    def carregar(conn, carga):
+        cur = conn.cursor(cursor_factory=cursor_dict_medido())
+        lote = carga['lote']
+        
+        carga['uuids_lote'] = {normalizar_uuid(r['uuid_comum']) for r in lote} - {None}
+        try:
+            carga['accounts'] = buscar_accounts_com_cache(cur, carga['uuids_lote'], cache)
+        except Exception as e:
+            if not conexao_ativa(conn):
+                raise
+            carga['erro'] = f'Erro ao buscar lote em accounts: {e}'
+            return carga
+        
+        # Modo incremental: hash de accounts comparado com o da última execução
+        carga['hashes_accounts'] = {}
+        carga['inalterados'] = set()
+        accounts_verificar = carga['accounts']
+        if estado:
+            carga['hashes_accounts'] = {uuid_lote: hash_accounts(dados) for uuid_lote, dados in carga['accounts'].items()}
+            carga['inalterados'] = estado.inalterados(carga['hashes_accounts'])
+            accounts_verificar = {uuid_lote: dados for uuid_lote, dados in carga['accounts'].items()
+                                  if uuid_lote not in carga['inalterados']}
+        
+        # Normalização dos dados de accounts feita aqui, fora da thread principal
+        carga['accounts_normalizado'] = normalizar_registros_accounts(accounts_verificar)
+        
+        # Somente UUIDs com CPF em accounts podem chegar à comparação com tb_usuario
+        accounts_com_cpf = {}
+        for r in lote:
+            normalizado = carga['accounts_normalizado'].get(normalizar_uuid(r['uuid_comum']))
+            if normalizado and normalizado['cpf_cnpj']:
+                accounts_com_cpf[r['uuid_comum']] = normalizado
+        try:
+            if tipo_sso_id_sql:
+                carga['usuarios_gestao'] = comparar_usuarios_sql(cur, 'tb_usuario', ['id'], accounts_com_cpf, tipo_sso_id_sql)
+            else:
+                carga['usuarios_gestao'] = buscar_usuarios_por_sso_lote(
+                    cur, 'tb_usuario', ['id', 'cpf_cnpj', 'name', 'email', 'phone'], list(accounts_com_cpf)
+                )
+        except Exception as e:
+            if not conexao_ativa(conn):
+                raise
+            carga['erro'] = f'Erro ao buscar lote em gestao: {e}'
+        return carga
+    
+    def executar(pool, carga):
+        return pool.executar(carregar, carga)
+    return executar
+
+def estagio_contrato(expressao_cpf_segurado, tipo_sso_id_sql=None):
+    """
+    Estágio 2 (contrato): segurados por CPF, contrato.usuario e segurados vinculados.
+    Com tipo_sso_id_sql, contrato.usuario é comparado no banco (comparar_usuarios_sql).
+    """
+    def carregar(conn, carga):
+        cur = conn.cursor(cursor_factory=cursor_dict_medido())
+        normalizados = carga['accounts_normalizado']
+        cpfs_accounts = {uuid_lote: normalizado['cpf_cnpj'] for uuid_lote, normalizado in normalizados.items()}
+        try:
+            carga['segurados_por_cpf'] = buscar_segurados_por_cpf_lote(
+                cur, set(cpfs_accounts.values()) - {None, ''}, expressao_cpf_segurado
+            )
+            # Somente UUIDs cujo CPF existe em segurado seguem para a comparação
+            uuids_elegiveis = [
+                r['uuid_comum'] for r in carga['lote']
+                if cpfs_accounts.get(normalizar_uuid(r['uuid_comum'])) in carga['segurados_por_cpf']
+            ]
+            if tipo_sso_id_sql:
+                carga['usuarios_contrato'] = comparar_usuarios_sql(
+                    cur, 'usuario', ['id'],
+                    {uuid: normalizados[normalizar_uuid(uuid)] for uuid in uuids_elegiveis},
+                    tipo_sso_id_sql
+                )
+            else:
+                carga['usuarios_contrato'] = buscar_usuarios_por_sso_lote(
+                    cur, 'usuario', ['id', 'cpf_cnpj', 'nome', 'email'], uuids_elegiveis
+                )
+            carga['segurados_por_usuario'] = buscar_segurados_vinculados_lote(
+                cur, [dados['id'] for dados in carga['usuarios_contrato'].values()], expressao_cpf_segurado
+            )
+        except Exception as e:
+            if not conexao_ativa(conn):
+                raise
+            carga['erro'] = f'Erro ao buscar lote em contrato: {e}'
+        return carga
+    
+    def executar(pool, carga):
+        if 'erro' in carga:
+            return carga
+        return pool.executar(carregar, carga)
+    return executar
+
+def obter_tipos_colunas(cur, tabela, colunas):
+    """Retorna dict {coluna: tipo SQL} das colunas informadas da tabela."""
+    cur.execute("""
+        SELECT attname, format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attname = ANY(%s) AND NOT attisdropped
+    """, (tabela, list(colunas)))
+    tipos = dict(cur.fetchall())
+    
+    faltando = [coluna for coluna in colunas if coluna not in tipos]
+    if faltando:
+        raise ValueError(f"Colunas não encontradas em {tabela}: {', '.join(faltando)}")
+    return tipos
+
+# --- REGISTROS DAS AÇÕES (ETAPA 2 -> ETAPA 3 -> RELATÓRIO) ---
+# Um objeto com __slots__ por ação, em vez de um dict por ação: sem o dicionário
+# de atributos de cada instância, listas com milhões de itens ocupam uma fração
+# da memória. get() mantém a mesma interface de dict usada pelo relatório.
+
+# Tuplas de campos divergentes compartilhadas entre registros (poucas combinações possíveis)
+_CAMPOS_DIVERGENTES = {}
+
+def campos_divergentes(divergencias):
+    """Tupla (compartilhada) com os nomes dos campos divergentes."""
+    chave = tuple(divergencias)
+    return _CAMPOS_DIVERGENTES.setdefault(chave, chave)
+
+class RegistroAcao:
+    """Base dos registros de ação: acesso por atributo e get() como em um dict."""
+    __slots__ = ()
+    TIPO = None
+
+    def get(self, campo, padrao=None):
+        return getattr(self, campo, padrao)
+
+    def para_json(self):
+        """Linha do plano de ações: [tipo, campos na ordem de __slots__]."""
+        return [self.TIPO] + [getattr(self, campo) for campo in self.__slots__]
+
+    @classmethod
+    def de_json(cls, valores):
+        """Recria o registro a partir de uma linha do plano de ações (sem o tipo)."""
+        registro = cls.__new__(cls)
+        for campo, valor in zip(cls.__slots__, valores):
+            setattr(registro, campo, valor)
+        if 'campos_divergentes' in cls.__slots__:
+            registro.campos_divergentes = campos_divergentes(registro.campos_divergentes or ())
+        return registro
+
+    @property
+    def divergencias(self):
+        return str(list(self.campos_divergentes))
+
+class UpdateGestao(RegistroAcao):
+    """UPDATE de gestao.tb_usuario (aba 1-Updates Gestão)."""
+    TIPO = 'tb_usuario'
+    __slots__ = ('indice', 'uuid', 'id_gestao', 'cpf_antes', 'cpf_depois', 'nome_antes', 'nome_depois',
+                 'email_antes', 'email_depois', 'phone_antes', 'phone_depois', 'campos_divergentes', 'status')
+
+    def __init__(self, indice, uuid, id_gestao, cpf_antes, cpf_depois, nome_antes, nome_depois,
+                 email_antes, email_depois, phone_antes, phone_depois, divergencias):
+        self.indice = indice
+        self.uuid = uuid
+        self.id_gestao = id_gestao
+        self.cpf_antes = cpf_antes
+        self.cpf_depois = cpf_depois
+        self.nome_antes = nome_antes
+        self.nome_depois = nome_depois
+        self.email_antes = email_antes
+        self.email_depois = email_depois
+        self.phone_antes = phone_antes
+        self.phone_depois = phone_depois
+        self.campos_divergentes = campos_divergentes(divergencias)
+        self.status = ''
+
+class UpdateContrato(RegistroAcao):
+    """UPDATE de contrato.usuario (aba 2-Updates Contrato)."""
+    TIPO = 'usuario'
+    __slots__ = ('indice', 'uuid', 'id_usuario', 'cpf_antes', 'cpf_depois', 'nome_antes', 'nome_depois',
+                 'email_antes', 'email_depois', 'campos_divergentes', 'status')
+
+    def __init__(self, indice, uuid, id_usuario, cpf_antes, cpf_depois, nome_antes, nome_depois,
+                 email_antes, email_depois, divergencias):
+        self.indice = indice
+        self.uuid = uuid
+        self.id_usuario = id_usuario
+        self.cpf_antes = cpf_antes
+        self.cpf_depois = cpf_depois
+        self.nome_antes = nome_antes
+        self.nome_depois = nome_depois
+        self.email_antes = email_antes
+        self.email_depois = email_depois
+        self.campos_divergentes = campos_divergentes(divergencias)
+        self.status = ''
+
+class Desvinculacao(RegistroAcao):
+    """Segurado a desvincular do usuário (aba 3-Desvinculações)."""
+    TIPO = 'segurado'
+    __slots__ = ('indice', 'uuid', 'segurado_id', 'cpf_segurado', 'cpf_correto', 'nome_segurado', 'usuario_id', 'status')
+
+    def __init__(self, indice, uuid, segurado_id, cpf_segurado, cpf_correto, nome_segurado, usuario_id):
+        self.indice = indice
+        self.uuid = uuid
+        self.segurado_id = segurado_id
+        self.cpf_segurado = cpf_segurado
+        self.cpf_correto = cpf_correto
+        self.nome_segurado = nome_segurado
+        self.usuario_id = usuario_id
+        self.status = ''
+
+class Ignorado(RegistroAcao):
+    """Registro do relatório ignorado na análise (aba 4-Ignorados)."""
+    TIPO = 'ignorado'
+    __slots__ = ('uuid', 'cpf_accounts', 'motivo', 'indice')
+
+    def __init__(self, uuid, motivo, cpf_accounts='', indice=None):
+        self.uuid = uuid
+        self.cpf_accounts = cpf_accounts
+        self.motivo = motivo
+        self.indice = indice
+
+class ErroRegistro(RegistroAcao):
+    """Registro do relatório que falhou na análise (aba 5-Erros)."""
+    TIPO = 'erro'
+    __slots__ = ('uuid', 'erro', 'indice')
+
+    def __init__(self, uuid, erro, indice=None):
+        self.uuid = uuid
+        self.erro = erro
+        self.indice = indice
+
+def formatar_bytes(quantidade):
+    """Quantidade de bytes em B/KB/MB/GB."""
+    for unidade in ('B', 'KB', 'MB'):
+        if quantidade < 1024:
+            return f"{quantidade:.1f} {unidade}" if unidade != 'B' else f"{quantidade} B"
+        quantidade /= 1024
+    return f"{quantidade:.1f} GB"
+
+# --- PLANO DE AÇÕES EM DISCO (JSON-lines) ---
+# A análise grava cada ação em um arquivo só de acréscimo: cabeçalho, uma linha
+# compacta por registro ([tipo, valores...]) e, ao concluir, a linha 'fim' com o
+# resumo da análise e o SHA-256 de todas as linhas anteriores. Execução e
+# relatório leem o arquivo em streaming, sem manter as ações em memória.
+
+TIPOS_REGISTRO = {classe.TIPO: classe for classe in (UpdateGestao, UpdateContrato, Desvinculacao, Ignorado, ErroRegistro)}
+
+def caminho_plano(cliente_nome):
+    """Caminho do plano de ações gerado pela análise do cliente."""
+    return os.path.join(os.getcwd(), f'plano_{cliente_nome.lower().replace(" ", "_")}.jsonl')
+
+def caminho_resultado_execucao(cliente_nome):
+    """Caminho do diário com o status de cada ação executada."""
+    return os.path.join(os.getcwd(), f'execucao_{cliente_nome.lower().replace(" ", "_")}.jsonl')
+
+class DiarioAcoes:
+    """Arquivo JSON-lines só de acréscimo com registros de ação."""
+
+    def __init__(self, caminho, cabecalho=None, acrescentar=False):
+        self.caminho = caminho
+        self.contadores = {}
+        self._hash = hashlib.sha256()
+        self._arquivo = open(caminho, 'a' if acrescentar else 'w', encoding='utf-8', newline='\n')
+        if cabecalho is not None:
+            self._escrever(dict(cabecalho, tipo='cabecalho'))
+
+    def _escrever(self, dados):
+        linha = json.dumps(dados, ensure_ascii=False, separators=(',', ':'), default=str) + '\n'
+        self._hash.update(linha.encode('utf-8'))
+        self._arquivo.write(linha)
+
+    def registrar(self, registro):
+        self._escrever(registro.para_json())
+        self.contadores[registro.TIPO] = self.contadores.get(registro.TIPO, 0) + 1
+
+    def sincronizar(self):
+        """Garante em disco tudo o que foi registrado até aqui."""
+        self._arquivo.flush()
+        os.fsync(self._arquivo.fileno())
+
+    def concluir(self, dados):
+        """Grava a linha 'fim' (plano completo, com o SHA-256 das linhas anteriores) e fecha o arquivo."""
+        self._escrever(dict(dados, tipo='fim', sha256=self._hash.hexdigest()))
+        self.fechar()
+
+    def fechar(self):
+        if not self._arquivo.closed:
+            self.sincronizar()
+            self._arquivo.close()
+
+def ler_diario(caminho, tipos=None):
+    """Gera, na ordem do arquivo, os registros de ação do diário (opcionalmente só dos tipos informados)."""
+    with open(caminho, encoding='utf-8') as f:
+        for linha in f:
+            dados = json.loads(linha)
+            # Cabeçalho e 'fim' são objetos; registros são listas [tipo, valores...]
+            if isinstance(dados, list) and (tipos is None or dados[0] in tipos):
+                yield TIPOS_REGISTRO[dados[0]].de_json(dados[1:])
+
+def verificar_plano(caminho):
+    """
+    Confere a integridade do plano: lê o arquivo inteiro e compara o SHA-256 das
+    linhas com o registrado na linha 'fim'. Retorna (cabeçalho, fim).
+    Lança ValueError se o plano estiver incompleto ou tiver sido alterado.
+    """
+    soma = hashlib.sha256()
+    cabecalho = None
+    anterior = None
+    with open(caminho, 'rb') as f:
+        for linha in f:
+            if anterior is not None:
+                soma.update(anterior)
+            elif cabecalho is None:
+                cabecalho = json.loads(linha)
+            anterior = linha
+    
+    fim = json.loads(anterior) if anterior else None
+    if not isinstance(fim, dict) or fim.get('tipo') != 'fim':
+        raise ValueError("plano incompleto (análise interrompida)")
+    if fim.get('sha256') != soma.hexdigest():
+        raise ValueError("soma de verificação não confere (arquivo alterado)")
+    return cabecalho, fim
+
+def carregar_plano(cliente_nome, assinatura, checkpoint):
+    """
+    Verifica o plano de ações do cliente. Retorna o dict da linha 'fim' se o plano
+    estiver íntegro e completo, for do mesmo relatório e não depender de itens que
+    o checkpoint atual ainda não confirmou; senão None.
+    """
+    caminho = caminho_plano(cliente_nome)
+    if not os.path.exists(caminho):
+        return None
+    
+    try:
+        cabecalho, fim = verificar_plano(caminho)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Plano de ações {os.path.basename(caminho)} inválido: {e} - ignorando")
+        return None
+    
+    if cabecalho.get('cliente') != cliente_nome or cabecalho.get('assinatura') != assinatura:
+        print(f"⚠️  Plano de ações {os.path.basename(caminho)} pertence a outro relatório - ignorando")
+        return None
+    # Itens anteriores ao checkpoint da época não estão no plano
+    if any(checkpoint.get(tabela, 0) < indice for tabela, indice in cabecalho.get('checkpoint', {}).items()):
+        print(f"⚠️  Plano de ações {os.path.basename(caminho)} não cobre o checkpoint atual - ignorando")
+        return None
+    return fim
+
+def remover_arquivos_plano(cliente_nome):
+    """Remove o plano de ações e o diário de execução após o relatório final."""
+    for caminho in (caminho_plano(cliente_nome), caminho_resultado_execucao(cliente_nome)):
+        if os.path.exists(caminho):
+            os.remove(caminho)
+
+def normalizar_chave_uuid(valor):
+    """Normaliza sso_id para comparar o RETURNING com os itens do relatório."""
+    return normalizar_uuid(valor) or str(valor)
+
+def valor_no_plano(valor):
+    """Valor como fica gravado no plano de ações (tipos fora do JSON viram texto)."""
+    return valor if valor is None or isinstance(valor, (str, int, float, bool)) else str(valor)
+
+# Operações da ETAPA 3, na ordem de execução. Cada SQL usa `FROM (VALUES %s) AS v(<colunas>)`
+# e devolve no RETURNING a chave de cada linha atualizada. 'verificacao' relê as linhas
+# alvo (FOR UPDATE) para comparar 'atual' com os valores 'antes' registrados no plano.
+OPERACOES_UPDATE = {
+    'tb_usuario': {
+        'banco': 'gestao',
+        'descricao': 'gestao.tb_usuario',
+        'sql': """
+            UPDATE tb_usuario AS t
+            SET cpf_cnpj = v.cpf_cnpj, name = v.name, email = v.email, phone = v.phone, updated_at = NOW()
+            FROM (VALUES %s) AS v(sso_id, cpf_cnpj, name, email, phone)
+            WHERE t.sso_id = v.sso_id
+            RETURNING v.sso_id
+        """,
+        'colunas': ['sso_id', 'cpf_cnpj', 'name', 'email', 'phone'],
+        'valores': lambda item: (
+            item.uuid,
+            item.cpf_depois.replace('.', '').replace('-', ''),
+            item.nome_depois,
+            item.email_depois,
+            item.phone_depois
+        ),
+        'chave': lambda item: item.uuid,
+        'normalizar_chave': normalizar_chave_uuid,
+        'verificacao': "SELECT sso_id, cpf_cnpj, name, email, phone FROM tb_usuario WHERE sso_id = ANY(%s::{tipo}[]) FOR UPDATE",
+        'campos_verificados': ('cpf_cnpj', 'name', 'email', 'phone'),
+        'antes': lambda item: (item.cpf_antes, item.nome_antes, item.email_antes, item.phone_antes),
+        'atual': lambda linha: (formatar_cpf(linha[1]), linha[2], linha[3], linha[4])
+    },
+    'usuario': {
+        'banco': 'contrato',
+        'descricao': 'contrato.usuario',
+        'sql': """
+            UPDATE usuario AS t
+            SET cpf_cnpj = v.cpf_cnpj, nome = v.nome, email = v.email, updated_at = NOW()
+            FROM (VALUES %s) AS v(sso_id, cpf_cnpj, nome, email)
+            WHERE t.sso_id = v.sso_id
+            RETURNING v.sso_id
+        """,
+        'colunas': ['sso_id', 'cpf_cnpj', 'nome', 'email'],
+        'valores': lambda item: (
+            item.uuid,
+            item.cpf_depois.replace('.', '').replace('-', ''),
+            item.nome_depois,
+            item.email_depois
+        ),
+        'chave': lambda item: item.uuid,
+        'normalizar_chave': normalizar_chave_uuid,
+        'verificacao': "SELECT sso_id, cpf_cnpj, nome, email FROM usuario WHERE sso_id = ANY(%s::{tipo}[]) FOR UPDATE",
+        'campos_verificados': ('cpf_cnpj', 'nome', 'email'),
+        'antes': lambda item: (item.cpf_antes, item.nome_antes, item.email_antes),
+        'atual': lambda linha: (formatar_cpf(linha[1]), linha[2], linha[3])
+    },
+    'segurado': {
+        'banco': 'contrato',
+        'descricao': 'segurado (desvinculações)',
+        'sql': """
+            UPDATE segurado AS t
+            SET usuario_id = NULL, updated_at = NOW()
+            FROM (VALUES %s) AS v(id)
+            WHERE t.id = v.id
+            RETURNING t.id
+        """,
+        'colunas': ['id'],
+        'valores': lambda item: (item.segurado_id,),
+        'chave': lambda item: item.segurado_id,
+        'normalizar_chave': str,
+        'verificacao': "SELECT id, usuario_id, cpf_cnpj FROM segurado WHERE id = ANY(%s::{tipo}[]) FOR UPDATE",
+        'campos_verificados': ('usuario_id', 'cpf_cnpj'),
+        'antes': lambda item: (item.usuario_id, item.cpf_segurado),
+        'atual': lambda linha: (linha[1], linha[2])
+    }
+}
+
+def executar_pagina_updates(cur, operacao, pagina, template):
+    """
+    Executa uma página de itens em um único comando, protegida por SAVEPOINT.
+    Se o comando falhar, refaz a página linha a linha, cada uma com o próprio
+    SAVEPOINT, para que somente os itens com problema fiquem com erro.
+    Preenche item.status e retorna (sucessos, erros).
+    """
+    from psycopg2.extras import execute_values
+    
+    normalizar_chave = operacao['normalizar_chave']
+    
+    cur.execute("SAVEPOINT pagina_updates")
+    try:
+        retornados = execute_values(
+            cur, operacao['sql'], [operacao['valores'](item) for item in pagina],
+            template=template, page_size=len(pagina), fetch=True
+        )
+        cur.execute("RELEASE SAVEPOINT pagina_updates")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT pagina_updates")
+        if len(pagina) == 1:
+            pagina[0].status = f'ERRO: {e}'
+            print(f"  ❌ Erro ao atualizar {operacao['descricao']} ({operacao['chave'](pagina[0])}): {e}")
+            return 0, 1
+        
+        print(f"  ⚠️  Erro na página de {len(pagina)} registro(s), reprocessando linha a linha: {e}")
+        sucessos = 0
+        erros = 0
+        for item in pagina:
+            s_item, e_item = executar_pagina_updates(cur, operacao, [item], template)
+            sucessos += s_item
+            erros += e_item
+        return sucessos, erros
+    
+    atualizados = {normalizar_chave(linha[0]) for linha in retornados}
+    sucessos = 0
+    erros = 0
+    for item in pagina:
+        if normalizar_chave(operacao['chave'](item)) in atualizados:
+            item.status = 'SUCESSO'
+            sucessos += 1
+        else:
+            item.status = 'ERRO: registro não encontrado para atualização'
+            erros += 1
+    return sucessos, erros
+
+def separar_conflitos(cur, operacao, pagina, tipo_chave):
+    """
+    Concorrência otimista: relê (com FOR UPDATE) somente as linhas alvo da página e
+    compara com os valores "antes" registrados no plano. Itens cuja linha mudou desde
+    a análise recebem status de CONFLITO e ficam fora do UPDATE; linhas inexistentes
+    seguem para o UPDATE, que registra o erro.
+    Retorna (itens a atualizar, quantidade de conflitos).
+    """
+    normalizar_chave = operacao['normalizar_chave']
+    cur.execute(operacao['verificacao'].format(tipo=tipo_chave), ([operacao['chave'](item) for item in pagina],))
+    atuais = {
+        normalizar_chave(linha[0]): tuple(map(valor_no_plano, operacao['atual'](linha)))
+        for linha in cur.fetchall()
     }
     
-    # Validação: túnel SSH é obrigatório
-    if not SSH_CONFIG['ssh_host'] or not SSH_CONFIG['ssh_user']:
-        raise ValueError("SSH_HOST e SSH_USER são obrigatórios no arquivo .env")
+    liberados = []
+    conflitos = 0
+    for item in pagina:
+        atual = atuais.get(normalizar_chave(operacao['chave'](item)))
+        antes = operacao['antes'](item)
+        if atual is None or atual == antes:
+            liberados.append(item)
+            continue
+        alterados = [campo for campo, valor_antes, valor_atual in zip(operacao['campos_verificados'], antes, atual)
+                     if valor_antes != valor_atual]
+        item.status = f"CONFLITO: {', '.join(alterados)} alterado(s) desde a análise"
+        conflitos += 1
+    return liberados, conflitos
+
+def executar_updates_em_lote(conn, tabela, itens, tamanho_pagina):
+    """
+    Aplica os itens da operação com UPDATE ... FROM (VALUES ...) via execute_values,
+    uma página por comando, depois de conferir os valores atuais das linhas alvo
+    (separar_conflitos). Não faz COMMIT. Retorna (sucessos, erros, conflitos).
+    """
+    operacao = OPERACOES_UPDATE[tabela]
+    cur = conn.cursor()
+    tipos = obter_tipos_colunas(cur, tabela, operacao['colunas'])
+    template = '(' + ', '.join(f'%s::{tipos[coluna]}' for coluna in operacao['colunas']) + ')'
+    
+    sucessos = 0
+    erros = 0
+    conflitos = 0
+    for inicio in range(0, len(itens), tamanho_pagina):
+        pagina, c_pagina = separar_conflitos(cur, operacao, itens[inicio:inicio + tamanho_pagina], tipos[operacao['colunas'][0]])
+        conflitos += c_pagina
+        if not pagina:
+            continue
+        s_pagina, e_pagina = executar_pagina_updates(cur, operacao, pagina, template)
+        sucessos += s_pagina
+        erros += e_pagina
+    return sucessos, erros, conflitos
+
+def caminho_checkpoint(cliente_nome):
+    """Caminho do arquivo de checkpoint da execução do cliente."""
+    return os.path.join(os.getcwd(), f'checkpoint_{cliente_nome.lower().replace(" ", "_")}.json')
+
+def carregar_checkpoint(cliente_nome, assinatura):
+    """
+    Lê o checkpoint do cliente. Retorna dict {tabela: último índice confirmado}
+    ou {} se não houver checkpoint válido para este relatório.
+    """
+    caminho = caminho_checkpoint(cliente_nome)
+    if not os.path.exists(caminho):
+        return {}
+    
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            dados = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Checkpoint ilegível ({caminho}): {e} - ignorando")
+        return {}
+    
+    if dados.get('cliente') != cliente_nome or dados.get('assinatura') != assinatura:
+        print(f"⚠️  Checkpoint {os.path.basename(caminho)} pertence a outro relatório - ignorando")
+        return {}
+    
+    return {tabela: int(indice) for tabela, indice in dados.get('tabelas', {}).items()}
+
+def salvar_checkpoint(cliente_nome, assinatura, tabelas):
+    """Grava o checkpoint de forma atômica (arquivo temporário + rename)."""
+    caminho = caminho_checkpoint(cliente_nome)
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump({
+            'cliente': cliente_nome,
+            'assinatura': assinatura,
+            'tabelas': tabelas,
+            'atualizado_em': time.strftime('%Y-%m-%d %H:%M:%S')
+        }, f, ensure_ascii=False, indent=2)
+    os.replace(temporario, caminho)
+
+def caminho_ignorados_checkpoint(cliente_nome):
+    """Caminho dos ignorados e erros da análise que acompanham o checkpoint."""
+    return os.path.join(os.getcwd(), f'checkpoint_{cliente_nome.lower().replace(" ", "_")}_ignorados.jsonl')
+
+def salvar_ignorados_checkpoint(cliente_nome, registros):
+    """
+    Grava (de forma atômica) os ignorados e erros da análise antes da execução: uma
+    retomada pula a análise dos registros já confirmados e os recupera daqui.
+    """
+    caminho = caminho_ignorados_checkpoint(cliente_nome)
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w', encoding='utf-8', newline='\n') as f:
+        for registro in registros:
+            f.write(json.dumps(registro.para_json(), ensure_ascii=False, separators=(',', ':'), default=str) + '\n')
+    os.replace(temporario, caminho)
+
+def carregar_ignorados_checkpoint(cliente_nome, ate_indice):
+    """
+    Ignorados e erros gravados com o checkpoint dos registros até ate_indice
+    (os que a retomada não analisa de novo). Retorna None se o arquivo não existir.
+    """
+    caminho = caminho_ignorados_checkpoint(cliente_nome)
+    if not os.path.exists(caminho):
+        return None
+    try:
+        return [registro for registro in ler_diario(caminho)
+                if registro.get('indice') is not None and registro.indice <= ate_indice]
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠️  Ignorados do checkpoint ilegíveis ({caminho}): {e}")
+        return None
+
+def caminho_executados_checkpoint(cliente_nome):
+    """Caminho dos itens executados (com status) que acompanham o checkpoint."""
+    return os.path.join(os.getcwd(), f'checkpoint_{cliente_nome.lower().replace(" ", "_")}_executados.jsonl')
+
+def retomar_executados_checkpoint(cliente_nome, checkpoint, registrar):
+    """
+    Entrega a registrar os itens executados em execuções anteriores que o checkpoint
+    confirma (abas 1 a 3 do relatório de uma execução retomada) e regrava o arquivo
+    só com eles, descartando resultados de janelas sem COMMIT confirmado.
+    Retorna a quantidade de itens recuperados.
+    """
+    caminho = caminho_executados_checkpoint(cliente_nome)
+    if not os.path.exists(caminho):
+        return 0
+    temporario = caminho + '.tmp'
+    recuperados = 0
+    with open(temporario, 'w', encoding='utf-8', newline='\n') as f:
+        for item in ler_diario(caminho):
+            if item.indice <= checkpoint.get(item.TIPO, 0):
+                f.write(json.dumps(item.para_json(), ensure_ascii=False, separators=(',', ':'), default=str) + '\n')
+                registrar(item)
+                recuperados += 1
+    os.replace(temporario, caminho)
+    return recuperados
+
+def remover_checkpoint(cliente_nome):
+    """Remove o checkpoint (e os ignorados e executados que o acompanham) após uma execução concluída."""
+    for caminho in (caminho_checkpoint(cliente_nome), caminho_ignorados_checkpoint(cliente_nome),
+                    caminho_executados_checkpoint(cliente_nome)):
+        if os.path.exists(caminho):
+            os.remove(caminho)
+
+def aplicar_updates_com_checkpoint(conexoes, itens, tamanho_pagina, commit_a_cada, cliente_nome, assinatura, checkpoint,
+                                   registrar_resultado, reconectar=None, sincronizar_resultados=None):
+    """
+    Executa as ações (na ordem do relatório, lidas do plano) em janelas de
+    ~commit_a_cada itens, com COMMIT ao final de cada uma. Uma janela sempre
+    contém registros inteiros (todos os itens de um mesmo índice). Itens já
+    confirmados segundo o checkpoint são pulados. Após cada COMMIT, entrega cada
+    item executado (com status) a registrar_resultado, chama sincronizar_resultados
+    e só então grava no checkpoint o último índice confirmado.
+    Se a conexão de um banco cair no meio da janela, reconectar(banco, conn)
+    devolve uma conexão nova (restabelecendo o túnel) e a parte da janela ainda
+    sem COMMIT nesse banco é repetida; conexoes é atualizado com a conexão nova.
+    Retorna (dict {tabela: (sucessos, erros, conflitos)}, quantidade pulada pelo checkpoint).
+    """
+    totais = {tabela: [0, 0, 0] for tabela in OPERACOES_UPDATE}
+    ja_aplicados = 0
+    janela = {}
+    quantidade = 0
+    limite = None
+    
+    def executar_banco(banco, tabelas):
+        """Executa e confirma as tabelas da janela em um banco; retorna {tabela: (sucessos, erros, conflitos)}."""
+        for tentativa in range(TENTATIVAS_RECONEXAO + 1):
+            conn = conexoes[banco]
+            try:
+                resultados = {tabela: executar_updates_em_lote(conn, tabela, janela[tabela], tamanho_pagina) for tabela in tabelas}
+                conn.commit()
+                return resultados
+            except psycopg2.Error:
+                if reconectar is None or tentativa == TENTATIVAS_RECONEXAO or conexao_ativa(conn):
+                    raise
+                print(f"\n⚠️  Conexão com {banco} caiu antes do COMMIT até o registro #{limite} - reconectando e repetindo a janela...")
+                conexoes[banco] = reconectar(banco, conn)
+    
+    def executar_janela():
+        resumo_janela = []
+        for banco in conexoes:
+            tabelas = [tabela for tabela, operacao in OPERACOES_UPDATE.items() if operacao['banco'] == banco and tabela in janela]
+            resultados = executar_banco(banco, tabelas)
+            for tabela, valores in resultados.items():
+                for n, valor in enumerate(valores):
+                    totais[tabela][n] += valor
+            for tabela in tabelas:
+                for item in janela[tabela]:
+                    registrar_resultado(item)
+                resumo_janela.append(f"{tabela}: {len(janela[tabela])}")
+            if sincronizar_resultados:
+                sincronizar_resultados()
+            
+            for tabela, operacao in OPERACOES_UPDATE.items():
+                if operacao['banco'] == banco:
+                    checkpoint[tabela] = limite
+            salvar_checkpoint(cliente_nome, assinatura, checkpoint)
+        
+        print(f"  ✓ COMMIT até o registro #{limite} ({', '.join(resumo_janela)})")
+    
+    for item in itens:
+        if item.indice <= checkpoint.get(item.TIPO, 0):
+            ja_aplicados += 1
+            continue
+        # Fecha a janela ao atingir o tamanho, sem separar itens do mesmo registro
+        if quantidade >= commit_a_cada and item.indice != limite:
+            executar_janela()
+            janela = {}
+            quantidade = 0
+        janela.setdefault(item.TIPO, []).append(item)
+        quantidade += 1
+        limite = item.indice
+    
+    if janela:
+        executar_janela()
+    
+    return {tabela: tuple(valores) for tabela, valores in totais.items()}, ja_aplicados
+
+# Colunas do relatório usadas pelo ajuste (as demais não são carregadas)
+COLUNAS_RELATORIO = ('uuid_comum',)
+
+def dividir_em_lotes(iteravel, tamanho, inicio=0):
+    """Gera (posição inicial, lote) com até `tamanho` itens consumidos do iterável."""
+    iterador = iter(iteravel)
+    while True:
+        lote = list(islice(iterador, tamanho))
+        if not lote:
+            return
+        yield inicio, lote
+        inicio += len(lote)
+
+# Marca de fim de fila entre as threads do pipeline
+FIM_PIPELINE = object()
+
+def executar_pipeline_lotes(lotes, estagios, lotes_em_voo):
+    """
+    Processa os lotes em estágios encadeados por filas, cada estágio com as suas
+    threads, de modo que o lote N+1 seja buscado em um banco enquanto o lote N é
+    consultado no outro e comparado na thread principal.
+    
+    estagios: lista de (funcao, recursos); cada thread recebe um dos recursos do
+    estágio (conexão ou pool) e chama funcao(recurso, carga) para cada lote.
+    
+    Gera as cargas do último estágio na MESMA ORDEM dos lotes de entrada. No máximo
+    `lotes_em_voo` lotes ficam em memória ao mesmo tempo. Uma exceção em qualquer
+    thread interrompe o pipeline e é relançada aqui.
+    """
+    parar = threading.Event()
+    vagas = threading.Semaphore(lotes_em_voo)
+    trava = threading.Lock()
+    falhas = []
+    # A fila i alimenta o estágio i; a última entrega os resultados à thread principal.
+    # As vagas limitam os lotes em circulação, então nenhum put fica bloqueado.
+    filas = [queue.Queue(maxsize=lotes_em_voo + len(recursos)) for _, recursos in estagios]
+    filas.append(queue.Queue(maxsize=lotes_em_voo + 1))
+    restantes = [len(recursos) for _, recursos in estagios]
+    consumidores = restantes[1:] + [1]
+    
+    def registrar_falha(e):
+        with trava:
+            falhas.append(e)
+        parar.set()
+    
+    def produtor():
+        try:
+            for seq, carga in enumerate(lotes):
+                while not vagas.acquire(timeout=0.1):
+                    if parar.is_set():
+                        return
+                if parar.is_set():
+                    return
+                filas[0].put((seq, carga))
+        except BaseException as e:
+            registrar_falha(e)
+        finally:
+            for _ in range(restantes[0]):
+                filas[0].put(FIM_PIPELINE)
+    
+    def trabalhador(indice, funcao, recurso):
+        entrada, saida = filas[indice], filas[indice + 1]
+        try:
+            while not parar.is_set():
+                try:
+                    item = entrada.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is FIM_PIPELINE:
+                    break
+                seq, carga = item
+                saida.put((seq, funcao(recurso, carga)))
+        except BaseException as e:
+            registrar_falha(e)
+        finally:
+            # A última thread do estágio avisa o fim ao estágio seguinte
+            with trava:
+                restantes[indice] -= 1
+                ultima = restantes[indice] == 0
+            if ultima:
+                for _ in range(consumidores[indice]):
+                    saida.put(FIM_PIPELINE)
+    
+    threads = [threading.Thread(target=produtor, name='pipeline-leitura', daemon=True)]
+    for indice, (funcao, recursos) in enumerate(estagios):
+        for n, recurso in enumerate(recursos, 1):
+            threads.append(threading.Thread(
+                target=trabalhador, args=(indice, funcao, recurso),
+                name=f'pipeline-{indice + 1}.{n}', daemon=True
+            ))
+    for thread in threads:
+        thread.start()
+    
+    pendentes = {}
+    proximo = 0
+    try:
+        while True:
+            try:
+                item = filas[-1].get(timeout=0.1)
+            except queue.Empty:
+                if falhas:
+                    break
+                continue
+            if item is FIM_PIPELINE:
+                break
+            seq, carga = item
+            pendentes[seq] = carga
+            # Entrega na ordem de entrada, mesmo que os lotes terminem fora de ordem
+            while proximo in pendentes:
+                yield pendentes.pop(proximo)
+                proximo += 1
+                vagas.release()
+        
+        if falhas:
+            raise falhas[0]
+    finally:
+        parar.set()
+        for thread in threads:
+            thread.join()
+
+def assinatura_arquivo(caminho):
+    """Identifica um arquivo de entrada pelo nome, tamanho e data de modificação."""
+    info = os.stat(caminho)
+    return {'arquivo': os.path.basename(caminho), 'tamanho': info.st_size, 'modificado_em': int(info.st_mtime)}
+
+# --- SAÍDA DA ANÁLISE (VERBOSIDADE) ---
+VERBOSIDADES = ('detalhado', 'progresso', 'silencioso')
+
+def formatar_duracao(segundos):
+    """Duração em H:MM:SS."""
+    segundos = int(segundos)
+    return f"{segundos // 3600}:{segundos % 3600 // 60:02d}:{segundos % 60:02d}"
+
+def caminho_log_analise(cliente_nome):
+    """Caminho do log com o detalhe por registro da análise (LOG_ANALISE=S)."""
+    return os.path.join(os.getcwd(), f'analise_{cliente_nome.lower().replace(" ", "_")}.log')
+
+class SaidaAnalise:
+    """
+    Saída do loop da ETAPA 2. No modo 'detalhado', as linhas de cada registro vão
+    para o console; em 'progresso' e 'silencioso', só para o log da análise (se
+    houver), gravado com buffer. 'progresso' mostra uma linha única, atualizada a
+    cada `intervalo` segundos, com taxa, ETA e contadores; fora de um terminal,
+    a linha é repetida a cada `intervalo_arquivo` segundos.
+    """
+    
+    TAMANHO_BUFFER_LOG = 1024 * 1024
+    
+    def __init__(self, verbosidade, total=None, inicio=0, caminho_log=None, intervalo=0.5, intervalo_arquivo=30):
+        self.verbosidade = verbosidade
+        self.total = total
+        self.inicio = inicio
+        self.caminho_log = caminho_log
+        self._log = open(caminho_log, 'w', encoding='utf-8', buffering=self.TAMANHO_BUFFER_LOG) if caminho_log else None
+        self._terminal = sys.stdout.isatty()
+        self._intervalo = intervalo if self._terminal else intervalo_arquivo
+        self._comeco = time.monotonic()
+        self._proxima = self._comeco + self._intervalo
+        self._linha_aberta = False
+    
+    def detalhe(self, mensagem):
+        """Linha do detalhe de um registro."""
+        if self.verbosidade == 'detalhado':
+            print(mensagem)
+        if self._log:
+            self._log.write(mensagem + '\n')
+    
+    def aviso(self, mensagem):
+        """Mensagem que sempre vai para o console (e para o log), mesmo com a linha de progresso."""
+        self._quebrar_linha()
+        print(mensagem)
+        if self._log:
+            self._log.write(mensagem + '\n')
+    
+    def progresso(self, posicao, contadores, inalterados=0):
+        """Atualiza a linha de progresso, no máximo uma vez por intervalo."""
+        if self.verbosidade != 'progresso':
+            return
+        agora = time.monotonic()
+        if agora < self._proxima:
+            return
+        self._proxima = agora + self._intervalo
+        self._exibir(posicao, contadores, inalterados, agora)
+    
+    def concluir(self, posicao, contadores, inalterados=0):
+        """Exibe a linha de progresso final e fecha o log."""
+        if self.verbosidade == 'progresso':
+            self._exibir(posicao, contadores, inalterados, time.monotonic())
+            self._quebrar_linha()
+        self.fechar()
+    
+    def _exibir(self, posicao, contadores, inalterados, agora):
+        decorrido = agora - self._comeco
+        feitos = posicao - self.inicio
+        taxa = feitos / decorrido if decorrido > 0 else 0.0
+        partes = [f"{posicao}/{self.total}" if self.total else str(posicao)]
+        if self.total:
+            partes[0] += f" ({posicao / self.total:.1%})"
+        partes.append(f"{taxa:.0f} reg/s")
+        if self.total and taxa > 0:
+            partes.append(f"ETA {formatar_duracao(max(self.total - posicao, 0) / taxa)}")
+        partes.append(f"gestão {contadores.get('tb_usuario', 0)} | contrato {contadores.get('usuario', 0)} | "
+                      f"desvinc. {contadores.get('segurado', 0)} | ignorados {contadores.get('ignorado', 0)} | "
+                      f"erros {contadores.get('erro', 0)}" + (f" | inalterados {inalterados}" if inalterados else ''))
+        linha = "⏳ " + " | ".join(partes)
+        if self._terminal:
+            sys.stdout.write("\r\033[K" + linha)
+            sys.stdout.flush()
+            self._linha_aberta = True
+        else:
+            print(linha)
+    
+    def _quebrar_linha(self):
+        if self._linha_aberta:
+            sys.stdout.write("\n")
+            self._linha_aberta = False
+    
+    def fechar(self):
+        """Fecha o log da análise (descarregando o buffer)."""
+        self._quebrar_linha()
+        if self._log:
+            self._log.close()
+            self._log = None
+
+# --- LEITORES DO RELATÓRIO DE ENTRADA ---
+# Cada leitor recebe o caminho do arquivo e retorna (linhas, total_estimado), onde
+# linhas é um iterador de dicts somente com as colunas de COLUNAS_RELATORIO.
+def abrir_relatorio_xlsx(caminho):
+    """Relatório do script de análise (aba '1-Emails Duplicados'), lido em modo read_only."""
+    from openpyxl import load_workbook
+    
+    # read_only: as linhas são lidas sob demanda, sem carregar a planilha inteira
+    wb = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        ws = wb['1-Emails Duplicados']
+        headers = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())
+        posicoes = posicoes_colunas_relatorio(headers, "aba '1-Emails Duplicados'")
+        total_estimado = ws.max_row - 1 if ws.max_row else None
+    except Exception:
+        wb.close()
+        raise
+    
+    def linhas():
+        try:
+            for row in ws.iter_rows(min_row=2, values_only=True):
+                yield {coluna: (row[posicao] if posicao < len(row) else None) for coluna, posicao in posicoes.items()}
+        finally:
+            wb.close()
+    
+    return linhas(), total_estimado
+
+def abrir_relatorio_csv(caminho):
+    """CSV com cabeçalho contendo uuid_comum (separador detectado: vírgula, ponto e vírgula, tab ou |)."""
+    arquivo = open(caminho, newline='', encoding='utf-8-sig')
+    try:
+        amostra = arquivo.read(64 * 1024)
+        arquivo.seek(0)
+        try:
+            dialeto = csv.Sniffer().sniff(amostra, delimiters=',;\t|')
+        except csv.Error:
+            dialeto = csv.excel
+        leitor = csv.reader(arquivo, dialeto)
+        headers = [h.strip() for h in next(leitor, [])]
+        posicoes = posicoes_colunas_relatorio(headers, 'cabeçalho do CSV')
+    except Exception:
+        arquivo.close()
+        raise
+    
+    def linhas():
+        with arquivo:
+            for row in leitor:
+                yield {coluna: (row[posicao] if posicao < len(row) else None) for coluna, posicao in posicoes.items()}
+    
+    return linhas(), None
+
+def abrir_relatorio_uuids(caminho):
+    """Arquivo texto com um UUID por linha (linhas vazias, comentários '#' e cabeçalho são ignorados)."""
+    arquivo = open(caminho, encoding='utf-8-sig')
+    
+    def linhas():
+        with arquivo:
+            for linha in arquivo:
+                valor = linha.strip()
+                if not valor or valor.startswith('#') or valor == 'uuid_comum':
+                    continue
+                yield {'uuid_comum': valor}
+    
+    return linhas(), None
+
+def abrir_relatorio_parquet(caminho):
+    """Parquet lido em blocos, somente com as colunas de COLUNAS_RELATORIO (requer pyarrow)."""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("leitura de Parquet requer o pacote pyarrow (pip install pyarrow)")
+    
+    arquivo = pq.ParquetFile(caminho)
+    posicoes_colunas_relatorio(arquivo.schema_arrow.names, 'schema do Parquet')
     
-    LIMITE_REGISTROS = int(os.getenv('LIMITE_REGISTROS', '0'))
+    def linhas():
+        for bloco in arquivo.iter_batches(batch_size=65536, columns=list(COLUNAS_RELATORIO)):
+            yield from bloco.to_pylist()
     
-    return DB_GESTAO, DB_CONTRATO, DB_PESSOA, SSH_CONFIG, SENHA_ACCOUNTS, URL_ACCOUNTS, DB_ACCOUNTS_NAME_USER, LIMITE_REGISTROS
+    return linhas(), arquivo.metadata.num_rows
 
-# --- FUNÇÕES AUXILIARES ---
-def limpar_cpf(cpf):
-    """Remove caracteres não numéricos."""
-    if not cpf: return None
-    return re.sub(r'\D', '', str(cpf))
+def abrir_relatorio_arrow(caminho):
+    """Arquivo Arrow IPC / Feather v2, mapeado em memória e lido por record batch (requer pyarrow)."""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError("leitura de Arrow/Feather requer o pacote pyarrow (pip install pyarrow)")
+    
+    leitor = pa.ipc.open_file(pa.memory_map(caminho, 'r'))
+    posicoes_colunas_relatorio(leitor.schema.names, 'schema do Arrow')
+    
+    def linhas():
+        for i in range(leitor.num_record_batches):
+            yield from leitor.get_batch(i).select(list(COLUNAS_RELATORIO)).to_pylist()
+    
+    total_estimado = sum(leitor.get_batch(i).num_rows for i in range(leitor.num_record_batches))
+    return linhas(), total_estimado
 
-def formatar_cpf(cpf):
-    """Aplica máscara de CPF."""
-    c = limpar_cpf(cpf)
-    if not c or len(c) != 11: return c
-    return f"{c[:3]}.{c[3:6]}.{c[6:9]}-{c[9:]}"
+# Formatos aceitos, pela extensão do arquivo (na ordem de busca do relatório)
+LEITORES_RELATORIO = {
+    '.parquet': abrir_relatorio_parquet,
+    '.arrow': abrir_relatorio_arrow,
+    '.feather': abrir_relatorio_arrow,
+    '.csv': abrir_relatorio_csv,
+    '.txt': abrir_relatorio_uuids,
+    '.uuids': abrir_relatorio_uuids,
+    '.xlsx': abrir_relatorio_xlsx,
+}
 
-def comparar_campos(dict1, dict2, campos):
+def posicoes_colunas_relatorio(headers, origem):
+    """Retorna {coluna: posição} das colunas de COLUNAS_RELATORIO no cabeçalho informado."""
+    headers = list(headers)
+    posicoes = {}
+    for coluna in COLUNAS_RELATORIO:
+        if coluna not in headers:
+            raise ValueError(f"coluna '{coluna}' não encontrada no {origem}")
+        posicoes[coluna] = headers.index(coluna)
+    return posicoes
+
+def localizar_relatorio(cliente_nome):
     """
-    Compara campos entre dois dicionários.
-    Retorna dict com campos divergentes: {'campo': (valor1, valor2)}
+    Localiza o relatório de entrada do cliente. Usa ARQUIVO_RELATORIO se definido;
+    senão procura relatorio_<cliente>.<extensão> nas pastas conhecidas, nas
+    extensões de LEITORES_RELATORIO.
     """
-    divergencias = {}
-    for campo in campos:
-        val1 = dict1.get(campo)
-        val2 = dict2.get(campo)
-        
-        # Normaliza valores para comparação
-        if campo == 'cpf_cnpj' or campo == 'cpf':
-            val1 = limpar_cpf(val1)
-            val2 = limpar_cpf(val2)
-        elif isinstance(val1, str):
-            val1 = val1.strip() if val1 else None
-        if isinstance(val2, str):
-            val2 = val2.strip() if val2 else None
-            
-        if val1 != val2:
-            divergencias[campo] = (val1, val2)
+    arquivo_informado = os.getenv('ARQUIVO_RELATORIO', '').strip()
+    if arquivo_informado:
+        if not os.path.exists(arquivo_informado):
+            print(f"\n❌ ERRO: Relatório informado em ARQUIVO_RELATORIO não existe: {arquivo_informado}")
+            sys.exit(1)
+        return arquivo_informado
     
-    return divergencias
-
-def verificar_porta_disponivel(port):
-    """Verifica se uma porta está disponível para uso."""
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    try:
-        sock.bind(('127.0.0.1', port))
-        sock.close()
-        return True
-    except OSError:
-        return False
-
-def aguardar_porta_aberta(port, timeout=10):
-    """Aguarda até que a porta esteja aberta e aceitando conexões."""
-    inicio = time.time()
-    while time.time() - inicio < timeout:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            sock.connect(('127.0.0.1', port))
-            sock.close()
-            return True
-        except (socket.error, ConnectionRefusedError):
-            time.sleep(0.5)
-    return False
-
-@contextmanager
-def gerenciar_tunnel_ssh(SSH_CONFIG):
-    """Context manager para gerenciar ciclo de vida do túnel SSH."""
-    processo_ssh = None
+    nome_base = f'relatorio_{cliente_nome.lower().replace(" ", "_")}'
+    pastas_possiveis = [
+        os.path.join(os.getcwd(), '..', 'analise-inconsistencia'),
+        os.getcwd(),
+        os.path.join(os.getcwd(), '..'),
+    ]
     
-    try:
-        print(f"[SSH] Conectando ao servidor {SSH_CONFIG['ssh_host']}:{SSH_CONFIG['ssh_port']}...")
-        
-        if not verificar_porta_disponivel(SSH_CONFIG['local_bind_port']):
-            print(f"[SSH] Aviso: Porta {SSH_CONFIG['local_bind_port']} já está em uso.")
-            print(f"[SSH] Assumindo que o túnel já está ativo...")
-            yield None
-            return
-        
-        remote_host, remote_port = SSH_CONFIG['remote_bind_address']
-        
-        ssh_cmd = [
-            'ssh',
-            '-L', f"{SSH_CONFIG['local_bind_port']}:{remote_host}:{remote_port}",
-            '-p', str(SSH_CONFIG['ssh_port']),
-            '-l', SSH_CONFIG['ssh_user'],
-            SSH_CONFIG['ssh_host'],
-            '-N',
-            '-o', 'StrictHostKeyChecking=no',
-            '-o', 'ServerAliveInterval=60',
-            '-o', 'ServerAliveCountMax=3'
-        ]
-        
-        if SSH_CONFIG['ssh_pkey']:
-            ssh_cmd.insert(1, '-i')
-            ssh_cmd.insert(2, SSH_CONFIG['ssh_pkey'])
-        
-        print(f"[SSH] Estabelecendo túnel: localhost:{SSH_CONFIG['local_bind_port']} -> {remote_host}:{remote_port}")
-        
-        if os.name == 'nt':
-            processo_ssh = subprocess.Popen(
-                ssh_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                stdin=subprocess.PIPE,
-                creationflags=subprocess.CREATE_NEW_PROCESS_GROUP
-            )
-        else:
-            processo_ssh = subprocess.Popen(
-                ssh_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                stdin=subprocess.PIPE,
-                preexec_fn=os.setsid
-            )
-        
-        if SSH_CONFIG['ssh_password'] and not SSH_CONFIG['ssh_pkey']:
-            print("[SSH] Nota: Para autenticação por senha, considere usar chave SSH.")
-        
-        print(f"[SSH] Aguardando túnel ficar ativo...", end=" ")
-        if aguardar_porta_aberta(SSH_CONFIG['local_bind_port'], timeout=15):
-            print("✓")
-            print(f"[SSH] Túnel SSH estabelecido com sucesso!")
-        else:
-            raise Exception("Timeout ao aguardar túnel SSH ficar ativo")
-        
-        yield processo_ssh
-        
-    except FileNotFoundError:
-        print(f"[SSH] ERRO: Comando 'ssh' não encontrado no sistema.")
-        print(f"[SSH] Certifique-se de que o OpenSSH está instalado.")
-        sys.exit(1)
-    except Exception as e:
-        print(f"[SSH] Erro ao estabelecer túnel: {e}")
-        if processo_ssh:
-            try:
-                processo_ssh.terminate()
-            except:
-                pass
-        sys.exit(1)
-    finally:
-        if processo_ssh:
-            print("[SSH] Encerrando túnel SSH...", end=" ")
-            try:
-                processo_ssh.terminate()
-                processo_ssh.wait(timeout=5)
-                print("✓")
-            except:
-                try:
-                    processo_ssh.kill()
-                    print("✓ (forçado)")
-                except:
-                    print("⚠️  (processo pode continuar em background)")
-            print("[SSH] Túnel SSH encerrado.")
-
-def ajustar_hosts_para_tunnel(db_config, SSH_CONFIG):
-    """Ajusta host e porta dos bancos para usar túnel SSH."""
-    config = db_config.copy()
-    config['host'] = '127.0.0.1'
-    config['port'] = SSH_CONFIG['local_bind_port']
-    return config
+    # Tenta encontrar o arquivo em diferentes localizações e formatos
+    for pasta in pastas_possiveis:
+        for extensao in LEITORES_RELATORIO:
+            local = os.path.join(pasta, nome_base + extensao)
+            if os.path.exists(local):
+                return local
+    
+    print(f"\n❌ ERRO: Relatório não encontrado!")
+    print(f"\nArquivo procurado: {nome_base}.{{{','.join(e.lstrip('.') for e in LEITORES_RELATORIO)}}}")
+    print(f"\nLocais verificados:")
+    for pasta in pastas_possiveis:
+        print(f"  - {pasta}")
+    print(f"\n💡 Execute primeiro o script de análise para gerar o relatório.")
+    sys.exit(1)
 
 def ler_relatorio_emails_duplicados(cliente_nome):
-    """Lê o relatório de emails duplicados gerado pelo script de análise."""
-    nome_arquivo = f'relatorio_{cliente_nome.lower().replace(" ", "_")}.xlsx'
-    caminho = os.path.join(os.getcwd(), '..', 'analise-inconsistencia', nome_arquivo)
-    
-    # Tenta encontrar o arquivo em diferentes localizações
-    locais_possiveis = [
-        caminho,
-        os.path.join(os.getcwd(), nome_arquivo),
-        os.path.join(os.getcwd(), '..', nome_arquivo),
-    ]
+    """
+    Abre o relatório de emails duplicados (xlsx, csv, lista de UUIDs, Parquet ou Arrow).
+    Retorna (registros, total_estimado, caminho): os registros são lidos sob
+    demanda por um gerador; total_estimado pode ser None quando o formato não o informa.
+    """
+    arquivo_encontrado = localizar_relatorio(cliente_nome)
+    extensao = os.path.splitext(arquivo_encontrado)[1].lower()
     
-    arquivo_encontrado = None
-    for local in locais_possiveis:
-        if os.path.exists(local):
-            arquivo_encontrado = local
-            break
-    
-    if not arquivo_encontrado:
-        print(f"\n❌ ERRO: Relatório não encontrado!")
-        print(f"\nArquivo procurado: {nome_arquivo}")
-        print(f"\nLocais verificados:")
-        for local in locais_possiveis:
-            print(f"  - {local}")
-        print(f"\n💡 Execute primeiro o script de análise para gerar o relatório.")
+    leitor = LEITORES_RELATORIO.get(extensao)
+    if not leitor:
+        print(f"❌ Formato de relatório não suportado: {extensao} (aceitos: {', '.join(LEITORES_RELATORIO)})")
         sys.exit(1)
     
     print(f"[Relatório] Lendo: {arquivo_encontrado}")
     
     try:
-        wb = load_workbook(arquivo_encontrado)
-        ws = wb['1-Emails Duplicados']
-        
-        registros = []
-        headers = [cell.value for cell in ws[1]]
-        
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            if row[0]:  # Se tem UUID
-                registro = dict(zip(headers, row))
-                registros.append(registro)
-        
-        wb.close()
-        print(f"[Relatório] {len(registros)} registros carregados")
-        return registros
-        
+        linhas, total_estimado = leitor(arquivo_encontrado)
     except Exception as e:
         print(f"❌ Erro ao ler relatório: {e}")
         sys.exit(1)
+    
+    return iterar_registros_relatorio(linhas), total_estimado, arquivo_encontrado
+
+def iterar_registros_relatorio(linhas):
+    """
+    Gera os registros do relatório sob demanda, descartando linhas sem UUID
+    e UUIDs repetidos durante a leitura. O UUID sai sem espaços nas bordas:
+    é o valor usado nas consultas por sso_id do lote.
+    """
+    uuids_vistos = set()
+    carregados = 0
+    duplicados = 0
+    
+    for registro in linhas:
+        if not registro.get('uuid_comum'):  # Sem UUID
+            continue
+        
+        uuid = str(registro['uuid_comum']).strip()
+        chave = normalizar_uuid(uuid) or uuid
+        if chave in uuids_vistos:
+            duplicados += 1
+            continue
+        uuids_vistos.add(chave)
+        
+        carregados += 1
+        if uuid != registro['uuid_comum']:
+            registro = dict(registro, uuid_comum=uuid)
+        yield registro
+    
+    print(f"\n[Relatório] {carregados} registros lidos ({duplicados} UUID(s) duplicado(s) ignorado(s))")
+
+# Linhas de cada aba usadas para calcular a largura das colunas
+AMOSTRA_LARGURA_COLUNAS = 100
+
+def escrever_aba_excel(wb, nome_aba, dados, cabecalho):
+    """
+    Cria uma aba no workbook write_only e grava as linhas à medida que são produzidas.
+    As primeiras AMOSTRA_LARGURA_COLUNAS linhas ficam em memória só até a largura das
+    colunas ser calculada (no modo write_only, larguras e painéis congelados precisam
+    ser definidos antes da primeira linha). Retorna a quantidade de registros gravados.
+    """
+    from openpyxl.styles import Font, PatternFill, Alignment
+    from openpyxl.utils import get_column_letter
+    from openpyxl.cell import WriteOnlyCell
+    
+    ws = wb.create_sheet(title=nome_aba)
+    
+    # Estiliza cabeçalho
+    header_fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
+    header_font = Font(bold=True, color='FFFFFF', size=11)
+    header_alignment = Alignment(horizontal='center', vertical='center')
+    
+    linha_cabecalho = []
+    for col_name in cabecalho:
+        cell = WriteOnlyCell(ws, value=col_name)
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = header_alignment
+        linha_cabecalho.append(cell)
+    
+    linhas = ([item.get(col, '') for col in cabecalho] for item in dados)
+    amostra = list(islice(linhas, AMOSTRA_LARGURA_COLUNAS))
+    
+    if not amostra:
+        ws.append(linha_cabecalho)
+        ws.append(['Nenhum registro encontrado'])
+        return 0
+    
+    # Ajusta largura das colunas pela amostra
+    larguras = [len(str(col_name)) for col_name in cabecalho]
+    for linha in amostra:
+        for col_num, valor in enumerate(linha):
+            larguras[col_num] = max(larguras[col_num], len(str(valor)))
+    for col_num, largura in enumerate(larguras, 1):
+        ws.column_dimensions[get_column_letter(col_num)].width = min(largura + 2, 50)
+    
+    ws.freeze_panes = 'A2'
+    
+    ws.append(linha_cabecalho)
+    total = 0
+    for linha in chain(amostra, linhas):
+        ws.append(linha)
+        total += 1
+    return total
 
 def salvar_excel_consolidado(relatorios_dict, nome_arquivo='ajuste_executado.xlsx'):
-    """Salva múltiplos relatórios em um único arquivo Excel com abas separadas."""
+    """
+    Salva múltiplos relatórios em um único arquivo Excel com abas separadas.
+    Usa um Workbook write_only: as linhas de cada aba são gravadas em disco
+    conforme os dados (listas ou geradores) são consumidos.
+    Retorna o caminho do arquivo, ou None se não foi possível gravá-lo.
+    """
+    from openpyxl import Workbook
+    
     caminho = os.path.join(os.getcwd(), nome_arquivo)
     
     try:
-        wb = Workbook()
-        if 'Sheet' in wb.sheetnames:
-            wb.remove(wb['Sheet'])
+        wb = Workbook(write_only=True)
         
+        total_registros = 0
         for nome_aba, (dados, cabecalho) in relatorios_dict.items():
-            ws = wb.create_sheet(title=nome_aba)
-            
-            if not dados:
-                ws.append(cabecalho)
-                ws.append(['Nenhum registro encontrado'])
-                continue
-            
-            ws.append(cabecalho)
-            
-            # Estiliza cabeçalho
-            header_fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-            header_font = Font(bold=True, color='FFFFFF', size=11)
-            header_alignment = Alignment(horizontal='center', vertical='center')
-            
-            for col_num, _ in enumerate(cabecalho, 1):
-                cell = ws.cell(row=1, column=col_num)
-                cell.fill = header_fill
-                cell.font = header_font
-                cell.alignment = header_alignment
-            
-            # Adiciona dados
-            for item in dados:
-                linha = [item.get(col, '') for col in cabecalho]
-                ws.append(linha)
-            
-            # Ajusta largura das colunas
-            for col_num, col_name in enumerate(cabecalho, 1):
-                column_letter = get_column_letter(col_num)
-                max_length = len(str(col_name))
-                for row in ws.iter_rows(min_row=2, max_row=min(100, len(dados)+1), min_col=col_num, max_col=col_num):
-                    for cell in row:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                adjusted_width = min(max_length + 2, 50)
-                ws.column_dimensions[column_letter].width = adjusted_width
-            
-            ws.freeze_panes = 'A2'
+            total_registros += escrever_aba_excel(wb, nome_aba, dados, cabecalho)
         
         wb.save(caminho)
         
-        total_registros = sum(len(dados) for dados, _ in relatorios_dict.values())
         print(f"\n📊 Relatório de execução salvo: {caminho}")
         print(f"   └─ {len(relatorios_dict)} abas criadas | {total_registros} registros totais")
+        return caminho
         
     except Exception as e:
         print(f"⚠️  Erro ao salvar arquivo Excel: {e}")
+        return None
 
-def main():
+def main(modo='completo'):
+    """
+    Ajuste de um cliente. modo 'completo' analisa, pede confirmação e executa;
+    'plan' só analisa e grava o plano de ações; 'apply' executa um plano já gravado,
+    sem repetir a análise.
+    """
     # Carrega configurações
     try:
-        DB_GESTAO, DB_CONTRATO, DB_PESSOA, SSH_CONFIG, SENHA_ACCOUNTS, URL_ACCOUNTS, DB_ACCOUNTS_NAME_USER, LIMITE_REGISTROS = carregar_configuracoes()
+        DB_GESTAO, DB_CONTRATO, DB_PESSOA, SSH_CONFIG, SENHA_ACCOUNTS, URL_ACCOUNTS, DB_ACCOUNTS_NAME_USER, BUSCA_CPF_SEGURADO, LIMITE_REGISTROS, TAMANHO_LOTE, TAMANHO_PAGINA_UPDATE, COMMIT_A_CADA, WORKERS_PIPELINE, MOTOR_COMPARACAO, MODO_INCREMENTAL, CACHE_ACCOUNTS, SAIDA_ANALISE = carregar_configuracoes()
     except ValueError as e:
         print(f"❌ ERRO: {e}")
         sys.exit(1)
     
     cliente_nome = os.getenv('NOME_CLIENTE', 'CLIENTE')
+    # Resumo devolvido ao final (usado pelo modo multicliente)
+    resumo = {'cliente': cliente_nome}
     
     print(f"\n--- INICIANDO AJUSTE DE INCONSISTÊNCIAS [{cliente_nome}] ---")
     
+    # Tempos das etapas e latência das consultas (aba 6-Performance)
+    METRICAS.reiniciar()
+    METRICAS.iniciar_etapa('Túnel SSH')
+    
     # Gerencia túnel SSH automaticamente
-    with gerenciar_tunnel_ssh(SSH_CONFIG):
+    with gerenciar_tunnel_ssh(SSH_CONFIG) as tunel:
         # Ajusta configurações dos bancos para usar túnel
         db_gestao_ajustado = ajustar_hosts_para_tunnel(DB_GESTAO, SSH_CONFIG)
         db_contrato_ajustado = ajustar_hosts_para_tunnel(DB_CONTRATO, SSH_CONFIG)
@@ -422,320 +2800,497 @@ def main():
         print("\n" + "="*60)
         print("ETAPA 1: CARREGAMENTO DE DADOS")
         print("="*60)
+        METRICAS.iniciar_etapa('ETAPA 1 - Carregamento de dados')
         
-        registros = ler_relatorio_emails_duplicados(cliente_nome)
+        registros, total_registros, arquivo_relatorio = ler_relatorio_emails_duplicados(cliente_nome)
         
-        if not registros:
+        primeiro_registro = next(registros, None)
+        if primeiro_registro is None:
             print("❌ Nenhum registro de email duplicado encontrado no relatório.")
-            return
+            return dict(resumo, status='SEM REGISTROS')
+        registros = chain([primeiro_registro], registros)
         
         # Aplica limite de registros se configurado
         MODO_DEBUG = False
         if LIMITE_REGISTROS > 0:
-            registros = registros[:LIMITE_REGISTROS]
+            registros = islice(registros, LIMITE_REGISTROS)
+            total_registros = min(total_registros, LIMITE_REGISTROS) if total_registros else LIMITE_REGISTROS
             if LIMITE_REGISTROS == 1:
                 MODO_DEBUG = True
                 print(f"🔍 MODO DEBUG ATIVADO: Processamento interativo detalhado")
             else:
-                print(f"⚠️  LIMITE ATIVO: Processando apenas {len(registros)} registros (LIMITE_REGISTROS={LIMITE_REGISTROS})")
+                print(f"⚠️  LIMITE ATIVO: Processando até {LIMITE_REGISTROS} registros (LIMITE_REGISTROS={LIMITE_REGISTROS})")
         else:
-            print(f"📊 Processando todos os {len(registros)} registros")
+            print(f"📊 Processando todos os registros (~{total_registros or '?'} linhas no relatório)")
+        total_exibicao = total_registros or '?'
         
-        # Listas para relatório final
-        lista_updates_gestao = []
-        lista_updates_contrato = []
-        lista_desvinculacoes = []
-        lista_erros = []
-        lista_ignorados = []
+        # Checkpoint de uma execução anterior interrompida
+        assinatura_relatorio = dict(assinatura_arquivo(arquivo_relatorio), limite=LIMITE_REGISTROS)
+        checkpoint = carregar_checkpoint(cliente_nome, assinatura_relatorio)
+        inicio_retomada = min(checkpoint.get(tabela, 0) for tabela in OPERACOES_UPDATE) if checkpoint else 0
+        if checkpoint:
+            print(f"♻️  Checkpoint encontrado: {', '.join(f'{t} até #{i}' for t, i in checkpoint.items())}")
+            if inicio_retomada:
+                print(f"   Retomando a análise a partir do registro #{inicio_retomada + 1}")
         
-        contador_processados = 0
-        contador_atualizados_gestao = 0
-        contador_atualizados_contrato = 0
-        contador_desvinculados = 0
+        # Plano de ações de uma análise anterior concluída para o mesmo relatório
+        plano_anterior = carregar_plano(cliente_nome, assinatura_relatorio, checkpoint) if modo != 'plan' else None
+        reutilizar_plano = False
+        if modo == 'apply':
+            if not plano_anterior:
+                print(f"❌ Nenhum plano de ações válido para este relatório ({os.path.basename(caminho_plano(cliente_nome))}).")
+                print("   Gere o plano com: python main.py plan")
+                return dict(resumo, status='SEM PLANO')
+            analise_anterior = plano_anterior['analise']
+            print(f"📝 Aplicando o plano de ações {os.path.basename(caminho_plano(cliente_nome))} "
+                  f"(análise concluída em {analise_anterior['concluida_em']}, integridade conferida)")
+            reutilizar_plano = True
+        elif plano_anterior:
+            analise_anterior = plano_anterior['analise']
+            print(f"📝 Plano de ações encontrado: {os.path.basename(caminho_plano(cliente_nome))} "
+                  f"(análise concluída em {analise_anterior['concluida_em']})")
+            # REUTILIZAR_PLANO=S/N responde sem interação
+            resposta = os.getenv('REUTILIZAR_PLANO', '').strip().upper()
+            if resposta in ('S', 'N'):
+                print(f"Aplicar o plano sem repetir a análise? (S/N): {resposta} (REUTILIZAR_PLANO)")
+            else:
+                resposta = input("Aplicar o plano sem repetir a análise? (S/N): ").strip().upper()
+            reutilizar_plano = resposta in ['S', 'SIM', 'Y', 'YES']
         
         print("\n" + "="*60)
         print("ETAPA 2: ANÁLISE E PREPARAÇÃO DE UPDATES")
         print("="*60)
+        METRICAS.iniciar_etapa('ETAPA 2 - Análise')
+        
+        contador_conexoes_remotas = 0
+        # Conexões do pool são abertas pelas threads do pipeline (e de novo a cada reconexão)
+        trava_conexoes_remotas = threading.Lock()
         
-        # Conexões com os bancos
+        def preparar_conexao_gestao(conn):
+            # Conexão dblink nomeada com accounts, reutilizada em todos os lotes da conexão
+            nonlocal contador_conexoes_remotas
+            if abrir_conexao_dblink(conn, URL_ACCOUNTS, DB_ACCOUNTS_NAME_USER, SENHA_ACCOUNTS):
+                with trava_conexoes_remotas:
+                    contador_conexoes_remotas += 1
+        
+        # Pools de conexões com os bancos: uma conexão por worker do pipeline,
+        # mais a conexão principal (verificações e execução dos UPDATEs)
+        pool_gestao = None
+        pool_contrato = None
+        diario = None
+        estado = None
+        saida = None
+        conn_gestao = None
+        conn_contrato = None
         try:
-            conn_gestao = psycopg2.connect(**db_gestao_ajustado)
-            conn_contrato = psycopg2.connect(**db_contrato_ajustado)
+            pool_gestao = PoolConexoes('gestao', db_gestao_ajustado, WORKERS_PIPELINE + 1,
+                                       ao_conectar=preparar_conexao_gestao, ao_fechar=fechar_conexao_dblink,
+                                       ao_reconectar=tunel.restaurar)
+            pool_contrato = PoolConexoes('contrato', db_contrato_ajustado, WORKERS_PIPELINE + 1,
+                                         ao_reconectar=tunel.restaurar)
+            conn_gestao = pool_gestao.obter()
+            conn_contrato = pool_contrato.obter()
             
             print("[Conexões] Bancos conectados com sucesso!")
+            print(f"[dblink] Conexão '{NOME_CONEXAO_DBLINK}' com accounts aberta.")
+            
+            # Cache local de accounts (origem: servidor e banco do dblink)
+            cache_accounts = obter_cache_accounts(CACHE_ACCOUNTS, f"{URL_ACCOUNTS}/{DB_ACCOUNTS_NAME_USER}")
+            if cache_accounts:
+                print(f"[Cache accounts] LRU de {cache_accounts.max_memoria} registro(s), TTL {cache_accounts.ttl}s"
+                      f"{f', disco: {cache_accounts.arquivo}' if cache_accounts.arquivo else ''}"
+                      f"{' - atualização forçada' if cache_accounts.forcar_atualizacao else ''}")
             
-            # Processa cada registro
-            for idx, registro in enumerate(registros, 1):
-                uuid = registro['uuid_comum']
+            if MODO_INCREMENTAL:
+                estado = EstadoIncremental(caminho_estado(cliente_nome))
+                print(f"[Incremental] Estado da última execução: {os.path.basename(estado.caminho)}")
+            
+            if reutilizar_plano:
+                # Análise já feita: contadores e parâmetros vêm do plano
+                print("♻️  Usando o plano de ações existente - análise não será repetida")
+                analise = analise_anterior
+            else:
+                # Verifica índice de CPF normalizado em segurado
+                expressao_cpf_segurado, modo_busca_cpf = preparar_busca_cpf_segurado(conn_contrato, db_contrato_ajustado, BUSCA_CPF_SEGURADO)
                 
-                if MODO_DEBUG:
-                    print("\n" + "="*70)
-                    print(f"🔍 ANÁLISE DETALHADA - REGISTRO {idx}/{len(registros)}")
-                    print("="*70)
-                    print(f"UUID: {uuid}")
-                else:
-                    print(f"\n[{idx}/{len(registros)}] Processando UUID: {uuid}")
+                # Comparação no banco: só vale para tabelas cujas colunas comparadas são texto
+                tipo_sso_id_gestao = None
+                tipo_sso_id_contrato = None
+                if MOTOR_COMPARACAO == 'sql':
+                    tipo_sso_id_gestao = preparar_comparacao_sql(conn_gestao, 'tb_usuario')
+                    tipo_sso_id_contrato = preparar_comparacao_sql(conn_contrato, 'usuario')
+                    print(f"[Comparação] tb_usuario: {'sql' if tipo_sso_id_gestao else 'python'} | "
+                          f"usuario: {'sql' if tipo_sso_id_contrato else 'python'}")
                 
-                try:
-                    # 1. Buscar dados em accounts (via dblink)
-                    cur_gestao = conn_gestao.cursor(cursor_factory=RealDictCursor)
-                    sql_accounts = f"""
-                        SELECT id, cpf_cnpj, name, email, phone
-                        FROM dblink(
-                            'host={URL_ACCOUNTS} dbname={DB_ACCOUNTS_NAME_USER} user={DB_ACCOUNTS_NAME_USER} password={SENHA_ACCOUNTS}',
-                            'SELECT id, cpf_cnpj, name, email, phone FROM users WHERE id = ''{uuid}'''
-                        ) AS accounts(id uuid, cpf_cnpj varchar, name varchar, email varchar, phone varchar)
-                    """
-                    cur_gestao.execute(sql_accounts)
-                    dados_accounts = cur_gestao.fetchone()
-                    
-                    if not dados_accounts:
-                        print(f"  ⚠️  UUID não encontrado em accounts - IGNORANDO")
-                        lista_ignorados.append({
-                            'uuid': uuid,
-                            'motivo': 'UUID não encontrado em accounts'
-                        })
-                        continue
+                if WORKERS_PIPELINE > 1:
+                    print(f"[Pipeline] {WORKERS_PIPELINE} worker(s) por estágio (gestao/accounts e contrato)")
+                
+                # Plano de ações em disco: cada ação planejada vai direto para o arquivo
+                diario = DiarioAcoes(caminho_plano(cliente_nome), {
+                    'cliente': cliente_nome,
+                    'assinatura': assinatura_relatorio,
+                    'checkpoint': checkpoint,
+                    'criado_em': time.strftime('%Y-%m-%d %H:%M:%S')
+                })
+                contador_processados = 0
+                contador_inalterados = 0
+                ja_aplicados = 0
+                acoes_registro = 0
+                acoes_no_plano = 0
+                ignorados_a_partir_de = None
+                
+                # Registros anteriores à retomada não são analisados de novo: os seus ignorados
+                # e erros vêm da execução interrompida, para que as abas 4 e 5 fiquem completas
+                if inicio_retomada:
+                    anteriores = carregar_ignorados_checkpoint(cliente_nome, inicio_retomada)
+                    if anteriores is None:
+                        ignorados_a_partir_de = inicio_retomada + 1
+                        print(f"⚠️  Ignorados/erros da execução interrompida indisponíveis: as abas 4-Ignorados e "
+                              f"5-Erros cobrirão só a partir do registro #{ignorados_a_partir_de}")
+                    else:
+                        for registro in anteriores:
+                            diario.registrar(registro)
+                        if anteriores:
+                            print(f"♻️  {len(anteriores)} ignorado(s)/erro(s) de registros anteriores ao checkpoint mantidos no relatório")
+                
+                def planejar(registro):
+                    # Ações já confirmadas em uma execução anterior (checkpoint) não entram no plano
+                    nonlocal ja_aplicados, acoes_registro, acoes_no_plano
+                    acoes_registro += 1
+                    if registro.indice <= checkpoint.get(registro.TIPO, 0):
+                        ja_aplicados += 1
+                    else:
+                        acoes_no_plano += 1
+                        diario.registrar(registro)
+                
+                # Pula os registros já confirmados e processa o restante em lotes (uma chamada ao dblink por lote).
+                # Enquanto um lote é comparado aqui, os seguintes já estão sendo buscados nos bancos.
+                registros = islice(registros, inicio_retomada, None)
+                cargas = executar_pipeline_lotes(
+                    ({'inicio': inicio_lote, 'lote': lote} for inicio_lote, lote in dividir_em_lotes(registros, TAMANHO_LOTE, inicio_retomada)),
+                    [(estagio_accounts_gestao(tipo_sso_id_gestao, estado, cache_accounts), [pool_gestao] * WORKERS_PIPELINE),
+                     (estagio_contrato(expressao_cpf_segurado, tipo_sso_id_contrato), [pool_contrato] * WORKERS_PIPELINE)],
+                    lotes_em_voo=2 * WORKERS_PIPELINE + 1
+                )
+                # Modo debug é interativo: o detalhe de cada registro sempre vai para o console
+                saida = SaidaAnalise('detalhado' if MODO_DEBUG else SAIDA_ANALISE['verbosidade'], total_registros,
+                                     inicio_retomada, caminho_log_analise(cliente_nome) if SAIDA_ANALISE['log'] else None)
+                if saida.caminho_log:
+                    print(f"[Saída] Detalhe por registro em {os.path.basename(saida.caminho_log)}")
+                uuid_validar = None
+                idx = inicio_retomada
+                for carga in cargas:
+                    inicio_lote, lote = carga['inicio'], carga['lote']
+                    if uuid_validar is None:
+                        uuid_validar = lote[0]['uuid_comum']
                     
-                    cpf_accounts = limpar_cpf(dados_accounts['cpf_cnpj'])
-                    if not cpf_accounts:
-                        print(f"  ⚠️  CPF vazio em accounts - IGNORANDO")
-                        lista_ignorados.append({
-                            'uuid': uuid,
-                            'motivo': 'CPF vazio em accounts'
-                        })
+                    if 'erro' in carga:
+                        saida.aviso(f"\n❌ {carga['erro']}")
+                        for idx, registro in enumerate(lote, inicio_lote + 1):
+                            diario.registrar(ErroRegistro(registro['uuid_comum'], carga['erro'], idx))
                         continue
                     
-                    if MODO_DEBUG:
-                        print(f"\n📋 DADOS EM ACCOUNTS (Fonte da Verdade):")
-                        print(f"   CPF......: {formatar_cpf(cpf_accounts)}")
-                        print(f"   Nome.....: {dados_accounts['name']}")
-                        print(f"   Email....: {dados_accounts['email']}")
-                        print(f"   Telefone.: {dados_accounts['phone'] or 'N/A'}")
-                    else:
-                        print(f"  ✓ Accounts: CPF={formatar_cpf(cpf_accounts)}, Nome={dados_accounts['name']}")
-                    
-                    # 2. Verificar existência em segurado (por CPF)
-                    cur_contrato = conn_contrato.cursor(cursor_factory=RealDictCursor)
-                    sql_segurado = """
-                        SELECT id, cpf_cnpj, usuario_id, nome
-                        FROM segurado
-                        WHERE REGEXP_REPLACE(cpf_cnpj, '\D', '', 'g') = %s
-                        LIMIT 1
-                    """
-                    cur_contrato.execute(sql_segurado, (cpf_accounts,))
-                    dados_segurado = cur_contrato.fetchone()
+                    # Dados do lote já carregados pelos estágios do pipeline (sem consultas por registro)
+                    accounts_lote = carga['accounts']
+                    segurados_por_cpf = carga['segurados_por_cpf']
+                    usuarios_gestao = carga['usuarios_gestao']
+                    usuarios_contrato = carga['usuarios_contrato']
+                    segurados_por_usuario = carga['segurados_por_usuario']
+                    inalterados = carga['inalterados']
+                    resultados_estado = []
                     
-                    if not dados_segurado:
-                        print(f"  ⚠️  CPF não encontrado em segurado - IGNORANDO")
-                        lista_ignorados.append({
-                            'uuid': uuid,
-                            'cpf_accounts': formatar_cpf(cpf_accounts),
-                            'motivo': 'CPF não encontrado em segurado'
-                        })
-                        continue
+                    if not MODO_DEBUG:
+                        saida.detalhe(f"\n[Accounts] Lote {inicio_lote // TAMANHO_LOTE + 1}: {len(accounts_lote)}/{len(carga['uuids_lote'])} UUID(s) encontrados")
+                    if inalterados:
+                        saida.detalhe(f"[Incremental] {len(inalterados)} UUID(s) sem alteração em accounts desde a última execução - pulando")
                     
-                    if MODO_DEBUG:
-                        print(f"\n✅ VALIDAÇÃO: CPF existe em SEGURADO")
-                        print(f"   Segurado ID: {dados_segurado['id']}")
-                        print(f"   Nome.......: {dados_segurado['nome']}")
-                    else:
-                        print(f"  ✓ Segurado encontrado: ID={dados_segurado['id']}")
+                    for idx, registro in enumerate(lote, inicio_lote + 1):
+                        saida.progresso(idx, diario.contadores, contador_inalterados)
+                        uuid = registro['uuid_comum']
+                        if inalterados and normalizar_uuid(uuid) in inalterados:
+                            contador_inalterados += 1
+                            continue
+                        acoes_registro = 0
+                        acoes_no_plano = 0
                     
-                    # 3. Comparar e preparar update para gestao.tb_usuario
-                    sql_gestao_busca = """
-                        SELECT id, cpf_cnpj, name, email, phone
-                        FROM tb_usuario
-                        WHERE sso_id = %s
-                    """
-                    cur_gestao.execute(sql_gestao_busca, (uuid,))
-                    dados_gestao = cur_gestao.fetchone()
+                        if MODO_DEBUG:
+                            print("\n" + "="*70)
+                            print(f"🔍 ANÁLISE DETALHADA - REGISTRO {idx}/{total_exibicao}")
+                            print("="*70)
+                            print(f"UUID: {uuid}")
+                            contadores_antes = dict(diario.contadores)
+                        else:
+                            saida.detalhe(f"\n[{idx}/{total_exibicao}] Processando UUID: {uuid}")
                     
-                    if dados_gestao:
-                        campos_comparar = ['cpf_cnpj', 'name', 'email', 'phone']
-                        divergencias_gestao = comparar_campos(
-                            {'cpf_cnpj': cpf_accounts, 'name': dados_accounts['name'], 
-                             'email': dados_accounts['email'], 'phone': dados_accounts['phone']},
-                            dict(dados_gestao),
-                            campos_comparar
-                        )
+                        try:
+                            # 1. Dados de accounts já carregados no lote
+                            uuid_normalizado = normalizar_uuid(uuid)
+                            if not uuid_normalizado:
+                                raise ValueError(f"UUID inválido: {uuid}")
+                            dados_accounts = accounts_lote.get(uuid_normalizado)
+                        
+                            if not dados_accounts:
+                                saida.detalhe(f"  ⚠️  UUID não encontrado em accounts - IGNORANDO")
+                                diario.registrar(Ignorado(uuid, 'UUID não encontrado em accounts', indice=idx))
+                                continue
+                        
+                            # Forma normalizada do registro, calculada uma vez no estágio de accounts
+                            accounts_normalizado = carga['accounts_normalizado'][uuid_normalizado]
+                            cpf_accounts = accounts_normalizado['cpf_cnpj']
+                            cpf_accounts_formatado = accounts_normalizado['cpf_formatado']
+                            if not cpf_accounts:
+                                saida.detalhe(f"  ⚠️  CPF vazio em accounts - IGNORANDO")
+                                diario.registrar(Ignorado(uuid, 'CPF vazio em accounts', indice=idx))
+                                continue
                         
-                        if divergencias_gestao:
-                            if MODO_DEBUG:
-                                print(f"\n⚠️  DIVERGÊNCIAS EM GESTÃO.TB_USUARIO:")
-                                for campo, (val_correto, val_atual) in divergencias_gestao.items():
-                                    campo_label = {
-                                        'cpf_cnpj': 'CPF',
-                                        'name': 'Nome',
-                                        'email': 'Email',
-                                        'phone': 'Telefone'
-                                    }.get(campo, campo)
-                                    
-                                    if campo == 'cpf_cnpj':
-                                        val_correto = formatar_cpf(val_correto)
-                                        val_atual = formatar_cpf(val_atual)
-                                    
-                                    print(f"   {campo_label}:")
-                                    print(f"      Atual.....: {val_atual or 'N/A'}")
-                                    print(f"      Correto...: {val_correto or 'N/A'}")
-                            else:
-                                print(f"  → Gestão: {len(divergencias_gestao)} campo(s) divergente(s)")
-                            
-                            lista_updates_gestao.append({
-                                'uuid': uuid,
-                                'id_gestao': dados_gestao['id'],
-                                'cpf_antes': formatar_cpf(dados_gestao['cpf_cnpj']),
-                                'cpf_depois': formatar_cpf(cpf_accounts),
-                                'nome_antes': dados_gestao['name'],
-                                'nome_depois': dados_accounts['name'],
-                                'email_antes': dados_gestao['email'],
-                                'email_depois': dados_accounts['email'],
-                                'phone_antes': dados_gestao['phone'],
-                                'phone_depois': dados_accounts['phone'],
-                                'divergencias': str(list(divergencias_gestao.keys()))
-                            })
-                            contador_atualizados_gestao += 1
-                        else:
                             if MODO_DEBUG:
-                                print(f"\n✅ GESTÃO.TB_USUARIO: Dados consistentes")
+                                print(f"\n📋 DADOS EM ACCOUNTS (Fonte da Verdade):")
+                                print(f"   CPF......: {cpf_accounts_formatado}")
+                                print(f"   Nome.....: {dados_accounts['name']}")
+                                print(f"   Email....: {dados_accounts['email']}")
+                                print(f"   Telefone.: {dados_accounts['phone'] or 'N/A'}")
                             else:
-                                print(f"  ✓ Gestão: Dados consistentes")
-                    
-                    # 4. Comparar e preparar update para contrato.usuario
-                    sql_contrato_busca = """
-                        SELECT id, cpf_cnpj, nome, email
-                        FROM usuario
-                        WHERE sso_id = %s
-                    """
-                    cur_contrato.execute(sql_contrato_busca, (uuid,))
-                    dados_contrato_usuario = cur_contrato.fetchone()
-                    
-                    if dados_contrato_usuario:
-                        campos_comparar = ['cpf_cnpj', 'nome', 'email']
-                        divergencias_contrato = comparar_campos(
-                            {'cpf_cnpj': cpf_accounts, 'nome': dados_accounts['name'], 
-                             'email': dados_accounts['email']},
-                            {'cpf_cnpj': dados_contrato_usuario['cpf_cnpj'],
-                             'nome': dados_contrato_usuario['nome'],
-                             'email': dados_contrato_usuario['email']},
-                            campos_comparar
-                        )
+                                saida.detalhe(f"  ✓ Accounts: CPF={cpf_accounts_formatado}, Nome={dados_accounts['name']}")
+                        
+                            # 2. Verificar existência em segurado (por CPF)
+                            dados_segurado = segurados_por_cpf.get(cpf_accounts)
+                        
+                            if not dados_segurado:
+                                saida.detalhe(f"  ⚠️  CPF não encontrado em segurado - IGNORANDO")
+                                diario.registrar(Ignorado(uuid, 'CPF não encontrado em segurado', cpf_accounts_formatado, idx))
+                                continue
                         
-                        if divergencias_contrato:
                             if MODO_DEBUG:
-                                print(f"\n⚠️  DIVERGÊNCIAS EM CONTRATO.USUARIO:")
-                                for campo, (val_correto, val_atual) in divergencias_contrato.items():
-                                    campo_label = {
-                                        'cpf_cnpj': 'CPF',
-                                        'nome': 'Nome',
-                                        'email': 'Email'
-                                    }.get(campo, campo)
-                                    
-                                    if campo == 'cpf_cnpj':
-                                        val_correto = formatar_cpf(val_correto)
-                                        val_atual = formatar_cpf(val_atual)
-                                    
-                                    print(f"   {campo_label}:")
-                                    print(f"      Atual.....: {val_atual or 'N/A'}")
-                                    print(f"      Correto...: {val_correto or 'N/A'}")
+                                print(f"\n✅ VALIDAÇÃO: CPF existe em SEGURADO")
+                                print(f"   Segurado ID: {dados_segurado['id']}")
+                                print(f"   Nome.......: {dados_segurado['nome']}")
                             else:
-                                print(f"  → Contrato.usuario: {len(divergencias_contrato)} campo(s) divergente(s)")
+                                saida.detalhe(f"  ✓ Segurado encontrado: ID={dados_segurado['id']}")
+                        
+                            # 3. Comparar e preparar update para gestao.tb_usuario
+                            dados_gestao = usuarios_gestao.get(uuid_normalizado)
+                        
+                            if dados_gestao:
+                                campos_comparar = ['cpf_cnpj', 'name', 'email', 'phone']
+                                divergencias_gestao = calcular_divergencias(accounts_normalizado, dados_gestao, campos_comparar)
                             
-                            lista_updates_contrato.append({
-                                'uuid': uuid,
-                                'id_usuario': dados_contrato_usuario['id'],
-                                'cpf_antes': formatar_cpf(dados_contrato_usuario['cpf_cnpj']),
-                                'cpf_depois': formatar_cpf(cpf_accounts),
-                                'nome_antes': dados_contrato_usuario['nome'],
-                                'nome_depois': dados_accounts['name'],
-                                'email_antes': dados_contrato_usuario['email'],
-                                'email_depois': dados_accounts['email'],
-                                'divergencias': str(list(divergencias_contrato.keys()))
-                            })
-                            contador_atualizados_contrato += 1
-                        else:
-                            if MODO_DEBUG:
-                                print(f"\n✅ CONTRATO.USUARIO: Dados consistentes")
-                            else:
-                                print(f"  ✓ Contrato.usuario: Dados consistentes")
+                                if divergencias_gestao:
+                                    if MODO_DEBUG:
+                                        print(f"\n⚠️  DIVERGÊNCIAS EM GESTÃO.TB_USUARIO:")
+                                        for campo, (val_correto, val_atual) in divergencias_gestao.items():
+                                            campo_label = {
+                                                'cpf_cnpj': 'CPF',
+                                                'name': 'Nome',
+                                                'email': 'Email',
+                                                'phone': 'Telefone'
+                                            }.get(campo, campo)
+                                        
+                                            if campo == 'cpf_cnpj':
+                                                val_correto = formatar_cpf(val_correto)
+                                                val_atual = formatar_cpf(val_atual)
+                                        
+                                            print(f"   {campo_label}:")
+                                            print(f"      Atual.....: {val_atual or 'N/A'}")
+                                            print(f"      Correto...: {val_correto or 'N/A'}")
+                                    else:
+                                        saida.detalhe(f"  → Gestão: {len(divergencias_gestao)} campo(s) divergente(s)")
+                                
+                                    planejar(UpdateGestao(
+                                        indice=idx,
+                                        uuid=uuid,
+                                        id_gestao=dados_gestao['id'],
+                                        cpf_antes=formatar_cpf(dados_gestao['cpf_cnpj']),
+                                        cpf_depois=cpf_accounts_formatado,
+                                        nome_antes=dados_gestao['name'],
+                                        nome_depois=dados_accounts['name'],
+                                        email_antes=dados_gestao['email'],
+                                        email_depois=dados_accounts['email'],
+                                        phone_antes=dados_gestao['phone'],
+                                        phone_depois=dados_accounts['phone'],
+                                        divergencias=divergencias_gestao
+                                    ))
+                                else:
+                                    if MODO_DEBUG:
+                                        print(f"\n✅ GESTÃO.TB_USUARIO: Dados consistentes")
+                                    else:
+                                        saida.detalhe(f"  ✓ Gestão: Dados consistentes")
                         
-                        # 5. Verificar segurados com CPF divergente vinculados a este usuario_id
-                        usuario_id = dados_contrato_usuario['id']
-                        sql_segurados_divergentes = """
-                            SELECT id, cpf_cnpj, nome
-                            FROM segurado
-                            WHERE usuario_id = %s
-                            AND REGEXP_REPLACE(cpf_cnpj, '\D', '', 'g') != %s
-                        """
-                        cur_contrato.execute(sql_segurados_divergentes, (usuario_id, cpf_accounts))
-                        segurados_divergentes = cur_contrato.fetchall()
+                            # 4. Comparar e preparar update para contrato.usuario
+                            dados_contrato_usuario = usuarios_contrato.get(uuid_normalizado)
                         
-                        if segurados_divergentes:
-                            if MODO_DEBUG:
-                                print(f"\n⚠️  SEGURADOS COM CPF DIVERGENTE (serão desvinculados):")
-                                for seg in segurados_divergentes:
-                                    print(f"   Segurado ID: {seg['id']}")
-                                    print(f"   CPF Errado.: {seg['cpf_cnpj']}")
-                                    print(f"   CPF Correto: {formatar_cpf(cpf_accounts)}")
-                                    print(f"   Nome.......: {seg['nome']}")
-                                    print(f"   Ação.......: SET usuario_id = NULL")
-                                    print()
-                            else:
-                                print(f"  → {len(segurados_divergentes)} segurado(s) com CPF divergente para desvincular")
+                            if dados_contrato_usuario:
+                                campos_comparar = ['cpf_cnpj', 'nome', 'email']
+                                divergencias_contrato = calcular_divergencias(accounts_normalizado, dados_contrato_usuario, campos_comparar)
                             
-                            for seg in segurados_divergentes:
-                                lista_desvinculacoes.append({
-                                    'uuid': uuid,
-                                    'segurado_id': seg['id'],
-                                    'cpf_segurado': seg['cpf_cnpj'],
-                                    'cpf_correto': formatar_cpf(cpf_accounts),
-                                    'nome_segurado': seg['nome'],
-                                    'usuario_id': usuario_id
-                                })
-                                contador_desvinculados += 1
-                    
-                    contador_processados += 1
-                    
-                    # Em modo debug, pausa após cada registro
-                    if MODO_DEBUG:
-                        print("\n" + "="*70)
-                        print("📊 RESUMO DAS AÇÕES PARA ESTE REGISTRO:")
-                        if lista_updates_gestao and lista_updates_gestao[-1]['uuid'] == uuid:
-                            print("   ✓ UPDATE em gestao.tb_usuario")
-                        if lista_updates_contrato and lista_updates_contrato[-1]['uuid'] == uuid:
-                            print("   ✓ UPDATE em contrato.usuario")
-                        if any(d['uuid'] == uuid for d in lista_desvinculacoes):
-                            count = sum(1 for d in lista_desvinculacoes if d['uuid'] == uuid)
-                            print(f"   ✓ Desvincular {count} segurado(s)")
-                        if not lista_updates_gestao and not lista_updates_contrato and not any(d['uuid'] == uuid for d in lista_desvinculacoes):
-                            print("   ✅ Nenhuma alteração necessária - Dados consistentes!")
-                        print("="*70)
-                    
-                except Exception as e:
-                    print(f"  ❌ Erro ao processar: {e}")
-                    lista_erros.append({
-                        'uuid': uuid,
-                        'erro': str(e)
-                    })
+                                if divergencias_contrato:
+                                    if MODO_DEBUG:
+                                        print(f"\n⚠️  DIVERGÊNCIAS EM CONTRATO.USUARIO:")
+                                        for campo, (val_correto, val_atual) in divergencias_contrato.items():
+                                            campo_label = {
+                                                'cpf_cnpj': 'CPF',
+                                                'nome': 'Nome',
+                                                'email': 'Email'
+                                            }.get(campo, campo)
+                                        
+                                            if campo == 'cpf_cnpj':
+                                                val_correto = formatar_cpf(val_correto)
+                                                val_atual = formatar_cpf(val_atual)
+                                        
+                                            print(f"   {campo_label}:")
+                                            print(f"      Atual.....: {val_atual or 'N/A'}")
+                                            print(f"      Correto...: {val_correto or 'N/A'}")
+                                    else:
+                                        saida.detalhe(f"  → Contrato.usuario: {len(divergencias_contrato)} campo(s) divergente(s)")
+                                
+                                    planejar(UpdateContrato(
+                                        indice=idx,
+                                        uuid=uuid,
+                                        id_usuario=dados_contrato_usuario['id'],
+                                        cpf_antes=formatar_cpf(dados_contrato_usuario['cpf_cnpj']),
+                                        cpf_depois=cpf_accounts_formatado,
+                                        nome_antes=dados_contrato_usuario['nome'],
+                                        nome_depois=dados_accounts['name'],
+                                        email_antes=dados_contrato_usuario['email'],
+                                        email_depois=dados_accounts['email'],
+                                        divergencias=divergencias_contrato
+                                    ))
+                                else:
+                                    if MODO_DEBUG:
+                                        print(f"\n✅ CONTRATO.USUARIO: Dados consistentes")
+                                    else:
+                                        saida.detalhe(f"  ✓ Contrato.usuario: Dados consistentes")
+                            
+                                # 5. Verificar segurados com CPF divergente vinculados a este usuario_id
+                                usuario_id = dados_contrato_usuario['id']
+                                segurados_divergentes = filtrar_segurados_divergentes(
+                                    segurados_por_usuario.get(usuario_id, []), cpf_accounts
+                                )
+                            
+                                if segurados_divergentes:
+                                    if MODO_DEBUG:
+                                        print(f"\n⚠️  SEGURADOS COM CPF DIVERGENTE (serão desvinculados):")
+                                        for seg in segurados_divergentes:
+                                            print(f"   Segurado ID: {seg['id']}")
+                                            print(f"   CPF Errado.: {seg['cpf_cnpj']}")
+                                            print(f"   CPF Correto: {cpf_accounts_formatado}")
+                                            print(f"   Nome.......: {seg['nome']}")
+                                            print(f"   Ação.......: SET usuario_id = NULL")
+                                            print()
+                                    else:
+                                        saida.detalhe(f"  → {len(segurados_divergentes)} segurado(s) com CPF divergente para desvincular")
+                                
+                                    for seg in segurados_divergentes:
+                                        planejar(Desvinculacao(
+                                            indice=idx,
+                                            uuid=uuid,
+                                            segurado_id=seg['id'],
+                                            cpf_segurado=seg['cpf_cnpj'],
+                                            cpf_correto=cpf_accounts_formatado,
+                                            nome_segurado=seg['nome'],
+                                            usuario_id=usuario_id
+                                        ))
+                        
+                            contador_processados += 1
+                            if estado:
+                                # Ações todas cobertas pelo checkpoint já foram aplicadas em uma execução anterior
+                                resultado = 'CONSISTENTE' if not acoes_registro else 'PLANEJADO' if acoes_no_plano else 'APLICADO'
+                                resultados_estado.append((uuid_normalizado, carga['hashes_accounts'][uuid_normalizado], resultado))
+                        
+                            # Em modo debug, pausa após cada registro
+                            if MODO_DEBUG:
+                                print("\n" + "="*70)
+                                print("📊 RESUMO DAS AÇÕES PARA ESTE REGISTRO:")
+                                novas = {tabela: diario.contadores.get(tabela, 0) - contadores_antes.get(tabela, 0) for tabela in OPERACOES_UPDATE}
+                                if novas['tb_usuario']:
+                                    print("   ✓ UPDATE em gestao.tb_usuario")
+                                if novas['usuario']:
+                                    print("   ✓ UPDATE em contrato.usuario")
+                                if novas['segurado']:
+                                    print(f"   ✓ Desvincular {novas['segurado']} segurado(s)")
+                                if not any(novas.values()):
+                                    print("   ✅ Nenhuma alteração necessária - Dados consistentes!")
+                                print("="*70)
+                        
+                        except Exception as e:
+                            saida.detalhe(f"  ❌ Erro ao processar: {e}")
+                            diario.registrar(ErroRegistro(uuid, str(e), idx))
+                
+                    # Ações do lote confirmadas em disco antes do próximo
+                    diario.sincronizar()
+                    if estado:
+                        estado.registrar_analise(resultados_estado)
+                saida.concluir(idx, diario.contadores, contador_inalterados)
+                
+                if ja_aplicados:
+                    print(f"♻️  {ja_aplicados} ação(ões) já aplicadas (checkpoint) - fora do plano")
+                
+                analise = {
+                    'processados': contador_processados,
+                    'inalterados': contador_inalterados,
+                    'updates_gestao': diario.contadores.get('tb_usuario', 0),
+                    'updates_contrato': diario.contadores.get('usuario', 0),
+                    'desvinculacoes': diario.contadores.get('segurado', 0),
+                    'ignorados': diario.contadores.get('ignorado', 0),
+                    'erros': diario.contadores.get('erro', 0),
+                    'busca_cpf': modo_busca_cpf,
+                    'uuid_validar': uuid_validar,
+                    'ignorados_a_partir_de': ignorados_a_partir_de,
+                    'concluida_em': time.strftime('%Y-%m-%d %H:%M:%S')
+                }
+                diario.concluir({'analise': analise})
+                
+            contador_processados = analise['processados']
+            contador_atualizados_gestao = analise['updates_gestao']
+            contador_atualizados_contrato = analise['updates_contrato']
+            contador_desvinculados = analise['desvinculacoes']
+            modo_busca_cpf = analise['busca_cpf']
+            uuid_validar = analise['uuid_validar']
+            arquivo_plano = caminho_plano(cliente_nome)
+            
+            resumo.update({
+                'processados': contador_processados,
+                'inalterados': analise.get('inalterados', 0),
+                'updates_gestao': contador_atualizados_gestao,
+                'updates_contrato': contador_atualizados_contrato,
+                'desvinculacoes': contador_desvinculados,
+                'ignorados': analise['ignorados'],
+                'erros': analise['erros']
+            })
             
             # Resumo antes da execução
             print("\n" + "="*60)
             print("RESUMO DAS ALTERAÇÕES A SEREM EXECUTADAS")
             print("="*60)
             print(f"Registros processados: {contador_processados}")
+            if MODO_INCREMENTAL:
+                print(f"  - Sem alteração desde a última execução (incremental): {analise.get('inalterados', 0)}")
             print(f"  - Updates em gestao.tb_usuario: {contador_atualizados_gestao}")
             print(f"  - Updates em contrato.usuario: {contador_atualizados_contrato}")
             print(f"  - Desvinculações em segurado: {contador_desvinculados}")
-            print(f"  - Registros ignorados: {len(lista_ignorados)}")
-            print(f"  - Erros: {len(lista_erros)}")
+            print(f"  - Registros ignorados: {analise['ignorados']}")
+            print(f"  - Erros: {analise['erros']}")
+            if analise.get('ignorados_a_partir_de'):
+                print(f"    (ignorados e erros só a partir do registro #{analise['ignorados_a_partir_de']}: retomada sem os dados da execução interrompida)")
+            print(f"  - Conexões remotas abertas (accounts): {contador_conexoes_remotas}")
+            if cache_accounts:
+                print(f"  - Cache de accounts: {cache_accounts.resumo()}")
+            print(f"  - Pool gestao: {pool_gestao.resumo()}")
+            print(f"  - Pool contrato: {pool_contrato.resumo()}")
+            print(f"  - Busca de CPF em segurado: {modo_busca_cpf}")
+            print(f"  - Plano de ações: {os.path.basename(arquivo_plano)} ({formatar_bytes(os.path.getsize(arquivo_plano))} em disco)")
             print("="*60)
             
             # Confirmação do usuário
             if contador_atualizados_gestao == 0 and contador_atualizados_contrato == 0 and contador_desvinculados == 0:
                 print("\n✅ Nenhuma alteração necessária! Todos os dados estão consistentes.")
-                conn_gestao.close()
-                conn_contrato.close()
-                return
+                # Plano sem ações não é guardado: a próxima execução não deve oferecê-lo para aplicar
+                remover_arquivos_plano(cliente_nome)
+                return dict(resumo, status='SEM ALTERAÇÕES')
+            
+            if modo == 'plan':
+                print(f"\n📝 Plano de ações gravado: {arquivo_plano}")
+                print("   Para executá-lo sem repetir a análise: python main.py apply")
+                return dict(resumo, status='PLANO GERADO', plano=arquivo_plano)
             
             if MODO_DEBUG:
                 print("\n" + "="*70)
@@ -747,104 +3302,94 @@ def main():
             else:
                 print("\n⚠️  ATENÇÃO: As alterações serão executadas DIRETAMENTE no banco de dados!")
             
-            resposta = input("\nConfirmar execução dos UPDATEs? (S/N): ").strip().upper()
+            # CONFIRMAR_UPDATES=S/N responde a confirmação sem interação (modo multicliente)
+            METRICAS.iniciar_etapa('Confirmação')
+            resposta = os.getenv('CONFIRMAR_UPDATES', '').strip().upper()
+            if resposta in ('S', 'N'):
+                print(f"\nConfirmar execução dos UPDATEs? (S/N): {resposta} (CONFIRMAR_UPDATES)")
+            else:
+                resposta = input("\nConfirmar execução dos UPDATEs? (S/N): ").strip().upper()
             
             if resposta not in ['S', 'SIM', 'Y', 'YES']:
                 print("\n⚠️  Operação cancelada pelo usuário.")
-                conn_gestao.close()
-                conn_contrato.close()
-                return
+                return dict(resumo, status='SOMENTE ANÁLISE' if resposta == 'N' else 'CANCELADO')
             
             # Execução dos UPDATEs
             print("\n" + "="*60)
             print("ETAPA 3: EXECUÇÃO DOS UPDATES")
             print("="*60)
+            METRICAS.iniciar_etapa('ETAPA 3 - Execução dos UPDATEs')
             
-            # Updates em gestao.tb_usuario
-            if lista_updates_gestao:
-                print(f"\n[Gestão] Executando {len(lista_updates_gestao)} update(s)...")
-                cur_gestao = conn_gestao.cursor()
-                for item in lista_updates_gestao:
-                    try:
-                        sql_update = """
-                            UPDATE tb_usuario
-                            SET cpf_cnpj = %s, name = %s, email = %s, phone = %s, updated_at = NOW()
-                            WHERE sso_id = %s
-                        """
-                        cur_gestao.execute(sql_update, (
-                            item['cpf_depois'].replace('.', '').replace('-', ''),
-                            item['nome_depois'],
-                            item['email_depois'],
-                            item['phone_depois'],
-                            item['uuid']
-                        ))
-                        item['status'] = 'SUCESSO'
-                    except Exception as e:
-                        item['status'] = f'ERRO: {e}'
-                        print(f"  ❌ Erro ao atualizar UUID {item['uuid']}: {e}")
-                
-                conn_gestao.commit()
-                print(f"  ✓ Updates em gestao.tb_usuario concluídos")
-            
-            # Updates em contrato.usuario
-            if lista_updates_contrato:
-                print(f"\n[Contrato] Executando {len(lista_updates_contrato)} update(s)...")
-                cur_contrato = conn_contrato.cursor()
-                for item in lista_updates_contrato:
-                    try:
-                        sql_update = """
-                            UPDATE usuario
-                            SET cpf_cnpj = %s, nome = %s, email = %s, updated_at = NOW()
-                            WHERE sso_id = %s
-                        """
-                        cur_contrato.execute(sql_update, (
-                            item['cpf_depois'].replace('.', '').replace('-', ''),
-                            item['nome_depois'],
-                            item['email_depois'],
-                            item['uuid']
-                        ))
-                        item['status'] = 'SUCESSO'
-                    except Exception as e:
-                        item['status'] = f'ERRO: {e}'
-                        print(f"  ❌ Erro ao atualizar UUID {item['uuid']}: {e}")
-                
-                conn_contrato.commit()
-                print(f"  ✓ Updates em contrato.usuario concluídos")
-            
-            # Desvinculações em segurado
-            if lista_desvinculacoes:
-                print(f"\n[Segurado] Executando {len(lista_desvinculacoes)} desvinculação(ões)...")
-                cur_contrato = conn_contrato.cursor()
-                for item in lista_desvinculacoes:
-                    try:
-                        sql_update = """
-                            UPDATE segurado
-                            SET usuario_id = NULL, updated_at = NOW()
-                            WHERE id = %s
-                        """
-                        cur_contrato.execute(sql_update, (item['segurado_id'],))
-                        item['status'] = 'SUCESSO'
-                    except Exception as e:
-                        item['status'] = f'ERRO: {e}'
-                        print(f"  ❌ Erro ao desvincular segurado {item['segurado_id']}: {e}")
-                
-                conn_contrato.commit()
-                print(f"  ✓ Desvinculações em segurado concluídas")
+            # A confirmação pode ter demorado: verifica as conexões (e reconecta se o túnel caiu)
+            conn_gestao = pool_gestao.renovar(conn_gestao)
+            conn_contrato = pool_contrato.renovar(conn_contrato)
+            
+            print(f"\n[Execução] {contador_atualizados_gestao} update(s) em gestao.tb_usuario, "
+                  f"{contador_atualizados_contrato} em contrato.usuario, {contador_desvinculados} desvinculação(ões) "
+                  f"- COMMIT a cada ~{COMMIT_A_CADA} linha(s)")
+            
+            # As ações são lidas do plano em disco; o status de cada uma vai para o diário de execução
+            diario = DiarioAcoes(caminho_resultado_execucao(cliente_nome))
+            
+            # Itens confirmados antes de uma interrupção continuam nas abas 1 a 3 do relatório
+            recuperados = retomar_executados_checkpoint(cliente_nome, checkpoint, diario.registrar) if checkpoint else 0
+            if recuperados:
+                print(f"♻️  {recuperados} item(ns) executados antes da interrupção mantidos no relatório")
+            # Cópia dos resultados junto ao checkpoint, sincronizada antes de cada gravação do checkpoint
+            executados = DiarioAcoes(caminho_executados_checkpoint(cliente_nome), acrescentar=True)
+            
+            def registrar_resultado(item):
+                diario.registrar(item)
+                executados.registrar(item)
+                if estado:
+                    estado.registrar_execucao(item)
+            
+            # Se a execução for interrompida, a retomada recupera daqui os ignorados e erros dos registros já confirmados
+            salvar_ignorados_checkpoint(cliente_nome, ler_diario(arquivo_plano, ('ignorado', 'erro')))
+            
+            # Queda do túnel no meio de uma janela: o pool restabelece o túnel e devolve uma conexão nova
+            pools = {'gestao': pool_gestao, 'contrato': pool_contrato}
+            conexoes = {'gestao': conn_gestao, 'contrato': conn_contrato}
+            try:
+                totais_execucao, ja_aplicados = aplicar_updates_com_checkpoint(
+                    conexoes, ler_diario(arquivo_plano, OPERACOES_UPDATE), TAMANHO_PAGINA_UPDATE, COMMIT_A_CADA,
+                    cliente_nome, assinatura_relatorio, checkpoint, registrar_resultado,
+                    reconectar=lambda banco, conn: pools[banco].renovar(conn),
+                    sincronizar_resultados=executados.sincronizar
+                )
+            finally:
+                conn_gestao, conn_contrato = conexoes['gestao'], conexoes['contrato']
+                executados.fechar()
+            diario.fechar()
+            if estado:
+                estado.confirmar()
+            
+            if ja_aplicados:
+                print(f"♻️  {ja_aplicados} item(ns) já aplicados (checkpoint) - ignorando")
+            for tabela, (sucessos, erros, conflitos) in totais_execucao.items():
+                if not sucessos and not erros and not conflitos:
+                    continue
+                print(f"  ✓ {OPERACOES_UPDATE[tabela]['descricao']}: {sucessos} sucesso(s), {erros} erro(s), "
+                      f"{conflitos} conflito(s)")
+            resumo['erros_execucao'] = sum(erros for _, erros, _ in totais_execucao.values())
+            resumo['conflitos_execucao'] = sum(conflitos for _, _, conflitos in totais_execucao.values())
+            if resumo['conflitos_execucao']:
+                print(f"⚠️  {resumo['conflitos_execucao']} linha(s) alterada(s) desde a análise não foram atualizadas (status CONFLITO no relatório)")
+            
+            remover_checkpoint(cliente_nome)
             
             # Em modo debug, valida os dados após update
-            if MODO_DEBUG and contador_processados > 0:
+            if MODO_DEBUG and contador_processados > 0 and uuid_validar:
                 print("\n" + "="*70)
                 print("🔍 VALIDAÇÃO PÓS-EXECUÇÃO")
                 print("="*70)
                 
-                uuid_validar = registros[0]['uuid_comum']
-                
                 # Re-busca dados atualizados
-                cur_gestao = conn_gestao.cursor(cursor_factory=RealDictCursor)
+                cur_gestao = conn_gestao.cursor(cursor_factory=cursor_dict_medido())
                 cur_gestao.execute("SELECT cpf_cnpj, name, email, phone FROM tb_usuario WHERE sso_id = %s", (uuid_validar,))
                 dados_gestao_apos = cur_gestao.fetchone()
                 
-                cur_contrato = conn_contrato.cursor(cursor_factory=RealDictCursor)
+                cur_contrato = conn_contrato.cursor(cursor_factory=cursor_dict_medido())
                 cur_contrato.execute("SELECT cpf_cnpj, nome, email FROM usuario WHERE sso_id = %s", (uuid_validar,))
                 dados_contrato_apos = cur_contrato.fetchone()
                 
@@ -862,15 +3407,13 @@ def main():
                 print("\n✅ Validação concluída!")
                 print("="*70)
             
-            conn_gestao.close()
-            conn_contrato.close()
-            
             print("\n✅ Todas as alterações foram executadas com sucesso!")
             
             # Gerar relatório de execução
             print("\n" + "="*60)
             print("ETAPA 4: GERANDO RELATÓRIO DE EXECUÇÃO")
             print("="*60)
+            METRICAS.iniciar_etapa('ETAPA 4 - Relatório')
             
             # Headers para cada aba
             headers_resumo = ['Métrica', 'Valor']
@@ -885,36 +3428,288 @@ def main():
             # Dados do resumo
             dados_resumo = [
                 {'Métrica': 'Total de registros processados', 'Valor': contador_processados},
+                {'Métrica': 'Sem alteração desde a última execução (incremental)', 'Valor': analise.get('inalterados', 0)},
                 {'Métrica': 'Updates em gestao.tb_usuario', 'Valor': contador_atualizados_gestao},
                 {'Métrica': 'Updates em contrato.usuario', 'Valor': contador_atualizados_contrato},
                 {'Métrica': 'Desvinculações em segurado', 'Valor': contador_desvinculados},
-                {'Métrica': 'Registros ignorados', 'Valor': len(lista_ignorados)},
-                {'Métrica': 'Erros encontrados', 'Valor': len(lista_erros)},
+                {'Métrica': 'Registros ignorados', 'Valor': analise['ignorados']},
+                {'Métrica': 'Erros encontrados', 'Valor': analise['erros']},
+                {'Métrica': 'Conexões remotas abertas (accounts)', 'Valor': contador_conexoes_remotas},
+                {'Métrica': 'Cache de accounts', 'Valor': cache_accounts.resumo() if cache_accounts else 'desativado'},
+                {'Métrica': 'Pool gestao', 'Valor': pool_gestao.resumo()},
+                {'Métrica': 'Pool contrato', 'Valor': pool_contrato.resumo()},
+                {'Métrica': 'Busca de CPF em segurado', 'Valor': modo_busca_cpf},
+                {'Métrica': 'Plano de ações', 'Valor': f"{os.path.basename(arquivo_plano)} ({formatar_bytes(os.path.getsize(arquivo_plano))})"},
                 {'Métrica': 'Cliente', 'Valor': cliente_nome},
                 {'Métrica': 'Data/Hora', 'Valor': time.strftime('%Y-%m-%d %H:%M:%S')}
             ]
+            if recuperados:
+                dados_resumo.insert(5, {'Métrica': 'Itens executados antes da interrupção (checkpoint)', 'Valor': recuperados})
+            if analise.get('ignorados_a_partir_de'):
+                dados_resumo.insert(7, {'Métrica': 'Ignorados/erros listados a partir do registro',
+                                        'Valor': f"#{analise['ignorados_a_partir_de']} (retomada sem os dados da execução interrompida)"})
             
             relatorios = {
                 '0-Resumo': (dados_resumo, headers_resumo),
-                '1-Updates Gestão': (lista_updates_gestao, headers_gestao),
-                '2-Updates Contrato': (lista_updates_contrato, headers_contrato),
-                '3-Desvinculações': (lista_desvinculacoes, headers_desvinc),
-                '4-Ignorados': (lista_ignorados, headers_ignorados),
-                '5-Erros': (lista_erros, headers_erros)
+                '1-Updates Gestão': (ler_diario(diario.caminho, ('tb_usuario',)), headers_gestao),
+                '2-Updates Contrato': (ler_diario(diario.caminho, ('usuario',)), headers_contrato),
+                '3-Desvinculações': (ler_diario(diario.caminho, ('segurado',)), headers_desvinc),
+                '4-Ignorados': (ler_diario(arquivo_plano, ('ignorado',)), headers_ignorados),
+                '5-Erros': (ler_diario(arquivo_plano, ('erro',)), headers_erros),
+                # Gerada por último: inclui o tempo das abas anteriores
+                '6-Performance': (METRICAS.linhas_relatorio(), MetricasDesempenho.CABECALHO)
             }
             
             nome_arquivo_relatorio = f'ajuste_executado_{cliente_nome.lower().replace(" ", "_")}.xlsx'
-            salvar_excel_consolidado(relatorios, nome_arquivo_relatorio)
+            # Plano e diário de execução só são descartados depois que o relatório foi gravado
+            if salvar_excel_consolidado(relatorios, nome_arquivo_relatorio):
+                remover_arquivos_plano(cliente_nome)
             
             print("\n" + "="*60)
             print("✅ AJUSTE DE INCONSISTÊNCIAS CONCLUÍDO COM SUCESSO!")
             print("="*60)
+            if analise.get('ignorados_a_partir_de'):
+                print(f"⚠️  As abas 4-Ignorados e 5-Erros listam só os registros a partir do #{analise['ignorados_a_partir_de']} "
+                      f"(retomada sem os dados da execução interrompida)")
+            
+            return dict(resumo, status='CONCLUÍDO', relatorio=nome_arquivo_relatorio)
             
         except Exception as e:
             print(f"\n❌ Erro crítico: {e}")
             print("⚠️  Verifique as conexões e tente novamente.")
-            return
+            return dict(resumo, status=f'ERRO: {e}')
+        finally:
+            if saida:
+                saida.fechar()
+            if diario:
+                diario.fechar()
+            if estado:
+                estado.fechar()
+            if pool_gestao:
+                pool_gestao.fechar()
+            if pool_contrato:
+                pool_contrato.fechar()
+            METRICAS.encerrar_etapa()
+            METRICAS.exibir_resumo()
+            if os.getenv('METRICAS_JSON', 'N').strip().upper() in ('S', 'SIM', 'Y', 'YES'):
+                caminho = METRICAS.salvar_json(caminho_metricas(cliente_nome), {'cliente': cliente_nome, 'modo': modo})
+                if caminho:
+                    print(f"📈 Métricas de desempenho salvas: {caminho}")
 
-if __name__ == "__main__":
-    main()
+# ============================================
+#          MODO MULTICLIENTE (EM LOTE)
+# ============================================
+def selecionar_clientes(nomes):
+    """
+    Retorna [(nome, arquivo_env)] dos clientes informados (pelo NOME_CLIENTE ou pelo
+    sufixo do arquivo .env.*, sem diferenciar maiúsculas) ou de todos, se nomes for vazio.
+    """
+    clientes = listar_clientes()
+    if not nomes:
+        return clientes
+    
+    selecionados = []
+    for nome in nomes:
+        encontrados = [
+            (nome_cliente, arquivo) for nome_cliente, arquivo in clientes
+            if nome.lower() in (nome_cliente.lower(), arquivo.replace('.env.', '').lower())
+        ]
+        if not encontrados:
+            raise ValueError(f"Cliente '{nome}' não encontrado entre os arquivos .env.*")
+        selecionados.extend(c for c in encontrados if c not in selecionados)
+    return selecionados
+
+def reservar_portas_locais(quantidade, porta_inicial):
+    """Retorna `quantidade` portas locais livres a partir de porta_inicial, uma por túnel SSH."""
+    portas = []
+    porta = porta_inicial
+    while len(portas) < quantidade:
+        if verificar_porta_disponivel(porta):
+            portas.append(porta)
+        porta += 1
+    return portas
+
+def executar_cliente_isolado(arquivo_env, nome_cliente, porta_local, confirmar, modo='completo', limite=None):
+    """
+    Executa o ajuste de um cliente em um processo próprio: carrega o .env do cliente,
+    usa um túnel SSH na porta local reservada e grava toda a saída em
+    ajuste_<cliente>.log. Retorna o resumo da execução.
+    """
+    from dotenv import load_dotenv
+    
+    # O processo pode ser reaproveitado para outro cliente: o ambiente é restaurado ao final
+    ambiente_original = dict(os.environ)
+    load_dotenv(arquivo_env, override=True)
+    os.environ['SSH_LOCAL_PORT'] = str(porta_local)
+    os.environ['CONFIRMAR_UPDATES'] = 'S' if confirmar else 'N'
+    if limite is not None:
+        os.environ['LIMITE_REGISTROS'] = str(limite)
+    # Sem operador para responder: não cria o índice de segurado, a menos que o .env peça
+    os.environ.setdefault('CRIAR_INDICE_CPF_SEGURADO', 'N')
+    # Plano de ações de uma análise anterior só é reaproveitado se o .env pedir
+    os.environ.setdefault('REUTILIZAR_PLANO', 'N')
+    
+    caminho_log = os.path.join(os.getcwd(), f'ajuste_{nome_cliente.lower().replace(" ", "_")}.log')
+    inicio = time.time()
+    with open(caminho_log, 'w', encoding='utf-8', buffering=1) as log, open(os.devnull) as entrada_vazia:
+        sys.stdout = sys.stderr = log
+        sys.stdin = entrada_vazia
+        try:
+            resumo = main(modo) or {'status': 'ENCERRADO'}
+        except SystemExit as e:
+            resumo = {'status': f'ERRO (saída {e.code})'}
+        except Exception as e:
+            resumo = {'status': f'ERRO: {e}'}
+        finally:
+            sys.stdout, sys.stderr, sys.stdin = sys.__stdout__, sys.__stderr__, sys.__stdin__
+            os.environ.clear()
+            os.environ.update(ambiente_original)
+    
+    resumo.update({'cliente': nome_cliente, 'arquivo_env': arquivo_env, 'porta_local': porta_local,
+                   'tempo_s': round(time.time() - inicio, 1), 'log': caminho_log})
+    return resumo
+
+def executar_multiclientes(nomes, processos, porta_inicial, confirmar, modo='completo', limite=None):
+    """
+    Processa vários clientes em paralelo, cada um em um processo com a sua
+    configuração, o seu túnel SSH e os seus arquivos de relatório e log.
+    Ao final, exibe e salva o resumo consolidado.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    import multiprocessing
+    
+    try:
+        clientes = selecionar_clientes(nomes)
+    except ValueError as e:
+        print(f"❌ ERRO: {e}")
+        sys.exit(1)
+    if not clientes:
+        print("❌ ERRO: Nenhum arquivo de configuração (.env.*) encontrado!")
+        sys.exit(1)
+    
+    portas = reservar_portas_locais(len(clientes), porta_inicial)
+    processos = max(1, min(processos, len(clientes)))
+    
+    print("\n" + "="*60)
+    print(f" 🔧  AJUSTE MULTICLIENTE - {len(clientes)} cliente(s), {processos} processo(s)")
+    print("="*60)
+    if modo == 'plan':
+        print("UPDATEs: somente análise, com plano de ações gravado (plan)")
+    else:
+        print(f"UPDATEs: {'SERÃO EXECUTADOS (--sim)' if confirmar else 'somente análise (use --sim para executar)'}"
+              f"{' - a partir do plano gravado (apply)' if modo == 'apply' else ''}")
+    for (nome, arquivo), porta in zip(clientes, portas):
+        print(f"  - {nome} ({arquivo}) → túnel na porta local {porta}")
+    
+    resumos = []
+    # spawn: os processos não herdam o estado deste processo (conexões, variáveis carregadas)
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processos, mp_context=contexto) as executor:
+        futuros = {
+            executor.submit(executar_cliente_isolado, arquivo, nome, porta, confirmar, modo, limite): nome
+            for (nome, arquivo), porta in zip(clientes, portas)
+        }
+        for futuro in as_completed(futuros):
+            try:
+                resumo = futuro.result()
+            except Exception as e:
+                resumo = {'cliente': futuros[futuro], 'status': f'ERRO: {e}'}
+            resumos.append(resumo)
+            print(f"[{len(resumos)}/{len(clientes)}] {resumo['cliente']}: {resumo['status']} ({resumo.get('tempo_s', '?')}s)")
+    
+    ordem = {nome: idx for idx, (nome, _) in enumerate(clientes)}
+    resumos.sort(key=lambda r: ordem.get(r['cliente'], len(ordem)))
+    
+    colunas = ['cliente', 'status', 'processados', 'inalterados', 'updates_gestao', 'updates_contrato',
+               'desvinculacoes', 'ignorados', 'erros', 'erros_execucao', 'conflitos_execucao', 'tempo_s', 'relatorio', 'log']
+    print("\n" + "="*60)
+    print("RESUMO CONSOLIDADO")
+    print("="*60)
+    for resumo in resumos:
+        print(f"{resumo['cliente']}: {resumo['status']}")
+        print(f"  processados={resumo.get('processados', '-')} gestao={resumo.get('updates_gestao', '-')} "
+              f"contrato={resumo.get('updates_contrato', '-')} desvinculações={resumo.get('desvinculacoes', '-')} "
+              f"ignorados={resumo.get('ignorados', '-')} erros={resumo.get('erros', '-')} tempo={resumo.get('tempo_s', '-')}s")
+    totais = {coluna: sum(r.get(coluna) or 0 for r in resumos)
+              for coluna in ['processados', 'updates_gestao', 'updates_contrato', 'desvinculacoes', 'ignorados', 'erros']}
+    print("-"*60)
+    print(f"TOTAL: " + ' '.join(f"{coluna}={valor}" for coluna, valor in totais.items()))
+    print("="*60)
+    
+    salvar_excel_consolidado({'0-Clientes': (resumos, colunas)}, 'ajuste_multiclientes.xlsx')
+    
+    return resumos
+
+def executar_cli(argv=None):
+    """
+    Ponto de entrada da linha de comando. Sem terminal (cron, agendador), não há
+    menu nem perguntas: o cliente vem de --cliente, o índice de segurado não é
+    criado, um plano anterior não é reaproveitado e os UPDATEs só são executados
+    com --sim, a menos que o .env responda. Retorna o código de saída (1 se a
+    execução terminou com erro).
+    """
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Ajuste de inconsistências entre accounts, gestao e contrato.')
+    parser.add_argument('acao', nargs='?', choices=['plan', 'apply'],
+                        help='plan: só analisa e grava o plano de ações; apply: executa o plano gravado (padrão: analisa e executa)')
+    parser.add_argument('--modo', '--mode', choices=['completo', 'plan', 'apply'],
+                        help='o mesmo que a ação posicional; completo analisa e executa (padrão)')
+    parser.add_argument('--cliente', '--client', metavar='CLIENTE', help='cliente a processar, sem exibir o menu')
+    parser.add_argument('--todos', action='store_true', help='processa todos os clientes (.env.*) em paralelo, sem menu')
+    parser.add_argument('--clientes', nargs='+', metavar='CLIENTE', help='processa somente os clientes informados, em paralelo')
+    parser.add_argument('--processos', type=int, default=4, help='clientes processados ao mesmo tempo (padrão: 4)')
+    parser.add_argument('--porta-inicial', type=int, default=15435, help='primeira porta local dos túneis SSH (padrão: 15435)')
+    parser.add_argument('--limite', '--limit', type=int, metavar='N',
+                        help='processa só os N primeiros registros (LIMITE_REGISTROS; 0 = todos)')
+    parser.add_argument('--sim', '--yes', '-y', action='store_true', help='executa os UPDATEs sem perguntar')
+    parser.add_argument('--atualizar-cache', action='store_true', help='ignora o cache de accounts e busca tudo de novo no dblink')
+    parser.add_argument('--verbosidade', choices=VERBOSIDADES,
+                        help='saída da análise: detalhado (linhas por registro), progresso (linha única) ou silencioso')
+    args = parser.parse_args(argv)
+    if args.modo and args.acao and args.modo != args.acao:
+        parser.error(f"ação '{args.acao}' e --modo {args.modo} não combinam")
+    modo = args.modo or args.acao or 'completo'
+    if args.limite is not None and args.limite < 0:
+        parser.error('--limite deve ser 0 ou maior')
+    interativo = sys.stdin.isatty()
+    if args.atualizar_cache:
+        os.environ['ATUALIZAR_CACHE_ACCOUNTS'] = 'S'
+    if args.verbosidade:
+        os.environ['VERBOSIDADE'] = args.verbosidade
+    
+    if args.todos or args.clientes:
+        resumos = executar_multiclientes(args.clientes or [], args.processos, args.porta_inicial, args.sim, modo, args.limite)
+        return 1 if any(str(r.get('status', '')).startswith('ERRO') for r in resumos) else 0
+    
+    from dotenv import load_dotenv
+    
+    # Seleciona o cliente e carrega as variáveis de ambiente
+    if args.cliente:
+        try:
+            _, env_file = selecionar_clientes([args.cliente])[0]
+        except ValueError as e:
+            print(f"❌ ERRO: {e}")
+            return 1
+    elif interativo:
+        env_file, _ = exibir_menu_clientes()
+    else:
+        parser.error('sem terminal interativo: informe o cliente com --cliente (ou use --todos/--clientes)')
+    load_dotenv(env_file)
+    
+    # Opções da linha de comando valem mais que o .env
+    if args.limite is not None:
+        os.environ['LIMITE_REGISTROS'] = str(args.limite)
+    if args.sim:
+        os.environ['CONFIRMAR_UPDATES'] = 'S'
+    if not interativo:
+        # Sem ninguém para responder: as perguntas usam a resposta conservadora, se o .env não definir outra
+        os.environ.setdefault('CONFIRMAR_UPDATES', 'N')
+        os.environ.setdefault('REUTILIZAR_PLANO', 'N')
+        os.environ.setdefault('CRIAR_INDICE_CPF_SEGURADO', 'N')
+    
+    resumo = main(modo) or {}
+    return 1 if str(resumo.get('status', '')).startswith('ERRO') else 0
 
+if __name__ == "__main__":
+    sys.exit(executar_cli())
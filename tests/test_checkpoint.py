@@ -0,0 +1,122 @@
+"""
+Checkpoint da ETAPA 3: interrupção no meio da execução, retomada pulando os itens
+confirmados, recuperação dos executados e dos ignorados e remoção ao final.
+Os UPDATEs são simulados (executar_updates_em_lote substituído).
+"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+CLIENTE = 'TESTE'
+ASSINATURA = {'arquivo': 'relatorio.csv', 'tamanho': 1, 'modificado_em': 1, 'limite': 0}
+
+
+def desvinculacao(indice):
+    return main.Desvinculacao(indice, f'uuid-{indice}', indice, '111', '222', 'Nome', 10)
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        anterior = os.getcwd()
+        os.chdir(diretorio.name)
+        self.addCleanup(os.chdir, anterior)
+        patcher = mock.patch('builtins.print')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.executados = []
+
+    def executar_lote(self, interromper_na_chamada=None):
+        chamadas = []
+
+        def executar(conn, tabela, itens, tamanho_pagina):
+            chamadas.append(tabela)
+            if len(chamadas) == interromper_na_chamada:
+                raise RuntimeError('interrupção simulada')
+            for item in itens:
+                item.status = 'SUCESSO'
+            self.executados.extend(item.indice for item in itens)
+            return len(itens), 0, 0
+        return executar
+
+    def aplicar(self, checkpoint, registrar, interromper_na_chamada=None, **opcoes):
+        conexoes = {'gestao': mock.Mock(), 'contrato': mock.Mock()}
+        with mock.patch.object(main, 'executar_updates_em_lote', side_effect=self.executar_lote(interromper_na_chamada)):
+            return main.aplicar_updates_com_checkpoint(
+                conexoes, [desvinculacao(i) for i in range(1, 7)], 100, 2, CLIENTE, ASSINATURA, checkpoint, registrar, **opcoes
+            )
+
+    def test_retomada_pula_confirmados_e_recupera_resultados(self):
+        # Primeira execução: a segunda janela (registros 3 e 4) é interrompida antes do COMMIT
+        checkpoint = {}
+        executados = main.DiarioAcoes(main.caminho_executados_checkpoint(CLIENTE), acrescentar=True)
+        main.salvar_ignorados_checkpoint(CLIENTE, [main.Ignorado('uuid-1', 'CPF vazio em accounts', indice=1),
+                                                   main.ErroRegistro('uuid-5', 'falha', 5)])
+        with self.assertRaises(RuntimeError):
+            self.aplicar(checkpoint, executados.registrar, interromper_na_chamada=2,
+                         sincronizar_resultados=executados.sincronizar)
+        executados.fechar()
+
+        # gestao (sem itens na janela) confirma a segunda janela; contrato fica no registro 2
+        self.assertEqual(main.carregar_checkpoint(CLIENTE, ASSINATURA), {'tb_usuario': 4, 'usuario': 2, 'segurado': 2})
+        self.assertEqual(main.carregar_checkpoint(CLIENTE, dict(ASSINATURA, tamanho=2)), {})
+
+        # Retomada: itens 1 e 2 não são executados de novo, mas voltam para o relatório
+        checkpoint = main.carregar_checkpoint(CLIENTE, ASSINATURA)
+        recuperados = []
+        self.assertEqual(main.retomar_executados_checkpoint(CLIENTE, checkpoint, recuperados.append), 2)
+        self.assertEqual([(item.indice, item.status) for item in recuperados], [(1, 'SUCESSO'), (2, 'SUCESSO')])
+        anteriores = main.carregar_ignorados_checkpoint(CLIENTE, 2)
+        self.assertEqual([(registro.TIPO, registro.indice) for registro in anteriores], [('ignorado', 1)])
+
+        self.executados = []
+        resultados = []
+        totais, ja_aplicados = self.aplicar(checkpoint, resultados.append)
+        self.assertEqual(ja_aplicados, 2)
+        self.assertEqual(self.executados, [3, 4, 5, 6])
+        self.assertEqual(totais['segurado'], (4, 0, 0))
+        self.assertEqual(main.carregar_checkpoint(CLIENTE, ASSINATURA)['segurado'], 6)
+
+        main.remover_checkpoint(CLIENTE)
+        for caminho in (main.caminho_checkpoint(CLIENTE), main.caminho_ignorados_checkpoint(CLIENTE),
+                        main.caminho_executados_checkpoint(CLIENTE)):
+            self.assertFalse(os.path.exists(caminho))
+
+    def test_janela_repetida_apos_queda_da_conexao(self):
+        chamadas = []
+        executar_original = self.executar_lote()
+
+        def executar(conn, tabela, itens, tamanho_pagina):
+            chamadas.append(conn)
+            if len(chamadas) == 2:
+                raise psycopg2.OperationalError('server closed the connection unexpectedly')
+            return executar_original(conn, tabela, itens, tamanho_pagina)
+
+        nova = mock.Mock()
+        reconectar = mock.Mock(return_value=nova)
+        conexoes = {'gestao': mock.Mock(), 'contrato': mock.Mock()}
+        with mock.patch.object(main, 'executar_updates_em_lote', side_effect=executar), \
+                mock.patch.object(main, 'conexao_ativa', return_value=False):
+            totais, _ = main.aplicar_updates_com_checkpoint(
+                conexoes, [desvinculacao(i) for i in range(1, 7)], 100, 2, CLIENTE, ASSINATURA, {}, lambda item: None,
+                reconectar=reconectar
+            )
+
+        reconectar.assert_called_once()
+        self.assertIs(conexoes['contrato'], nova)
+        self.assertEqual(self.executados, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(totais['segurado'], (6, 0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Consultas por lote com UUIDs do relatório que têm espaços nas bordas.
+O cursor é simulado: registra os parâmetros das consultas por sso_id.
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+from uuid import UUID
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+UUIDS = ['0f8fad5b-d9cb-469f-a165-70867728950e', '7c9e6679-7425-40de-944b-e07fc1f90ae7',
+         '16fd2706-8baf-433b-82eb-8c7fada847da']
+
+
+class CursorFalso:
+    """Responde à busca em accounts com todos os UUIDs pedidos; guarda os arrays de sso_id."""
+
+    def __init__(self):
+        self.sso_ids = []
+        self._uuids_accounts = []
+        self._linhas = []
+
+    def mogrify(self, sql, params):
+        self._uuids_accounts = params[0]
+        return sql.encode()
+
+    def execute(self, sql, params=None):
+        if 'dblink' in sql:
+            self._linhas = [{'id': uuid, 'cpf_cnpj': '123.456.789-0' + str(n), 'name': 'Nome', 'email': 'a@b.c', 'phone': None}
+                            for n, uuid in enumerate(self._uuids_accounts)]
+        elif 'sso_id = ANY' in sql:
+            # Literal '{"...","..."}': cada elemento precisa ser um UUID válido para o Postgres
+            elementos = [item.strip('"') for item in params[0].strip('{}').split(',')]
+            for elemento in elementos:
+                if elemento != elemento.strip():
+                    raise main.psycopg2.DataError(f'invalid input syntax for type uuid: "{elemento}"')
+                UUID(elemento)
+            self.sso_ids.append(elementos)
+            self._linhas = []
+        else:
+            self._linhas = []
+
+    def fetchall(self):
+        return self._linhas
+
+
+class TestUuidComEspacos(unittest.TestCase):
+
+    def setUp(self):
+        self.cursor = CursorFalso()
+        conn = mock.Mock()
+        conn.cursor.return_value = self.cursor
+        self.pool = mock.Mock()
+        self.pool.executar.side_effect = lambda funcao, carga: funcao(conn, carga)
+        patcher = mock.patch('builtins.print')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_uuid_com_espacos_nao_derruba_o_lote(self):
+        linhas = [{'uuid_comum': UUIDS[0]}, {'uuid_comum': f'  {UUIDS[1]}\t'}, {'uuid_comum': UUIDS[2]}]
+        lote = list(main.iterar_registros_relatorio(linhas))
+        self.assertEqual([r['uuid_comum'] for r in lote], UUIDS)
+
+        carga = main.estagio_accounts_gestao()(self.pool, {'inicio': 0, 'lote': lote})
+
+        self.assertNotIn('erro', carga)
+        self.assertEqual(len(carga['accounts']), 3)
+        self.assertEqual(sorted(self.cursor.sso_ids[0]), sorted(UUIDS))
+
+    def test_uuid_repetido_com_espacos_e_descartado(self):
+        linhas = [{'uuid_comum': UUIDS[0]}, {'uuid_comum': f' {UUIDS[0].upper()} '}]
+        self.assertEqual(len(list(main.iterar_registros_relatorio(linhas))), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
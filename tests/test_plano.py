@@ -0,0 +1,71 @@
+"""
+Integridade do plano de ações em disco: soma SHA-256 da linha 'fim'.
+"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+CLIENTE = 'TESTE'
+ASSINATURA = {'arquivo': 'relatorio.csv', 'tamanho': 1, 'modificado_em': 1, 'limite': 0}
+
+
+class TestPlanoAcoes(unittest.TestCase):
+
+    def setUp(self):
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        anterior = os.getcwd()
+        os.chdir(diretorio.name)
+        self.addCleanup(os.chdir, anterior)
+        patcher = mock.patch('builtins.print')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.caminho = main.caminho_plano(CLIENTE)
+
+    def gravar_plano(self, concluir=True):
+        diario = main.DiarioAcoes(self.caminho, {'cliente': CLIENTE, 'assinatura': ASSINATURA, 'checkpoint': {}})
+        diario.registrar(main.Desvinculacao(1, 'uuid-1', 10, '111', '222', 'Nome', 5))
+        diario.registrar(main.Ignorado('uuid-2', 'CPF vazio em accounts', indice=2))
+        if concluir:
+            diario.concluir({'analise': {'processados': 2}})
+        else:
+            diario.fechar()
+
+    def test_plano_integro(self):
+        self.gravar_plano()
+        cabecalho, fim = main.verificar_plano(self.caminho)
+        self.assertEqual(cabecalho['cliente'], CLIENTE)
+        self.assertEqual(main.carregar_plano(CLIENTE, ASSINATURA, {}), fim)
+        self.assertEqual([registro.TIPO for registro in main.ler_diario(self.caminho)], ['segurado', 'ignorado'])
+
+    def test_plano_alterado_e_rejeitado(self):
+        self.gravar_plano()
+        with open(self.caminho, encoding='utf-8') as f:
+            linhas = f.readlines()
+        linhas[1] = linhas[1].replace('"222"', '"333"')
+        with open(self.caminho, 'w', encoding='utf-8') as f:
+            f.writelines(linhas)
+
+        with self.assertRaisesRegex(ValueError, 'soma de verificação'):
+            main.verificar_plano(self.caminho)
+        self.assertIsNone(main.carregar_plano(CLIENTE, ASSINATURA, {}))
+
+    def test_plano_incompleto_e_rejeitado(self):
+        self.gravar_plano(concluir=False)
+        with self.assertRaisesRegex(ValueError, 'incompleto'):
+            main.verificar_plano(self.caminho)
+        self.assertIsNone(main.carregar_plano(CLIENTE, ASSINATURA, {}))
+
+    def test_plano_de_outro_relatorio_e_ignorado(self):
+        self.gravar_plano()
+        self.assertIsNone(main.carregar_plano(CLIENTE, dict(ASSINATURA, tamanho=2), {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
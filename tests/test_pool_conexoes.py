@@ -0,0 +1,121 @@
+"""
+Reconexão do PoolConexoes quando o túnel SSH cai no meio de uma consulta.
+O psycopg2.connect é substituído por conexões falsas que dependem do estado do túnel.
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+class TunelFalso:
+    """Túnel que pode ser derrubado; restaurar() o religa, como TunelSSH.restaurar."""
+    
+    def __init__(self):
+        self.ativo = True
+        self.restauracoes = 0
+        self.conexoes = []
+    
+    def restaurar(self):
+        if not self.ativo:
+            self.ativo = True
+            self.restauracoes += 1
+        return True
+    
+    def derrubar(self):
+        self.ativo = False
+        for conn in self.conexoes:
+            conn.closed = 1
+    
+    def conectar(self, *args, **kwargs):
+        if not self.ativo:
+            raise psycopg2.OperationalError("could not connect to server")
+        conn = ConexaoFalsa(self)
+        self.conexoes.append(conn)
+        return conn
+
+
+class CursorFalso:
+    def __init__(self, conn):
+        self.conn = conn
+    
+    def execute(self, sql, params=None):
+        if self.conn.closed:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+    
+    def fetchone(self):
+        return (1,)
+
+
+class ConexaoFalsa:
+    def __init__(self, tunel):
+        self.tunel = tunel
+        self.closed = 0
+        self.info = mock.Mock(transaction_status=psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+    
+    def cursor(self, *args, **kwargs):
+        return CursorFalso(self)
+    
+    def _verificar(self):
+        if self.closed:
+            raise psycopg2.InterfaceError("connection already closed")
+    
+    def commit(self):
+        self._verificar()
+    
+    def rollback(self):
+        self._verificar()
+    
+    def close(self):
+        self.closed = 1
+
+
+class TestReconexaoPool(unittest.TestCase):
+    
+    def setUp(self):
+        self.tunel = TunelFalso()
+        patches = [
+            mock.patch('psycopg2.connect', side_effect=self.tunel.conectar),
+            mock.patch.object(main.time, 'sleep'),
+            mock.patch('builtins.print'),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.pool = main.PoolConexoes('gestao', {'host': '127.0.0.1'}, 2, ao_reconectar=self.tunel.restaurar)
+    
+    def test_tunel_cai_durante_consulta(self):
+        # A conexão principal fica emprestada: a consulta usa a única outra vaga do pool
+        principal = self.pool.obter()
+        chamadas = []
+        
+        def consulta(conn):
+            chamadas.append(conn)
+            if len(chamadas) == 1:
+                self.tunel.derrubar()
+                conn.cursor().execute("SELECT 1")
+            return 'ok'
+        
+        self.assertEqual(self.pool.executar(consulta), 'ok')
+        self.assertEqual(self.tunel.restauracoes, 1)
+        self.assertGreaterEqual(self.pool.stats['reconexoes'], 1)
+        self.assertIsNot(chamadas[0], chamadas[1])
+        self.pool.devolver(principal)
+    
+    def test_banco_indisponivel_esgota_tentativas(self):
+        self.tunel.restaurar = lambda: False
+        self.pool._ao_reconectar = self.tunel.restaurar
+        principal = self.pool.obter()
+        self.tunel.derrubar()
+        with self.assertRaises(psycopg2.OperationalError):
+            self.pool.obter()
+        self.pool.devolver(principal)
+
+
+if __name__ == '__main__':
+    unittest.main()